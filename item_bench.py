@@ -0,0 +1,367 @@
+"""性能基准：生成模拟数据并测量界面各操作背后的数据库调用
+
+在不启动界面的情况下运行，结果保存为 JSON，便于不同版本之间对比：
+    python item_bench.py --sizes 1000 100000 --output bench.json
+    python item_bench.py --sizes 1000000 --repeat 50 --compare bench.json
+
+生成的数据库按行数和随机种子缓存在 --workdir 中，重复运行时不必重新生成。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+from itertools import islice
+
+try:
+    import resource
+except ImportError:  # Windows 上没有，不报告峰值内存
+    resource = None
+
+from item_profile import PROFILER
+from item_store import CATEGORY_ATTRIBUTES, SORT_COLUMNS, ItemQuery, ItemStore
+
+# 各类别所占的比例
+CATEGORY_MIX = {"食品": 0.5, "书籍": 0.3, "工具": 0.2}
+
+# 合成中文文本用的词
+NOUNS = ('大米', '面粉', '食用油', '牛奶', '饼干', '罐头', '方便面', '矿泉水', '小说', '词典', '教材', '绘本',
+         '杂志', '锤子', '螺丝刀', '扳手', '电钻', '卷尺', '梯子', '台灯', '雨伞', '保温杯', '背包', '围巾')
+ADJECTIVES = ('全新', '九成新', '未拆封', '家用', '便携', '大号', '小号', '进口', '国产', '旧款', '经典', '儿童')
+DISTRICTS = ('朝阳区', '海淀区', '东城区', '西城区', '丰台区', '浦东新区', '徐汇区', '天河区', '南山区', '武侯区')
+STREETS = ('建国路', '中山路', '人民路', '解放路', '长安街', '和平路', '学府路', '滨江路')
+SURNAMES = ('王', '李', '张', '刘', '陈', '杨', '赵', '黄', '周', '吴')
+GIVEN_NAMES = ('伟', '芳', '娜', '敏', '静', '磊', '洋', '艳', '勇', '军', '杰', '涛')
+PUBLISHERS = ('人民文学出版社', '商务印书馆', '中华书局', '三联书店', '译林出版社', '科学出版社')
+BRANDS = ('博世', '得力', '史丹利', '世达', '牧田', '长城')
+
+# 导入操作每次导入的物品数，及其重复次数（不超过 --repeat）
+IMPORT_ROWS = 1000
+IMPORT_REPEAT = 20
+
+# 测量的操作（以界面上对应的方法命名）及说明
+OPERATIONS = {
+    'open_store': "冷启动的数据部分：打开数据库（结构检查）和只读连接，读第一页，再关闭",
+    'load_items': "首屏加载（第一页 + 总数）",
+    'search_items': "关键词、类别、属性筛选查询的第一页",
+    'sort_items': "点击列标题排序后的第一页（可带类别，正序或倒序）",
+    'add_item': "添加物品",
+    'save_edits': "修改物品（带版本检查）",
+    'delete_item': "移入回收站",
+    'recover_item': "从回收站恢复",
+    'permanently_delete_item': "永久删除",
+    'import_items': f"向已有数据的表中导入一批物品（每次 {IMPORT_ROWS} 个新物品）",
+}
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+
+
+class ItemGenerator:
+    """按固定随机种子生成可重复的模拟物品记录（与 item_io.validate 的返回值格式相同）"""
+
+    def __init__(self, seed=0, category_mix=None):
+        self.random = random.Random(seed)
+        mix = category_mix or CATEGORY_MIX
+        self.categories = list(mix)
+        self.weights = [mix[category] for category in self.categories]
+        self.today = date(2025, 1, 1)
+
+    def person(self):
+        return self.random.choice(SURNAMES) + ''.join(self.random.choices(GIVEN_NAMES, k=self.random.randint(1, 2)))
+
+    def attributes(self, category):
+        r = self.random
+        if category == "食品":
+            # 保质期集中在前后一年，数量偏小（长尾）
+            return {"保质期": (self.today + timedelta(days=r.randint(-365, 365))).isoformat(),
+                    "数量": min(int(r.expovariate(1 / 8)) + 1, 500)}
+        if category == "书籍":
+            return {"作者": self.person(), "出版社": r.choice(PUBLISHERS)}
+        if category == "工具":
+            return {"品牌": r.choice(BRANDS), "型号": f'{r.choice("ABCDEFGH")}{r.randint(100, 9999)}'}
+        return {key: '' for key in CATEGORY_ATTRIBUTES.get(category, ())}
+
+    def record(self, number):
+        r = self.random
+        category = r.choices(self.categories, self.weights)[0]
+        noun = r.choice(NOUNS)
+        # 序号保证名称与类别的组合不重复
+        name = f'{r.choice(ADJECTIVES)}{noun}{number}'
+        description = f'{r.choice(ADJECTIVES)}的{noun}，{r.choice(("可自取", "可邮寄", "限同城", "先到先得"))}'
+        address = f'{r.choice(DISTRICTS)}{r.choice(STREETS)}{r.randint(1, 999)}号'
+        phone = f'1{r.choice("3578")}{r.randint(0, 999999999):09d}'
+        email = f'user{r.randint(1, 99999)}@example.com'
+        return name, description, address, phone, email, category, self.attributes(category)
+
+    def records(self, count, start=0):
+        for number in range(start, start + count):
+            yield self.record(number)
+
+
+def generate_database(path, count, seed=0, category_mix=None, progress=None):
+    """生成有 count 个物品的数据库文件，另有约 1% 的物品在回收站中"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    generator = ItemGenerator(seed, category_mix)
+    with ItemStore(path, cache_size=0) as store:
+        store.import_items(generator.records(count), batch_size=50000, progress=progress)
+        deleted = generator.random.sample(range(1, count + 1), max(count // 100, 2)) if count >= 2 else []
+        for start in range(0, len(deleted), 10000):
+            store.delete_items(deleted[start:start + 10000])
+        store.vacuum_step(0)
+
+
+def cached_database(workdir, count, seed=0, category_mix=None, progress=None):
+    """返回 count 行模拟数据的数据库路径，缓存中没有时生成"""
+    os.makedirs(workdir, exist_ok=True)
+    mix = '' if category_mix is None else '-' + '-'.join(f'{k}{v}' for k, v in sorted(category_mix.items()))
+    path = os.path.join(workdir, f'bench-{count}-{seed}{mix}.db')
+    if not os.path.exists(path):
+        generate_database(path + '.tmp', count, seed, category_mix, progress)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def percentile(samples, fraction):
+    """已排序样本的百分位数（最近秩法）"""
+    if not samples:
+        return None
+    return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+
+def summarize(samples):
+    """耗时样本（秒）的统计，单位毫秒"""
+    samples = sorted(samples)
+    to_ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    return {'count': len(samples),
+            'mean_ms': to_ms(sum(samples) / len(samples)) if samples else None,
+            'p50_ms': to_ms(percentile(samples, 0.50)),
+            'p95_ms': to_ms(percentile(samples, 0.95)),
+            'p99_ms': to_ms(percentile(samples, 0.99)),
+            'max_ms': to_ms(samples[-1] if samples else None)}
+
+
+def max_rss_kb():
+    """进程的峰值常驻内存（KB）；不支持的平台上为 None"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class Benchmark:
+    """在一个数据库副本上测量各操作，每个操作重复 repeat 次"""
+
+    def __init__(self, path, repeat=100, seed=0):
+        self.path = path
+        self.repeat = repeat
+        self.random = random.Random(seed)
+        self.generator = ItemGenerator(seed + 1)
+        self.store = ItemStore(path)
+        # 与界面相同：列表用只读连接查询，写入用主连接
+        self.view = self.store.reader(cache_size=0)
+
+    def close(self):
+        self.view.close()
+        self.store.close()
+
+    def ids(self, deleted=False):
+        table, clauses = self.store._view(deleted)
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        return [row[0] for row in self.store._execute(f'SELECT t.id FROM {table} AS t{where}')]
+
+    def measure(self, operation, prepare=None, repeat=None):
+        """对 operation(prepare()) 计时 repeat 次（默认为 self.repeat），返回耗时统计
+
+        先执行一次不计时的预热调用，同时用 tracemalloc 记录单次操作的内存分配峰值；
+        计时的调用不开启 tracemalloc，以免影响耗时。
+        """
+        tracemalloc.start()
+        try:
+            operation(prepare() if prepare else None)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        samples = []
+        for _ in range(repeat or self.repeat):
+            argument = prepare() if prepare else None
+            started = time.perf_counter()
+            operation(argument)
+            samples.append(time.perf_counter() - started)
+        result = summarize(samples)
+        result['peak_alloc_kb'] = peak // 1024
+        return result
+
+    def add_items(self, count):
+        """另外添加 count 个物品（在副本上），返回它们的 id"""
+        return [self.store.add_item(*record).added['items'][0]
+                for record in self.generator.records(count, start=3 * 10 ** 9)]
+
+    def run(self):
+        live, deleted = self.ids(), self.ids(True)
+        # 编辑和删除各消耗 repeat + 1 个物品，永久删除消耗 repeat + 1 个回收站物品（都含预热），
+        # 小数据库中原有的不够时先补足，每个操作的样本数都是 repeat
+        live_missing = max(2 * (self.repeat + 1) - len(live), 0)
+        deleted_missing = max(self.repeat + 1 - len(deleted), 0)
+        if live_missing or deleted_missing:
+            added = self.add_items(live_missing + deleted_missing)
+            live += added[:live_missing]
+            if deleted_missing:
+                deleted += self.store.delete_items(added[live_missing:]).added['deleted_items']
+        self.random.shuffle(live)
+        self.random.shuffle(deleted)
+        added = iter(self.generator.records(self.repeat + 1, start=10 ** 9))
+        keywords = [self.random.choice(NOUNS) for _ in range(self.repeat + 1)]
+        searches = iter([ItemQuery(keyword=keyword) for keyword in keywords[:self.repeat // 3]]
+                        + [ItemQuery(category=self.random.choice(list(CATEGORY_MIX)), keyword=keyword)
+                           for keyword in keywords[self.repeat // 3:self.repeat * 2 // 3]]
+                        + [ItemQuery(filters=[("数量", ">", self.random.randint(1, 30))])
+                           for _ in range(self.repeat + 1 - self.repeat * 2 // 3)])
+        sorts = iter([ItemQuery(sort=self.random.choice(list(SORT_COLUMNS)), descending=self.random.random() < 0.5,
+                                category=self.random.choice([None, *CATEGORY_MIX]))
+                      for _ in range(self.repeat + 1)])
+
+        def open_store(_):
+            with ItemStore(self.store.db_file) as store, store.reader() as view:
+                view.page(ItemQuery())
+
+        def load(_):
+            self.view.page(ItemQuery())
+            self.view.count(ItemQuery())
+
+        def search(query):
+            self.view.page(query)
+
+        def add(_):
+            self.store.add_item(*next(added))
+
+        def prepare_edit():
+            return self.view.get_item(live.pop())
+
+        def edit(item):
+            self.store.update_item(item.id, item.name, item.description + '（已修改）', item.address,
+                                   item.contact_phone, item.contact_email, item.category, item.attributes,
+                                   expected_version=item.version)
+
+        recycled = []
+
+        def delete(item_id):
+            recycled.extend(self.store.delete_items([item_id]).added['deleted_items'])
+
+        results = {
+            'open_store': self.measure(open_store),
+            'load_items': self.measure(load),
+            'search_items': self.measure(search, lambda: next(searches)),
+            'sort_items': self.measure(search, lambda: next(sorts)),
+            'add_item': self.measure(add),
+            'save_edits': self.measure(edit, prepare_edit),
+            'delete_item': self.measure(delete, live.pop),
+        }
+        # 恢复上一步刚删除的物品（不会与主列表冲突），永久删除原有的回收站物品
+        results['recover_item'] = self.measure(lambda item_id: self.store.recover_items([item_id]),
+                                               recycled.pop)
+        results['permanently_delete_item'] = self.measure(lambda item_id: self.store.purge_items([item_id]),
+                                                          deleted.pop)
+        # 放在最后，导入的行不影响前面的测量
+        imported = self.generator.records(IMPORT_ROWS * (self.repeat + 1), start=2 * 10 ** 9)
+        results['import_items'] = self.measure(
+            lambda records: self.store.import_items(records, batch_size=IMPORT_ROWS),
+            lambda: list(islice(imported, IMPORT_ROWS)), min(self.repeat, IMPORT_REPEAT))
+        results['import_items']['rows_per_second'] = round(IMPORT_ROWS * 1000 / results['import_items']['mean_ms'])
+        return results
+
+
+def run_size(workdir, count, repeat, seed=0, category_mix=None, keep=False, profile=False):
+    """测量 count 行数据下的各操作；在数据库副本上运行，缓存的数据库不会被修改
+
+    profile 为真时同时开启性能记录，结果中附带各 SQL 语句的统计和慢查询的执行计划。
+    """
+    started = time.perf_counter()
+    source = cached_database(workdir, count, seed, category_mix,
+                             progress=lambda n: print(f"  已生成 {n}/{count} 行", file=sys.stderr))
+    generate_seconds = time.perf_counter() - started
+    path = os.path.join(workdir, f'run-{count}.db')
+    shutil.copyfile(source, path)
+    benchmark = Benchmark(path, repeat, seed)
+    PROFILER.reset()
+    PROFILER.enabled = profile
+    try:
+        operations = benchmark.run()
+    finally:
+        PROFILER.enabled = False
+        benchmark.close()
+        if not keep:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    result = {'rows': count, 'repeat': benchmark.repeat, 'db_bytes': os.path.getsize(source),
+              'setup_seconds': round(generate_seconds, 3), 'operations': operations}
+    if profile:
+        result['profile'] = PROFILER.snapshot()
+    return result
+
+
+def compare(previous, current, threshold=0.2):
+    """与之前的结果比较 p95，返回变慢超过 threshold 的 [(行数, 操作, 之前, 现在)]"""
+    before = {(run['rows'], name): stats['p95_ms'] for run in previous['runs']
+              for name, stats in run['operations'].items()}
+    regressions = []
+    for run in current['runs']:
+        for name, stats in run['operations'].items():
+            old = before.get((run['rows'], name))
+            if old and stats['p95_ms'] is not None and stats['p95_ms'] > old * (1 + threshold):
+                regressions.append((run['rows'], name, old, stats['p95_ms']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="物品复活系统：性能基准")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="各轮的物品数")
+    parser.add_argument('--repeat', type=int, default=200, help="每个操作的重复次数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mix', help='类别比例（JSON），如 {"食品": 0.8, "书籍": 0.2}')
+    parser.add_argument('--workdir', default='bench-data', help="存放生成的数据库")
+    parser.add_argument('--output', help="结果 JSON 文件")
+    parser.add_argument('--compare', help="与之前的结果 JSON 比较，p95 变慢超过 --threshold 时返回非零")
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--keep', action='store_true', help="保留测量后的数据库副本")
+    parser.add_argument('--profile', action='store_true', help="同时记录 SQL 语句统计和慢查询（会略微增加耗时）")
+    args = parser.parse_args(argv)
+
+    mix = json.loads(args.mix) if args.mix else None
+    if mix and set(mix) - set(CATEGORY_ATTRIBUTES):
+        parser.error(f"未知的类别：{'、'.join(set(mix) - set(CATEGORY_ATTRIBUTES))}")
+    report = {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(),
+              'seed': args.seed, 'category_mix': mix or CATEGORY_MIX, 'operations': OPERATIONS, 'runs': []}
+    for count in args.sizes:
+        print(f"{count} 行：", file=sys.stderr)
+        run = run_size(args.workdir, count, args.repeat, args.seed, mix, args.keep, args.profile)
+        report['runs'].append(run)
+        for name, stats in run['operations'].items():
+            rate = f"  {stats['rows_per_second']} 行/秒" if 'rows_per_second' in stats else ''
+            print(f"  {name:<24} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  "
+                  f"p99 {stats['p99_ms']:>9.3f} ms  峰值分配 {stats['peak_alloc_kb']} KB{rate}")
+    rss = max_rss_kb()
+    if rss is not None:
+        report['max_rss_kb'] = rss
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for rows, name, old, new in regressions:
+            print(f"变慢：{rows} 行 {name} p95 {old} ms → {new} ms", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""查找重复物品：同一件捐赠物品以略有不同的名称、手机号写法或描述多次录入时，找出来建议合并
+
+add_item 只拒绝名称和类别都完全相同的物品。这里分三步批量查找近似重复，不做两两比较：
+1. 分块：为每个物品计算若干分块键——规范化的手机号、小写的邮箱，以及名称 bigram 的 MinHash
+   签名分段（LSH）后每段的值。同类别、至少有一个键相同的物品才成为候选对；
+2. 打分：按名称、联系方式、描述、地址的相似度加权，分数达到阈值的候选对视为重复；
+3. 成组：重复的对用并查集连成组，每组建议保留信息最全的一个，其余合并进它（ItemStore.merge_items）。
+
+第 1、2 步在进程池中并行，一百万个物品在多核机器上几分钟内完成。在界面中通过“编辑 → 查找重复
+物品…”查看和合并，也可以在命令行中列出：
+    python item_dedup.py
+    python item_dedup.py --threshold 0.9 --workers 4
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+import zlib
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from item_search import fold, grams
+from item_store import DB_FILE, MERGE_FIELDS, ItemQuery, ItemStore
+
+# MinHash 签名分成 LSH_BANDS 段，每段 LSH_ROWS 个值。两个名称 bigram 的 Jaccard 相似度为 s 时，
+# 成为候选对的概率是 1 - (1 - s^LSH_ROWS)^LSH_BANDS：s = 0.8 时约 0.99，s = 0.3 时约 0.15
+LSH_BANDS = 6
+LSH_ROWS = 3
+
+# MinHash 的各个哈希函数：bigram 的 CRC32 与不同的掩码异或；固定种子，各进程结果一致
+MINHASH_MASKS = tuple(random.Random(23).getrandbits(32) for _ in range(LSH_BANDS * LSH_ROWS))
+
+# 每个物品的分块键个数：手机号、邮箱、各段签名；没有的键记为 0
+KEY_SLOTS = 2 + LSH_BANDS
+
+# 同一个键下的物品超过这个数时不两两比较（公用电话、很常见的名称等），只靠其他键
+MAX_BLOCK = 50
+
+# 打分时各项的权重；某项在两个物品中有一个为空时不计入，其余按权重归一
+WEIGHTS = {'name': 0.5, 'contact': 0.3, 'description': 0.1, 'address': 0.1}
+
+# 分数达到此值才视为重复
+DEFAULT_THRESHOLD = 0.75
+
+# 比较描述时只看前面这么多个字
+DESCRIPTION_PREFIX = 200
+
+# 每个任务处理的物品数和候选对数
+ITEM_CHUNK = 20000
+PAIR_CHUNK = 20000
+
+# 工作进程中的只读连接，由 _open_worker_store 打开
+_worker_store = None
+
+
+class DuplicateGroup:
+    """一组可能重复的物品：items[0] 是建议保留的物品，score 为组内重复对的最低分"""
+
+    def __init__(self, items, score):
+        self.items = items
+        self.score = score
+
+    @property
+    def keep(self):
+        return self.items[0]
+
+    @property
+    def duplicates(self):
+        return self.items[1:]
+
+
+def normalize_phone(phone):
+    """手机号只保留数字并去掉 +86 / 0086 前缀；不足 7 位时视为没有，返回空串"""
+    digits = ''.join(char for char in phone or '' if char.isdigit())
+    if len(digits) > 11 and digits.lstrip('0').startswith('86'):
+        digits = digits.lstrip('0')[2:]
+    return digits if len(digits) >= 7 else ''
+
+
+def normalize_email(email):
+    email = (email or '').strip().lower()
+    return email if '@' in email else ''
+
+
+def minhash(shingles):
+    """shingles 的 MinHash 签名（每个掩码一个值）"""
+    hashes = [_crc(shingle) for shingle in shingles]
+    return [min(map(mask.__xor__, hashes)) for mask in MINHASH_MASKS]
+
+
+def _crc(text):
+    return zlib.crc32(text.encode())
+
+
+def _key(*parts):
+    """分块键：整数元组的 64 位哈希（不为 0）。字符串的内置 hash 在各进程中不同，先换成 CRC32；
+    偶尔冲突只会多出几个候选对，打分时排除"""
+    return hash(parts) & 0xFFFFFFFFFFFFFFFF or 1
+
+
+def block_keys(category, name, contact_phone, contact_email):
+    """一个物品的 KEY_SLOTS 个分块键，都带上类别，不同类别的物品不会成为候选对"""
+    phone = normalize_phone(contact_phone)
+    email = normalize_email(contact_email)
+    category = _crc(category)
+    keys = [_key(0, category, int(phone)) if phone else 0, _key(1, category, _crc(email)) if email else 0]
+    shingles = grams(fold(name), 2)
+    if not shingles:
+        return keys + [0] * LSH_BANDS
+    signature = minhash(shingles)
+    return keys + [_key(2 + band, category, *signature[band * LSH_ROWS:(band + 1) * LSH_ROWS])
+                   for band in range(LSH_BANDS)]
+
+
+def _block_chunk(rows):
+    """工作进程：[(id, 类别, 名称, 手机, 邮箱)] 的分块键，返回 (id 数组, 按行展开的键数组)"""
+    ids, keys = array('q'), array('Q')
+    for item_id, category, name, contact_phone, contact_email in rows:
+        ids.append(item_id)
+        keys.extend(block_keys(category, name, contact_phone, contact_email))
+    return ids, keys
+
+
+def candidate_pairs(ids, keys):
+    """有相同分块键的物品两两组成候选对，返回 {(小 id, 大 id)}"""
+    pairs = set()
+    for slot in range(KEY_SLOTS):
+        column = keys[slot::KEY_SLOTS]
+        # 按键排序后相同的键相邻，逐段取出，不必为百万个键建字典
+        order = sorted((i for i, key in enumerate(column) if key), key=column.__getitem__)
+        for _, block in itertools.groupby(order, key=column.__getitem__):
+            block = list(block)
+            if 1 < len(block) <= MAX_BLOCK:
+                pairs.update(itertools.combinations(sorted(ids[i] for i in block), 2))
+    return pairs
+
+
+def _jaccard(first, second):
+    return len(first & second) / len(first | second) if first and second else 0.0
+
+
+def profile(item):
+    """打分用的规范化形式：(名称 bigram, 名称中的数字, 手机, 邮箱, 描述 bigram, 地址 bigram)"""
+    name = fold(item.name)
+    return (grams(name, 2), ''.join(char for char in name if char.isdigit()),
+            normalize_phone(item.contact_phone), normalize_email(item.contact_email),
+            grams(fold(item.description)[:DESCRIPTION_PREFIX], 2), grams(fold(item.address), 2))
+
+
+def similarity(first, second):
+    """两个物品（profile 的结果）是同一件物品的可能性，0–1"""
+    name_a, digits_a, phone_a, email_a, description_a, address_a = first
+    name_b, digits_b, phone_b, email_b, description_b, address_b = second
+    # 名称中的数字多是型号、规格或编号，数字不同的名称再像也多半不是同一件物品
+    scores = {'name': _jaccard(name_a, name_b) * (1.0 if digits_a == digits_b else 0.5)}
+    if (phone_a or email_a) and (phone_b or email_b):
+        scores['contact'] = float(bool((phone_a and phone_a == phone_b) or (email_a and email_a == email_b)))
+    if description_a and description_b:
+        scores['description'] = _jaccard(description_a, description_b)
+    if address_a and address_b:
+        scores['address'] = _jaccard(address_a, address_b)
+    return sum(WEIGHTS[part] * score for part, score in scores.items()) / sum(WEIGHTS[part] for part in scores)
+
+
+def _score_chunk(pairs, threshold, store=None):
+    """为候选对打分，返回达到阈值的 [(id, id, 分数)]；在工作进程中使用该进程的只读连接"""
+    store = store or _worker_store
+    ids = {item_id for pair in pairs for item_id in pair}
+    profiles = {item.id: profile(item) for _, item in store.fetch(ItemQuery(), ids)}
+    matches = []
+    for first, second in pairs:
+        if first in profiles and second in profiles:
+            score = similarity(profiles[first], profiles[second])
+            if score >= threshold:
+                matches.append((first, second, score))
+    return matches
+
+
+def _open_worker_store(db_file):
+    global _worker_store
+    _worker_store = ItemStore(db_file, readonly=True)
+
+
+def _run(executor, workers, func, tasks, cancel=None):
+    """依次返回 func(*task) 的结果；有进程池时并行，在途的任务不超过工作进程数的两倍，不会一次读入全部数据"""
+    if executor is None:
+        for task in tasks:
+            if cancel is not None and cancel.is_set():
+                return
+            yield func(*task)
+        return
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(func, *task))
+        if len(pending) >= workers * 2:
+            yield pending.popleft().result()
+        if cancel is not None and cancel.is_set():
+            return
+    while pending:
+        yield pending.popleft().result()
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _richness(item):
+    """物品信息的完整程度：非空字段和扩展属性的个数"""
+    return (sum(1 for field in MERGE_FIELDS if getattr(item, field))
+            + sum(1 for value in item.attributes.values() if value not in (None, '')))
+
+
+def find_duplicates(store, threshold=DEFAULT_THRESHOLD, workers=None, progress=None, cancel=None):
+    """查找主列表中可能重复的物品，返回按分数从高到低排列的 [DuplicateGroup]
+
+    workers 为工作进程数，默认等于 CPU 核数；为 1 或物品不足一批时在当前进程中完成，省去启动进程的时间。
+    progress(说明文字) 在每个阶段和每批完成时调用；cancel 是 threading.Event，置位后尽快
+    结束并返回 None。遍历期间一直读着数据库，应在 reader() 得到的只读连接上调用。
+    """
+    workers = workers or os.cpu_count() or 1
+    report = progress or (lambda text: None)
+    if workers > 1 and store.count(ItemQuery()) > ITEM_CHUNK:
+        # 图形界面中从后台线程调用，fork 会复制 Tk 和正在使用的数据库连接，只能用 spawn
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_open_worker_store, initargs=(store.db_file,))
+    else:
+        executor = None
+    try:
+        rows = ((item.id, item.category, item.name, item.contact_phone, item.contact_email)
+                for item in store.iter_items(batch_size=ITEM_CHUNK))
+        ids, keys = array('q'), array('Q')
+        tasks = ((chunk,) for chunk in _chunks(rows, ITEM_CHUNK))
+        for chunk_ids, chunk_keys in _run(executor, workers, _block_chunk, tasks, cancel):
+            ids.extend(chunk_ids)
+            keys.extend(chunk_keys)
+            report(f"正在计算分块键：{len(ids)} 个物品")
+        if cancel is not None and cancel.is_set():
+            return None
+
+        report(f"正在生成候选对：{len(ids)} 个物品")
+        pairs = sorted(candidate_pairs(ids, keys))
+        del ids, keys
+
+        matches, scored = [], 0
+        tasks = ((chunk, threshold) if executor else (chunk, threshold, store) for chunk in _chunks(pairs, PAIR_CHUNK))
+        for chunk_matches in _run(executor, workers, _score_chunk, tasks, cancel):
+            matches += chunk_matches
+            scored = min(scored + PAIR_CHUNK, len(pairs))
+            report(f"正在比较候选对：{scored}/{len(pairs)}")
+        if cancel is not None and cancel.is_set():
+            return None
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    # 并查集把重复的对连成组
+    parent = {}
+
+    def root(item_id):
+        parent.setdefault(item_id, item_id)
+        while parent[item_id] != item_id:
+            parent[item_id] = parent[parent[item_id]]
+            item_id = parent[item_id]
+        return item_id
+
+    for first, second, _ in matches:
+        parent[root(first)] = root(second)
+    members, scores = {}, {}
+    for item_id in parent:
+        members.setdefault(root(item_id), []).append(item_id)
+    for first, _, score in matches:
+        group = root(first)
+        scores[group] = min(scores.get(group, 1.0), score)
+
+    items = {item.id: item for _, item in store.fetch(ItemQuery(), list(parent))}
+    groups = []
+    for group, ids in members.items():
+        group_items = sorted((items[item_id] for item_id in ids if item_id in items),
+                             key=lambda item: (-_richness(item), item.id))
+        if len(group_items) > 1:
+            groups.append(DuplicateGroup(group_items, scores[group]))
+    groups.sort(key=lambda group: (-group.score, group.keep.id))
+    report(f"找到 {len(groups)} 组可能重复的物品")
+    return groups
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="物品复活系统：查找可能重复的物品")
+    parser.add_argument('--db', default=DB_FILE, help="数据库文件路径")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="视为重复的最低分数（0–1）")
+    parser.add_argument('--workers', type=int, default=None, help="工作进程数，默认等于 CPU 核数")
+    args = parser.parse_args(argv)
+
+    with ItemStore(args.db) as store:
+        started = time.perf_counter()
+        groups = find_duplicates(store, args.threshold, args.workers,
+                                 progress=lambda text: print(text, file=sys.stderr))
+        for group in groups:
+            print(json.dumps({'score': round(group.score, 3), 'keep': group.keep.id,
+                              'items': [{'id': item.id, 'name': item.name, 'category': item.category}
+                                        for item in group.items]}, ensure_ascii=False))
+        print(f"用时 {time.perf_counter() - started:.1f} 秒。", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
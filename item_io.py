@@ -0,0 +1,256 @@
+"""物品的批量导入与导出（CSV / JSON Lines）
+
+也可以在命令行中使用：
+    python item_io.py import donations.csv
+    python item_io.py import donations.jsonl --on-duplicate skip
+    python item_io.py export items.csv
+    python item_io.py export recycle.jsonl --deleted
+    python item_io.py export items.csv --chunk-rows 100000
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+from item_store import CATEGORY_ATTRIBUTES, DB_FILE, ItemQuery, ItemStore, attribute_value
+
+# 物品的基本字段，顺序与 ItemStore.import_items 的记录一致（最后还有 attributes）
+BASE_FIELDS = ('name', 'description', 'address', 'contact_phone', 'contact_email', 'category')
+
+# 文件中可使用的列名：英文字段名或界面上的中文列名
+FIELD_ALIASES = {
+    'name': 'name', '名称': 'name',
+    'description': 'description', '描述': 'description',
+    'address': 'address', '地址': 'address',
+    'contact_phone': 'contact_phone', '联系人手机': 'contact_phone',
+    'contact_email': 'contact_email', '联系人邮箱': 'contact_email',
+    'category': 'category', '类别': 'category',
+    'attributes': 'attributes', '扩展属性': 'attributes',
+}
+
+# 所有类别的扩展属性名
+ALL_ATTRIBUTES = tuple(key for keys in CATEGORY_ATTRIBUTES.values() for key in keys)
+
+# 导出文件的列：基本字段、展开后的扩展属性，最后的 attributes 存放不属于已知类别的属性（JSON）
+EXPORT_COLUMNS = ('id',) + BASE_FIELDS + ALL_ATTRIBUTES + ('attributes',)
+
+# 导入时忽略的列（导出文件带有 id，便于原样导回）
+IGNORED_COLUMNS = ('id',)
+
+
+class ImportResult:
+    """一次导入的统计"""
+
+    def __init__(self):
+        self.written = 0  # 写入（新增或覆盖）的行数
+        self.invalid = 0  # 未通过校验而跳过的行数
+        self.errors = []  # [(行号, 原因)]，最多保留 max_errors 条
+
+
+def detect_format(path):
+    """按扩展名判断文件格式"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise ValueError(f'无法识别的文件格式：{path}')
+
+
+def read_records(path, fmt=None):
+    """逐行读取文件，产生 (行号, 记录)；不会把整个文件读入内存
+
+    CSV 的记录是字典，JSON Lines 的记录是该行的原始文本，由 validate 解析，
+    这样一行格式错误只影响这一行。
+    """
+    fmt = fmt or detect_format(path)
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+        elif fmt == 'jsonl':
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_no, line
+        else:
+            raise ValueError(f'不支持的文件格式：{fmt}')
+
+
+def validate(record):
+    """按类别的扩展属性校验一条记录，返回 ItemStore.import_items 所需的元组
+
+    扩展属性既可以放在 attributes 字段（字典或 JSON 文本）中，也可以直接作为列；
+    不属于该类别的属性只允许为空，日期、数字类型的属性统一格式（见 attribute_value）。
+    校验失败时抛出 ValueError。
+    """
+    if isinstance(record, str):
+        record = json.loads(record)
+        if not isinstance(record, dict):
+            raise ValueError('每行必须是一个 JSON 对象')
+    fields = {}
+    attributes = {}
+    for key, value in record.items():
+        if key is None:
+            raise ValueError('列数多于表头')
+        key = key.strip()
+        value = '' if value is None else value
+        if key in IGNORED_COLUMNS:
+            continue
+        if key in FIELD_ALIASES:
+            fields[FIELD_ALIASES[key]] = value
+        elif key in ALL_ATTRIBUTES:
+            attributes[key] = value
+        else:
+            raise ValueError(f'未知的列：{key}')
+
+    extra = fields.pop('attributes', None)
+    if isinstance(extra, str) and extra.strip():
+        extra = json.loads(extra)
+    if extra:
+        if not isinstance(extra, dict):
+            raise ValueError('扩展属性必须是对象')
+        attributes.update(extra)
+
+    name = str(fields.get('name', '')).strip()
+    category = str(fields.get('category', '')).strip()
+    if not name or not category:
+        raise ValueError('缺少必要的字段：名称和类别')
+    if category not in CATEGORY_ATTRIBUTES:
+        raise ValueError(f'未知的类别：{category}')
+
+    allowed = CATEGORY_ATTRIBUTES[category]
+    for key, value in attributes.items():
+        if key not in allowed and str(value).strip():
+            raise ValueError(f'类别“{category}”没有扩展属性“{key}”')
+    attributes = {key: attribute_value(key, str(attributes.get(key, '')).strip()) for key in allowed}
+
+    return (name, *(str(fields.get(field, '')).strip() for field in BASE_FIELDS[1:5]), category, attributes)
+
+
+def import_file(store, path, fmt=None, on_duplicate='update', batch_size=10000, progress=None, max_errors=100):
+    """从 CSV 或 JSON Lines 文件流式导入物品，返回 ImportResult
+
+    无效的行被跳过并记入 result.errors，不影响其余行；progress(已处理的有效行数) 在每批提交后调用。
+    """
+    result = ImportResult()
+
+    def valid_records():
+        for line_no, record in read_records(path, fmt):
+            try:
+                yield validate(record)
+            except ValueError as e:  # json.JSONDecodeError 也是 ValueError
+                result.invalid += 1
+                if len(result.errors) < max_errors:
+                    result.errors.append((line_no, str(e)))
+
+    result.written = store.import_items(valid_records(), on_duplicate=on_duplicate,
+                                        batch_size=batch_size, progress=progress)
+    return result
+
+
+def flatten(item):
+    """把物品展开成导出用的字典：扩展属性各占一列，未知属性以 JSON 放在 attributes 列"""
+    record = {'id': item.id, 'name': item.name, 'description': item.description, 'address': item.address,
+              'contact_phone': item.contact_phone, 'contact_email': item.contact_email,
+              'category': item.category}
+    extra = {}
+    for key, value in item.attributes.items():
+        if key in ALL_ATTRIBUTES:
+            record[key] = value
+        else:
+            extra[key] = value
+    record['attributes'] = json.dumps(extra, ensure_ascii=False) if extra else ''
+    return record
+
+
+def chunk_path(path, number):
+    """分块导出时第 number 块的文件名，如 items-00001.csv"""
+    base, extension = os.path.splitext(path)
+    return f'{base}-{number:05d}{extension}'
+
+
+def export_file(store, path, deleted=False, fmt=None, chunk_rows=None, progress=None, batch_size=1000):
+    """把主列表（或回收站）流式导出到 CSV / JSON Lines 文件，返回导出的行数
+
+    在单独的只读连接上用 fetchmany 逐批读取，内存占用与行数无关。chunk_rows 指定时
+    每 chunk_rows 行写一个文件（见 chunk_path），每个 CSV 文件都带表头。
+    progress(已导出行数, 总行数) 每导出一批调用一次。
+    """
+    fmt = fmt or detect_format(path)
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f'不支持的文件格式：{fmt}')
+    reader = store.reader()
+    f = None
+    try:
+        total = reader.count(ItemQuery(deleted=deleted))
+        exported = 0
+        chunk = 0
+        writer = None
+        for item in reader.iter_items(deleted=deleted, batch_size=batch_size):
+            if f is None or (chunk_rows and exported % chunk_rows == 0 and exported):
+                if f is not None:
+                    f.close()
+                chunk += 1
+                f = open(chunk_path(path, chunk) if chunk_rows else path, 'w', encoding='utf-8', newline='')
+                if fmt == 'csv':
+                    writer = csv.DictWriter(f, fieldnames=EXPORT_COLUMNS)
+                    writer.writeheader()
+            record = flatten(item)
+            if fmt == 'csv':
+                writer.writerow(record)
+            else:
+                f.write(json.dumps({key: value for key, value in record.items() if value != ''},
+                                   ensure_ascii=False) + '\n')
+            exported += 1
+            if progress and exported % batch_size == 0:
+                progress(exported, total)
+        if f is None:
+            # 没有数据时也生成一个（只有表头的）文件
+            f = open(chunk_path(path, 1) if chunk_rows else path, 'w', encoding='utf-8', newline='')
+            if fmt == 'csv':
+                csv.DictWriter(f, fieldnames=EXPORT_COLUMNS).writeheader()
+        if progress:
+            progress(exported, total)
+        return exported
+    finally:
+        if f is not None:
+            f.close()
+        reader.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="物品复活系统：批量导入与导出")
+    parser.add_argument('--db', default=DB_FILE, help="数据库文件路径")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help="从 CSV / JSON Lines 文件导入物品")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=('csv', 'jsonl'), help="默认按扩展名判断")
+    import_parser.add_argument('--on-duplicate', choices=('update', 'skip'), default='update',
+                               help="同名同类别物品已存在时覆盖（update）或保留原物品（skip）")
+    import_parser.add_argument('--batch-size', type=int, default=10000)
+
+    export_parser = commands.add_parser('export', help="把物品导出为 CSV / JSON Lines 文件")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--format', choices=('csv', 'jsonl'), help="默认按扩展名判断")
+    export_parser.add_argument('--deleted', action='store_true', help="导出回收站而不是主列表")
+    export_parser.add_argument('--chunk-rows', type=int, help="每个文件最多的行数，超过时分成多个文件")
+
+    args = parser.parse_args(argv)
+    with ItemStore(args.db) as store:
+        if args.command == 'import':
+            result = import_file(store, args.path, args.format, args.on_duplicate, args.batch_size,
+                                 progress=lambda n: print(f"已处理 {n} 行", file=sys.stderr))
+            for line_no, message in result.errors:
+                print(f"第 {line_no} 行：{message}", file=sys.stderr)
+            print(f"写入 {result.written} 个物品，跳过无效行 {result.invalid} 行。")
+        elif args.command == 'export':
+            exported = export_file(store, args.path, args.deleted, args.format, args.chunk_rows,
+                                   progress=lambda done, total: print(f"已导出 {done}/{total} 行", file=sys.stderr))
+            print(f"导出 {exported} 个物品。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""可选的性能记录：按操作统计耗时（SQL、JSON 解析、表格插入）、慢查询及其执行计划
+
+默认关闭，关闭时各埋点只多一次属性判断。开启方式：
+    ITEMS_PROFILE=1 python items-revival.py          # 启动时开启，慢查询阈值用 ITEMS_SLOW_QUERY_MS 设置
+或在界面菜单“设置 → 性能诊断…”中开启。统计结果可用 PROFILER.snapshot() 取得，或 dump 为 JSON 文件。
+
+一个“操作”（如添加物品）可能跨越多个线程：界面线程发起，后台线程执行 SQL，再回到界面线程
+刷新表格。发起时 begin，转交给其他线程前 hold，其他线程在 resume 中工作，完成后 release；
+所有持有者都释放后该操作结束。操作的总耗时从开始算到最后一段被计时的工作（SQL、JSON 解析或
+表格插入）结束为止，之后弹出的提示框等待用户点击的时间不计入。
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+# 分别计时的几类工作
+TIMED_KINDS = ('sql', 'json', 'tree')
+
+# 慢查询的默认阈值（毫秒）
+SLOW_QUERY_MS = 50
+
+# 保留的慢查询条数
+SLOW_QUERY_LOG = 100
+
+# 分别统计的不同 SQL 语句数上限，超出的归入 OTHER_STATEMENTS
+MAX_STATEMENTS = 500
+OTHER_STATEMENTS = '（其他语句）'
+
+# 不属于任何操作的 SQL 等计入此名下
+UNATTRIBUTED = '（未归类）'
+
+# 可以取执行计划的语句
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+_NULL = nullcontext()
+
+
+class Action:
+    """一次操作的计时"""
+
+    __slots__ = ('name', 'started', 'finished', 'holders', 'seconds', 'statements', 'rows')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = self.finished = time.perf_counter()  # finished：最后一段计时工作结束的时间
+        self.holders = 1
+        self.seconds = dict.fromkeys(TIMED_KINDS, 0.0)
+        self.statements = 0
+        self.rows = 0
+
+
+class ActionStats:
+    """同名操作的累计统计"""
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.max_wall = 0.0
+        self.seconds = dict.fromkeys(TIMED_KINDS, 0.0)
+        self.statements = 0
+        self.rows = 0
+
+    def add(self, action, wall):
+        self.count += 1
+        self.wall += wall
+        self.max_wall = max(self.max_wall, wall)
+        for kind, seconds in action.seconds.items():
+            self.seconds[kind] += seconds
+        self.statements += action.statements
+        self.rows += action.rows
+
+    def as_dict(self):
+        to_ms = lambda seconds: round(seconds * 1000, 3)
+        result = {'count': self.count, 'wall_ms': to_ms(self.wall), 'mean_ms': to_ms(self.wall / self.count),
+                  'max_ms': to_ms(self.max_wall)}
+        for kind, seconds in self.seconds.items():
+            result[f'{kind}_ms'] = to_ms(seconds)
+        # 其余时间：Python 逻辑、等待锁、在后台队列中排队、界面事件等
+        result['other_ms'] = to_ms(max(self.wall - sum(self.seconds.values()), 0))
+        result['statements'] = self.statements
+        result['rows'] = self.rows
+        return result
+
+
+class StatementStats:
+    """同一条 SQL 语句的累计统计"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+
+    def as_dict(self, sql):
+        return {'sql': sql, 'count': self.count, 'total_ms': round(self.seconds * 1000, 3),
+                'mean_ms': round(self.seconds * 1000 / self.count, 3), 'max_ms': round(self.max_seconds * 1000, 3),
+                'rows': self.rows}
+
+
+class ProfiledCursor:
+    """包装 sqlite3.Cursor：执行和逐行读取的时间都计入 SQL 时间，读完（或只取一行）时记入统计"""
+
+    def __init__(self, profiler, conn, sql, params):
+        self._profiler = profiler
+        self._conn = conn
+        self._sql = sql
+        self._params = params
+        self._rows = 0
+        self._done = False
+        self._action = profiler.current()
+        started = time.perf_counter()
+        try:
+            self._cursor = conn.execute(sql, params)
+        finally:
+            self._seconds = time.perf_counter() - started
+        if self._cursor.description is None:
+            # 不返回行的语句（INSERT、UPDATE 等）执行完即结束
+            self._finish(max(self._cursor.rowcount, 0))
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = next(self._cursor)
+        except StopIteration:
+            self._seconds += time.perf_counter() - started
+            self._finish()
+            raise
+        self._seconds += time.perf_counter() - started
+        self._rows += 1
+        return row
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._seconds += time.perf_counter() - started
+        self._rows += row is not None
+        self._finish()
+        return row
+
+    def fetchmany(self, size):
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(size)
+        self._seconds += time.perf_counter() - started
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._seconds += time.perf_counter() - started
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def _finish(self, rows=0):
+        if self._done:
+            return
+        self._done = True
+        self._profiler.record_statement(self._action, self._conn, self._sql, self._params, self._seconds,
+                                        self._rows + rows)
+
+
+class Profiler:
+    """全局的性能记录器，线程安全；enabled 为假时所有方法都几乎不做事"""
+
+    def __init__(self, enabled=False, slow_query_ms=SLOW_QUERY_MS):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """清空已记录的统计"""
+        with self._lock:
+            self.actions = {}  # 操作名 -> ActionStats
+            self.statements = {}  # SQL -> StatementStats
+            self.slow_queries = deque(maxlen=SLOW_QUERY_LOG)
+            self.since = time.time()
+
+    # ---- 操作 ----
+
+    def current(self):
+        """本线程当前所属的操作，没有时为 None"""
+        return getattr(self._local, 'action', None)
+
+    def begin(self, name):
+        """开始一个操作，返回 Action（关闭时返回 None）；须由 release 结束"""
+        return Action(name) if self.enabled else None
+
+    def hold(self):
+        """把本线程当前的操作转交给其他线程继续时调用，返回该操作（或 None），之后须 release"""
+        action = self.current()
+        if action is not None:
+            with self._lock:
+                action.holders += 1
+        return action
+
+    def resume(self, action):
+        """在本线程中以 action 的名义工作（action 为 None 时不做任何事）"""
+        return _NULL if action is None else self._resumed(action)
+
+    @contextmanager
+    def _resumed(self, action):
+        previous = self.current()
+        self._local.action = action
+        try:
+            yield action
+        finally:
+            self._local.action = previous
+
+    def release(self, action):
+        """释放对操作的持有，最后一个持有者释放时记入统计"""
+        if action is None:
+            return
+        with self._lock:
+            action.holders -= 1
+            if action.holders:
+                return
+            stats = self.actions.get(action.name)
+            if stats is None:
+                stats = self.actions[action.name] = ActionStats()
+            stats.add(action, action.finished - action.started)
+
+    def record(self, name, started):
+        """把从 started（time.perf_counter() 的值）到现在记为一次名为 name 的操作，如启动到首屏画出"""
+        if self.enabled:
+            action = Action(name)
+            action.started = started
+            self.release(action)
+
+    def action(self, name):
+        """上下文管理器：其中的工作计入名为 name 的操作"""
+        return self._action(name) if self.enabled else _NULL
+
+    @contextmanager
+    def _action(self, name):
+        action = self.begin(name)
+        try:
+            with self._resumed(action):
+                yield action
+        finally:
+            self.release(action)
+
+    def profile(self, name=None):
+        """装饰器：每次调用函数都作为一次操作记录，默认以函数名为操作名；已在某个操作中时计入该操作"""
+        def decorator(func):
+            action_name = name or func.__name__
+
+            def wrapper(*args, **kwargs):
+                if not self.enabled or self.current() is not None:
+                    return func(*args, **kwargs)
+                with self._action(action_name):
+                    return func(*args, **kwargs)
+            wrapper.__name__, wrapper.__doc__ = func.__name__, func.__doc__
+            return wrapper
+        return decorator
+
+    # ---- 计时 ----
+
+    def timed(self, kind):
+        """上下文管理器：其中的时间计入当前操作的 kind 类（见 TIMED_KINDS）"""
+        return self._timed(kind) if self.enabled else _NULL
+
+    @contextmanager
+    def _timed(self, kind):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            action = self.current()
+            if action is not None:
+                action.finished = time.perf_counter()
+                action.seconds[kind] += action.finished - started
+
+    def execute(self, conn, sql, params=()):
+        """代替 conn.execute 执行并计时，返回的游标用法不变"""
+        return ProfiledCursor(self, conn, sql, params)
+
+    def record_statement(self, action, conn, sql, params, seconds, rows):
+        if action is not None:
+            action.finished = time.perf_counter()
+            action.seconds['sql'] += seconds
+            action.statements += 1
+            action.rows += rows
+        key = ' '.join(sql.split())
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                if len(self.statements) >= MAX_STATEMENTS:
+                    key = OTHER_STATEMENTS
+                stats = self.statements.setdefault(key, StatementStats())
+            stats.count += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += rows
+        if seconds * 1000 >= self.slow_query_ms:
+            self.slow_queries.append({
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'action': action.name if action is not None else UNATTRIBUTED,
+                'sql': key, 'ms': round(seconds * 1000, 3), 'rows': rows,
+                'plan': self.explain(conn, sql, params),
+            })
+
+    @staticmethod
+    def explain(conn, sql, params):
+        """语句的 EXPLAIN QUERY PLAN，每行一个步骤，按层级缩进"""
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return []
+        try:
+            rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        except sqlite3.Error as e:
+            return [f'（无法取得执行计划：{e}）']
+        depth = {0: -1}
+        lines = []
+        for node, parent, _, detail in rows:
+            depth[node] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node] + detail)
+        return lines
+
+    # ---- 结果 ----
+
+    def snapshot(self):
+        """当前统计的字典（可直接序列化为 JSON）"""
+        with self._lock:
+            actions = {name: stats.as_dict() for name, stats in self.actions.items()}
+            statements = sorted(((sql, stats) for sql, stats in self.statements.items()),
+                                key=lambda entry: entry[1].seconds, reverse=True)
+            return {'enabled': self.enabled, 'slow_query_ms': self.slow_query_ms,
+                    'since': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.since)),
+                    'actions': actions,
+                    'statements': [stats.as_dict(sql) for sql, stats in statements],
+                    'slow_queries': list(self.slow_queries)}
+
+    def dump(self, path):
+        """把统计写入 JSON 文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+
+def _env_slow_query_ms():
+    value = os.environ.get('ITEMS_SLOW_QUERY_MS', '')
+    return float(value) if re.fullmatch(r'\d+(\.\d+)?', value) else SLOW_QUERY_MS
+
+
+# 进程内唯一的记录器，数据层和界面都向它报告
+PROFILER = Profiler(enabled=os.environ.get('ITEMS_PROFILE') == '1', slow_query_ms=_env_slow_query_ms())
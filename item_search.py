@@ -0,0 +1,470 @@
+"""拼音与模糊查找：预先计算物品的规范化形式，建立 n-gram 倒排索引
+
+规范化形式包括：名称（繁体转简体、全角转半角、小写）、名称的全拼和拼音首字母（需要安装
+可选的 pypinyin）、联系人手机中的数字、小写的联系人邮箱。查询时按与关键词共有的 n-gram
+比例排序，能容忍少量错字，例如“dm”“dami”“大迷”都能找到“大米”。
+
+索引常驻内存，并保存在数据库旁的 <数据库文件>-search 文件中，启动时直接载入；之后按
+change_log 增量同步，不必重建。也可以在命令行中使用：
+    python item_search.py build              # 重建索引
+    python item_search.py query dami         # 查找并显示耗时
+"""
+import argparse
+import functools
+import heapq
+import importlib.util
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+from item_store import DB_FILE, ItemQuery, ItemStore
+
+# 没有 pypinyin 时不支持拼音查找，其余照常；它载入约需 0.3 秒，推迟到第一次用到时
+# （通常在后台载入索引时），不拖慢程序启动
+HAS_PINYIN = importlib.util.find_spec('pypinyin') is not None
+
+# 索引格式的版本，改变索引内容时加一，旧的索引文件会被重建
+INDEX_VERSION = 2
+
+# 一次查找最多返回的物品数
+SEARCH_LIMIT = 1000
+
+# 与关键词共有的 n-gram 至少占关键词 n-gram 的比例，低于此比例的物品不算匹配
+MIN_SCORE = 0.5
+
+# 出现在超过这一比例的物品中的 n-gram 视为常见，部分匹配打分时忽略
+STOP_FRACTION = 0.05
+
+# 求完全匹配时每段比较的 id 数
+EXACT_CHUNK = 4096
+
+EMPTY = array('I')
+
+# 增量同步时一次读取的物品数
+SYNC_BATCH = 500
+
+# 常见繁体字到简体字的对照（成对排列）；不求完整，覆盖物品名称和姓氏中常见的字
+TRADITIONAL_PAIRS = (
+    '書书機机電电腦脑車车門门開开關关長长東东國国語语說说話话讀读寫写學学習习會会們们來来時时間间問问'
+    '題题點点燈灯鐘钟錶表筆笔紙纸畫画線线網网絡络號号碼码盤盘鍋锅壺壶襪袜褲裤帶带傘伞鑰钥鏡镜錢钱銀银'
+    '鐵铁銅铜鋼钢鋁铝錘锤鑽钻絲丝釘钉鋸锯麵面飯饭餅饼乾干糧粮雞鸡魚鱼鳥鸟豬猪蘋苹蔔卜湯汤醬酱鹽盐飲饮'
+    '礦矿頭头櫃柜爐炉熱热風风視视聽听響响樂乐遊游戲戏兒儿體体藥药醫医療疗護护膚肤髮发潔洁淨净濕湿條条'
+    '塊块張张雙双對对組组個个隻只輛辆臺台萬万億亿歲岁價价買买賣卖貨货質质寶宝貝贝紅红綠绿藍蓝黃黄舊旧'
+    '壞坏優优廠厂區区縣县鄉乡鎮镇樓楼層层廣广場场園园館馆圖图華华陽阳陰阴雲云龍龙鳳凤進进遠远運运達达'
+    '選选邊边過过還还這这與与為为從从眾众無无愛爱歡欢氣气現现發发錄录韓韩漢汉灣湾劉刘陳陈楊杨趙赵吳吴'
+    '鄭郑孫孙馬马羅罗謝谢馮冯許许鄧邓蕭萧葉叶閻阎蔣蒋賈贾盧卢顧顾龔龚嚴严譚谭陸陆寶宝膠胶裝装燒烧煙烟'
+    '餘余黨党塵尘隊队嬰婴級级錯错鬧闹衛卫導导總总厲厉勢势雜杂縫缝補补釣钓輪轮軟软轉转燈灯鋪铺'
+)
+TRADITIONAL = dict(zip(TRADITIONAL_PAIRS[0::2], TRADITIONAL_PAIRS[1::2]))
+
+
+def fold(text):
+    """统一字形：全角转半角、繁体转简体、英文小写，只保留文字和数字"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return ''.join(TRADITIONAL.get(char, char) for char in text if char.isalnum())
+
+
+def is_han(char):
+    return '一' <= char <= '鿿' or '㐀' <= char <= '䶿'
+
+
+@functools.lru_cache(maxsize=None)
+def _lazy_pinyin():
+    from pypinyin import lazy_pinyin
+    return lazy_pinyin
+
+
+def pinyin_forms(text):
+    """名称的 (全拼, 拼音首字母)，非汉字原样保留；没有 pypinyin 时为空"""
+    if not HAS_PINYIN or not any(is_han(char) for char in text):
+        return '', ''
+    # 非汉字逐字拆开，使首字母中保留其中的字母和数字
+    syllables = _lazy_pinyin()(text, errors=list)
+    return ''.join(syllables), ''.join(syllable[0] for syllable in syllables if syllable)
+
+
+def grams(text, size):
+    """text 的全部 size 字 n-gram（去重）；text 不足 size 字时就是它本身"""
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def document_grams(name, contact_phone, contact_email):
+    """一个物品在索引中的全部 n-gram；前缀区分来源，不同来源互不干扰"""
+    folded = fold(name)
+    full, initials = pinyin_forms(folded)
+    digits = ''.join(char for char in contact_phone or '' if char.isdigit())
+    email = (contact_email or '').strip().lower()
+    return ({'c' + gram for gram in grams(folded, 2)}
+            | {'p' + gram for gram in grams(full, 3)}
+            | {'i' + gram for gram in grams(initials, 2)}
+            | {'n' + gram for gram in grams(digits, 3)}
+            | {'e' + gram for gram in grams(email, 3)})
+
+
+def query_channels(keyword):
+    """关键词按各种可能的含义拆成 n-gram，返回 [n-gram 集合]，每组单独打分，取最高分"""
+    folded = fold(keyword)
+    channels = [{'c' + gram for gram in grams(folded, 2)}]
+    if folded.isascii():
+        # 字母数字可能是拼音、拼音首字母、手机号或邮箱
+        channels.append({'p' + gram for gram in grams(folded, 3)})
+        channels.append({'i' + gram for gram in grams(folded, 2)})
+        if folded.isdigit():
+            channels.append({'n' + gram for gram in grams(folded, 3)})
+        channels.append({'e' + gram for gram in grams(keyword.strip().lower(), 3)})
+    else:
+        # 汉字关键词也按拼音比较，可以找到同音的错别字
+        full, _ = pinyin_forms(folded)
+        if full:
+            channels.append({'p' + gram for gram in grams(full, 3)})
+    return [channel for channel in channels if channel]
+
+
+def index_path(db_file):
+    return db_file + '-search'
+
+
+class SearchIndex:
+    """内存中的倒排索引：n-gram -> 升序的物品 id 数组；只索引主列表中的物品
+
+    所有方法都可以从任意线程调用。open() 在后台线程中载入或建立索引，完成前 search 返回 None，
+    调用方应改用普通查找。
+    """
+
+    def __init__(self, store, path=None):
+        self.reader = store.reader()
+        self.path = path or index_path(store.db_file)
+        self.ready = False
+        self.error = None  # 载入或建立失败时的异常
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._seq = 0  # 已同步到的 change_log 序号
+        self._size = 0  # 已索引的物品数
+        self._dirty_grams = set()  # 尚未保存的 n-gram
+        self._documents = {}  # 尚未保存的物品字段：id -> (名称, 手机, 邮箱)，已删除为 None
+        self._conn = None
+        self._last = (None, None)  # 上一次查找的 (关键词, 结果)，同一查询的分页和计数不必重复计算
+
+    # ---- 载入与保存 ----
+
+    def open(self, background=True):
+        """载入索引文件并同步；文件不存在或已过时则重建"""
+        if background:
+            threading.Thread(target=self.open, args=(False,), daemon=True).start()
+            return
+        try:
+            with self._lock:
+                self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                self._conn.execute('PRAGMA journal_mode = WAL')
+                self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+                meta = dict(self._conn.execute('SELECT key, value FROM meta'))
+                current = meta.get('format') == self._format()
+                if not current:
+                    self._conn.execute('DROP TABLE IF EXISTS postings')
+                    self._conn.execute('DROP TABLE IF EXISTS documents')
+                self._conn.execute('CREATE TABLE IF NOT EXISTS postings (gram TEXT PRIMARY KEY, ids BLOB)')
+                # 各物品建索引时的字段，修改后据此找出要从倒排表中删去的旧 n-gram
+                self._conn.execute('CREATE TABLE IF NOT EXISTS documents '
+                                   '(id INTEGER PRIMARY KEY, name TEXT, contact_phone TEXT, contact_email TEXT)')
+                # 索引的序号比数据库的还大，说明数据库文件已被替换，须重建
+                if current and int(meta.get('seq', 0)) <= self.reader.last_change():
+                    self._load(int(meta['seq']))
+                    if self._apply_changes():
+                        self.save()
+                    else:
+                        self.rebuild()
+                else:
+                    self.rebuild()
+                self.ready = True
+        except (sqlite3.Error, OSError) as e:
+            self.error = e
+
+    @staticmethod
+    def _format():
+        return f'{INDEX_VERSION}{"+pinyin" if HAS_PINYIN else ""}'
+
+    def _load(self, seq):
+        postings = {}
+        for gram, blob in self._conn.execute('SELECT gram, ids FROM postings'):
+            ids = array('I')
+            ids.frombytes(blob)
+            postings[gram] = ids
+        self._postings = postings
+        self._seq = seq
+        self._size = self._conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def rebuild(self, progress=None):
+        """按主列表的全部物品重建索引并保存；progress(已处理物品数) 每一万个调用一次"""
+        with self._lock:
+            # 先取序号再读物品：期间提交的修改会在下次同步时重放，重复应用是安全的
+            seq = self.reader.last_change()
+            postings = {}
+            documents = []
+            for count, item in enumerate(self.reader.iter_items(), start=1):
+                fields = (item.name, item.contact_phone, item.contact_email)
+                for gram in document_grams(*fields):
+                    ids = postings.get(gram)
+                    if ids is None:
+                        ids = postings[gram] = array('I')
+                    ids.append(item.id)  # iter_items 按 id 升序，数组天然有序
+                documents.append((item.id, *fields))
+                if progress and count % 10000 == 0:
+                    progress(count)
+            self._conn.execute('BEGIN')
+            self._conn.execute('DELETE FROM postings')
+            self._conn.execute('DELETE FROM documents')
+            self._conn.executemany('INSERT INTO postings VALUES (?, ?)',
+                                   ((gram, ids.tobytes()) for gram, ids in postings.items()))
+            self._conn.executemany('INSERT INTO documents VALUES (?, ?, ?, ?)', documents)
+            self._write_meta(seq)
+            self._conn.execute('COMMIT')
+            self._postings = postings
+            self._seq = seq
+            self._size = len(documents)
+            self._dirty_grams.clear()
+            self._documents.clear()
+            self._last = (None, None)
+
+    def _write_meta(self, seq):
+        self._conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                               (('format', self._format()), ('seq', str(seq))))
+
+    def save(self):
+        """把增量同步后变化的部分写入索引文件
+
+        同一数据库的多个程序共用索引文件：文件已被同步得更新的程序保存过时不写，
+        以免用较旧的内容覆盖；文件中的序号因此只增不减。
+        """
+        with self._lock:
+            if self._conn is None or not (self._dirty_grams or self._documents):
+                return
+            self._conn.execute('BEGIN IMMEDIATE')
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+            if row and int(row[0]) > self._seq:
+                self._conn.execute('ROLLBACK')
+                return
+            self._conn.executemany('INSERT OR REPLACE INTO postings VALUES (?, ?)',
+                                   ((gram, self._postings[gram].tobytes()) for gram in self._dirty_grams
+                                    if gram in self._postings))
+            self._conn.executemany('DELETE FROM postings WHERE gram = ?',
+                                   ((gram,) for gram in self._dirty_grams if gram not in self._postings))
+            self._conn.executemany('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)',
+                                   ((item_id, *fields) for item_id, fields in self._documents.items()
+                                    if fields is not None))
+            self._conn.executemany('DELETE FROM documents WHERE id = ?',
+                                   ((item_id,) for item_id, fields in self._documents.items() if fields is None))
+            self._write_meta(self._seq)
+            self._conn.execute('COMMIT')
+            self._dirty_grams.clear()
+            self._documents.clear()
+
+    def close(self):
+        """保存并关闭；正在后台载入时等载入结束"""
+        with self._lock:
+            if self._conn is not None:
+                self.save()
+                self._conn.close()
+                self._conn = None
+            self.reader.close()
+
+    # ---- 增量同步 ----
+
+    def sync(self):
+        """应用 change_log 中的新修改（只涉及修改过的物品）；未就绪时不做任何事
+
+        修改记录已被清理、无法增量同步时，在后台重建索引，期间 search 返回 None。
+        """
+        if not self.ready:
+            return
+        if not self._apply_changes():
+            self.ready = False
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+            self.ready = True
+        except sqlite3.Error as e:
+            self.error = e
+
+    def _apply_changes(self):
+        """应用 change_log 中 _seq 之后的修改；修改记录已被清理时返回 False"""
+        with self._lock:
+            changes, seq = self.reader.changes_since(self._seq)
+            if changes is None:
+                return False
+            touched = set(changes.added['items'] + changes.updated['items'] + changes.removed['items'])
+            touched = sorted(touched)
+            for start in range(0, len(touched), SYNC_BATCH):
+                batch = touched[start:start + SYNC_BATCH]
+                current = {item.id: item for _, item in self.reader.fetch(ItemQuery(), batch)}
+                for item_id in batch:
+                    item = current.get(item_id)
+                    self._reindex(item_id, None if item is None else
+                                  (item.name, item.contact_phone, item.contact_email))
+            self._seq = seq
+            if touched:
+                self._last = (None, None)
+            return True
+
+    def _old_fields(self, item_id):
+        if item_id in self._documents:
+            return self._documents[item_id]
+        return self._conn.execute('SELECT name, contact_phone, contact_email FROM documents WHERE id = ?',
+                                  (item_id,)).fetchone()
+
+    def _reindex(self, item_id, fields):
+        """按物品的新字段（已删除时为 None）更新倒排表"""
+        old_fields = self._old_fields(item_id)
+        old = document_grams(*old_fields) if old_fields else set()
+        new = document_grams(*fields) if fields else set()
+        self._size += bool(fields) - bool(old_fields)
+        for gram in old - new:
+            ids = self._postings.get(gram)
+            if ids is not None:
+                index = bisect_left(ids, item_id)
+                if index < len(ids) and ids[index] == item_id:
+                    del ids[index]
+                if not ids:
+                    del self._postings[gram]
+                self._dirty_grams.add(gram)
+        for gram in new - old:
+            ids = self._postings.get(gram)
+            if ids is None:
+                ids = self._postings[gram] = array('I')
+            index = bisect_left(ids, item_id)
+            if index == len(ids) or ids[index] != item_id:
+                ids.insert(index, item_id)
+            self._dirty_grams.add(gram)
+        self._documents[item_id] = fields
+
+    # ---- 查找 ----
+
+    def search(self, keyword, limit=SEARCH_LIMIT):
+        """按相似度从高到低（同分按 id）返回匹配的物品 id；索引未就绪或关键词太短（少于两个字）时返回 None"""
+        if not self.ready or len(fold(keyword)) < 2:
+            return None
+        with self._lock:
+            if self._last[0] == (keyword, limit):
+                return self._last[1]
+            channels = [sorted((self._postings.get(gram, EMPTY) for gram in channel), key=len)
+                        for channel in query_channels(keyword)]
+            # 含有全部 n-gram 的物品得分最高；这样的物品已够 limit 个时不必再为部分匹配的物品打分
+            exact = sorted(set().union(*(self._exact(lists, limit) for lists in channels)))
+            if len(exact) >= limit:
+                result = exact[:limit]
+            else:
+                scores = {}
+                for lists in channels:
+                    for item_id, score in self._score(lists).items():
+                        if score > scores.get(item_id, 0):
+                            scores[item_id] = score
+                result = heapq.nsmallest(limit, scores, key=lambda item_id: (-scores[item_id], item_id))
+            self._last = ((keyword, limit), result)
+            return result
+
+    @staticmethod
+    def _exact(lists, limit):
+        """在所有倒排表（按长度升序）中都出现的 id 中最小的 limit 个，升序
+
+        按 id 分段求交集，够 limit 个即停止，常见 n-gram 的长表只需看开头的一段。
+        """
+        shortest, others = lists[0], lists[1:]
+        result = []
+        for start in range(0, len(shortest), EXACT_CHUNK):
+            chunk = shortest[start:start + EXACT_CHUNK]
+            low, high = chunk[0], chunk[-1]
+            matched = set(chunk)
+            for ids in others:
+                start, stop = bisect_left(ids, low), bisect_right(ids, high)
+                if len(matched) * 16 < stop - start:
+                    # 剩下的已经很少时逐个二分查找，比把长表的整段转成集合快
+                    matched = {item_id for item_id in matched if _contains(ids, item_id)}
+                else:
+                    matched.intersection_update(ids[start:stop])
+                if not matched:
+                    break
+            result += sorted(matched)
+            if len(result) >= limit:
+                break
+        return result[:limit]
+
+    def _score(self, lists):
+        """一组倒排表（按长度升序）的打分：{id: 出现在其中的比例}，只含不低于 MIN_SCORE 的物品
+
+        超过 STOP_FRACTION 的物品都有的 n-gram（如邮箱域名）几乎没有区分度，只要还有别的
+        n-gram 就不参与打分。至少要出现在 need 个表中的物品必然出现在最短的 len - need + 1 个
+        表之一中，只从这些表中取候选，其余的表只与候选求交集。
+        """
+        common = max(self._size * STOP_FRACTION, SEARCH_LIMIT)
+        lists = [ids for ids in lists if len(ids) <= common] or lists
+        total = len(lists)
+        need = max(1, math.ceil(MIN_SCORE * total))
+        counts = Counter()
+        for ids in lists[:total - need + 1]:
+            counts.update(ids)
+        candidates = set(counts)
+        for ids in lists[total - need + 1:]:
+            counts.update(candidates.intersection(ids))
+        return {item_id: count / total for item_id, count in counts.items() if count >= need}
+
+
+def _contains(ids, item_id):
+    """升序数组 ids 中是否有 item_id"""
+    index = bisect_left(ids, item_id)
+    return index < len(ids) and ids[index] == item_id
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="物品复活系统：拼音与模糊查找索引")
+    parser.add_argument('--db', default=DB_FILE, help="数据库文件路径")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('build', help="重建索引")
+    query_parser = commands.add_parser('query', help="查找并显示耗时")
+    query_parser.add_argument('keyword')
+    query_parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if not HAS_PINYIN:
+        print("未安装 pypinyin，不支持拼音查找（pip install pypinyin）。", file=sys.stderr)
+    with ItemStore(args.db) as store:
+        index = SearchIndex(store)
+        try:
+            if args.command == 'build':
+                started = time.perf_counter()
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(index.path + suffix):
+                        os.remove(index.path + suffix)
+                index.open(background=False)
+                if index.error:
+                    raise index.error
+                print(f"索引完成，用时 {time.perf_counter() - started:.1f} 秒。")
+            else:
+                index.open(background=False)
+                if index.error:
+                    raise index.error
+                started = time.perf_counter()
+                ids = index.search(args.keyword, SEARCH_LIMIT) or []
+                elapsed = time.perf_counter() - started
+                for item_id in ids[:args.limit]:
+                    item = store.get_item(item_id)
+                    if item:
+                        print(json.dumps({'id': item.id, 'name': item.name, 'category': item.category},
+                                         ensure_ascii=False))
+                print(f"共 {len(ids)} 个匹配，用时 {elapsed * 1000:.1f} 毫秒。", file=sys.stderr)
+        finally:
+            index.close()
+
+
+if __name__ == "__main__":
+    main()
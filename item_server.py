@@ -0,0 +1,449 @@
+"""物品复活系统的 HTTP/JSON 接口服务（仅用标准库的 asyncio）
+
+供自助终端、入库扫码枪等程序使用，与桌面程序共用同一个数据库文件：
+    python item_server.py --port 8080
+
+接口（请求和响应均为 JSON，物品字段与 ItemStore 相同）：
+    GET  /items                 列表；参数 q、category、region（地区）、filter（如 数量>5，可重复）、
+                                deleted=1、sort（列名，如 名称、保质期）、desc=1（倒序）、limit、
+                                cursor（上一页返回的 next_cursor）、count=1（附带总数）
+    GET  /facets                与 /items 相同条件下按类别、地区、出版社、品牌、保质期的计数
+    GET  /items/<id>            单个物品，deleted=1 时取回收站中的物品；ETag 为版本号
+    POST /items                 添加物品
+    PUT  /items/<id>            修改物品；If-Match 头（或请求体中的 version）为读取时的版本号
+    POST /items/delete          {"ids": [...]} 移入回收站
+    POST /recycle/recover       {"ids": [...], "replace": false} 从回收站恢复
+    POST /recycle/purge         {"ids": [...]} 永久删除
+    GET  /changes?since=<seq>   自 seq 以来修改过的行，供客户端增量刷新
+    GET  /diagnostics           性能记录的统计（需以 ITEMS_PROFILE=1 启动，见 item_profile）
+"""
+import argparse
+import asyncio
+import base64
+import json
+import re
+import sqlite3
+import sys
+import traceback
+import zlib
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from item_io import validate
+from item_profile import PROFILER
+from item_store import (DB_FILE, FILTER_OPERATORS, PAGE_SIZE, DuplicateItemError, ItemQuery, ItemStore,
+                        StaleItemError)
+
+# 列表每页最多的行数
+MAX_PAGE_SIZE = 1000
+
+# 请求体的大小上限（字节）
+MAX_BODY = 1 << 20
+
+# 一次组提交最多合并的写请求数
+MAX_BATCH = 256
+
+STATUS_TEXT = {
+    200: 'OK', 201: 'Created', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 409: 'Conflict', 412: 'Precondition Failed', 413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+# filter 参数：属性名、运算符、值，如“保质期<2025-01-01”
+FILTER_PATTERN = re.compile('^(.+?)(' + '|'.join(sorted(map(re.escape, FILTER_OPERATORS), key=len, reverse=True))
+                            + ')(.*)$')
+
+
+class ApiError(Exception):
+    """以指定状态码返回给客户端的错误"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def item_json(item):
+    """物品的 JSON 表示"""
+    return {'id': item.id, 'name': item.name, 'description': item.description, 'address': item.address,
+            'contact_phone': item.contact_phone, 'contact_email': item.contact_email, 'category': item.category,
+            'attributes': item.attributes, 'version': item.version}
+
+
+def changes_json(changes):
+    """ChangeSet 的 JSON 表示"""
+    return {kind: {table: ids for table, ids in getattr(changes, kind).items() if ids}
+            for kind in ('added', 'updated', 'removed')}
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))))
+    except (ValueError, TypeError):
+        raise ApiError(400, '无效的 cursor') from None
+
+
+class ReaderPool:
+    """只读连接池：每个连接同一时间只供一个请求使用，查询在线程池中执行，不阻塞事件循环"""
+
+    def __init__(self, db_file, size):
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='reader')
+        self._stores = asyncio.Queue()
+        for _ in range(size):
+            self._stores.put_nowait(ItemStore(db_file, readonly=True, cache_size=0))
+
+    async def run(self, method, *args):
+        """在一个空闲的只读连接上执行 ItemStore 的 method 方法"""
+        store = await self._stores.get()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, getattr(store, method), *args)
+        finally:
+            self._stores.put_nowait(store)
+
+    def close(self):
+        self._executor.shutdown()
+        while not self._stores.empty():
+            self._stores.get_nowait().close()
+
+
+class GroupCommitWriter:
+    """写请求的组提交：同时到达的写请求合并到一个事务中，只提交一次
+
+    每个请求在自己的保存点中执行（ItemStore 的嵌套事务），失败只回滚它自己，不影响同批的其他请求。
+    所有写入都在同一个线程中经由同一个连接完成。
+    """
+
+    def __init__(self, db_file, max_batch=MAX_BATCH):
+        self.store = ItemStore(db_file)
+        self.max_batch = max_batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer')
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def run(self, method, *args):
+        """提交一次写操作并等待所在的批次提交，返回 ItemStore 方法的结果"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((method, args, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # 上一批提交期间到达的请求合并为下一批
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                results = await loop.run_in_executor(self._executor, self._commit, batch)
+            except Exception as e:  # 提交本身失败，整批都失败
+                results = [(False, e)] * len(batch)
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _commit(self, batch):
+        results = []
+        with self.store.transaction():
+            for method, args, _ in batch:
+                try:
+                    results.append((True, getattr(self.store, method)(*args)))
+                except Exception as e:
+                    results.append((False, e))
+        return results
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        self._executor.shutdown()
+        self.store.close()
+
+
+class ItemServer:
+    """HTTP/1.1（长连接）服务，把请求转成 ItemStore 的调用"""
+
+    def __init__(self, db_file=DB_FILE, readers=4):
+        self.db_file = db_file
+        self.reader_count = readers
+        self.readers = None
+        self.writer = None
+
+    async def start(self, host='127.0.0.1', port=8080):
+        # 先建立写连接，由它完成数据库结构的创建或升级，只读连接随后打开
+        self.writer = GroupCommitWriter(self.db_file)
+        self.writer.start()
+        self.readers = ReaderPool(self.db_file, self.reader_count)
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def close(self):
+        await self.writer.close()
+        self.readers.close()
+
+    async def handle(self, reader, writer):
+        """处理一个连接上的若干请求
+
+        请求行或请求头无法解析时回复 400，请求体超过 MAX_BODY 时回复 413，都不读取请求体，
+        回复后关闭连接。
+        """
+        try:
+            while True:
+                try:
+                    request = await self.read_head(reader)
+                except ValueError:
+                    writer.write(self.render(400, {'error': '请求行或请求头格式错误'}, {}, False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, version, headers, length = request
+                if length > MAX_BODY:
+                    writer.write(self.render(413, {'error': '请求体过大'}, {}, False))
+                    await writer.drain()
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload, extra = await self.respond(method, target, headers, body)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write(self.render(status, payload, extra, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def read_head(reader):
+        """读取请求行和请求头，返回 (方法, 路径, 协议版本, {小写头名: 值}, 请求体长度)
+
+        连接已关闭时返回 None；格式错误（包括过长的行、非法的 Content-Length）时抛出 ValueError。
+        """
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        method, target, version = request_line.decode('latin-1').split()
+        if not version.startswith('HTTP/'):
+            raise ValueError(f'不支持的协议：{version}')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, colon, value = line.decode('latin-1').partition(':')
+            if not colon or not name.strip():
+                raise ValueError(f'无效的请求头：{line!r}')
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get('content-length', '0')
+        if not length.isdigit():
+            raise ValueError(f'无效的 Content-Length：{length}')
+        return method, target, version, headers, int(length)
+
+    @staticmethod
+    def render(status, payload, extra, keep_alive):
+        body = b'' if payload is None else json.dumps(payload, ensure_ascii=False).encode()
+        lines = [f'HTTP/1.1 {status} {STATUS_TEXT[status]}',
+                 f'Content-Length: {len(body)}',
+                 f'Connection: {"keep-alive" if keep_alive else "close"}']
+        if payload is not None:
+            lines.append('Content-Type: application/json; charset=utf-8')
+        lines += [f'{name}: {value}' for name, value in extra.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+    async def respond(self, method, target, headers, body):
+        """返回 (状态码, JSON 内容, 额外的响应头)"""
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        try:
+            if body:
+                try:
+                    body = json.loads(body)
+                except ValueError:
+                    raise ApiError(400, '请求体不是有效的 JSON') from None
+            route = (method, *(':id' if part.isdigit() and i == 1 else part for i, part in enumerate(parts)))
+            if route == ('GET', 'items'):
+                return await self.list_items(params, headers)
+            if route == ('GET', 'items', ':id'):
+                return await self.get_item(int(parts[1]), params, headers)
+            if route == ('POST', 'items'):
+                return await self.add_item(body)
+            if route == ('PUT', 'items', ':id'):
+                return await self.update_item(int(parts[1]), body, headers)
+            if route == ('POST', 'items', 'delete'):
+                return await self.write_ids('delete_items', body)
+            if route == ('POST', 'recycle', 'recover'):
+                replace = body.get('replace', False) if isinstance(body, dict) else False
+                if isinstance(replace, list):
+                    replace = set(replace)
+                return await self.write_ids('recover_items', body, replace)
+            if route == ('POST', 'recycle', 'purge'):
+                return await self.write_ids('purge_items', body)
+            if route == ('GET', 'facets'):
+                return await self.facets(params, headers)
+            if route == ('GET', 'changes'):
+                return await self.changes(params)
+            if route == ('GET', 'diagnostics'):
+                return 200, PROFILER.snapshot(), {}
+            if route[1:] in (('items',), ('items', ':id'), ('items', 'delete'), ('recycle', 'recover'),
+                             ('recycle', 'purge'), ('facets',), ('changes',), ('diagnostics',)):
+                raise ApiError(405, f'不支持的方法：{method}')
+            raise ApiError(404, '没有这个接口')
+        except ApiError as e:
+            return e.status, {'error': str(e)}, {}
+        except DuplicateItemError:
+            return 409, {'error': '名称和类别相同的物品已存在'}, {}
+        except StaleItemError as e:
+            current = item_json(e.current) if e.current else None
+            return 412, {'error': '物品已被其他用户修改或删除', 'current': current}, {}
+        except ValueError as e:
+            return 400, {'error': str(e)}, {}
+        except (TypeError, KeyError) as e:
+            # 请求中的值类型不对（如游标解码后不是键、请求体字段不是预期的类型）
+            return 400, {'error': f'请求格式不正确：{e}'}, {}
+        except sqlite3.Error as e:
+            traceback.print_exc(file=sys.stderr)
+            return 500, {'error': f'数据库错误：{e}'}, {}
+        except Exception:
+            # 其余异常是服务自身的问题，记下堆栈，仍给客户端一个响应，不中断连接
+            traceback.print_exc(file=sys.stderr)
+            return 500, {'error': '服务内部错误'}, {}
+
+    @staticmethod
+    def query(params):
+        filters = []
+        for text in params.get('filter', []):
+            match = FILTER_PATTERN.match(text)
+            if not match:
+                raise ApiError(400, f'无效的筛选条件：{text}')
+            filters.append(tuple(part.strip() for part in match.groups()))
+        return ItemQuery(deleted=params.get('deleted', ['0'])[0] in ('1', 'true'),
+                         keyword=params.get('q', [''])[0].strip(),
+                         category=params.get('category', [None])[0] or None,
+                         filters=filters,
+                         region=params.get('region', [None])[0] or None,
+                         sort=params.get('sort', [None])[0] or None,
+                         descending=params.get('desc', ['0'])[0] in ('1', 'true'))
+
+    async def list_items(self, params, headers):
+        query = self.query(params)
+        try:
+            limit = min(max(int(params.get('limit', [PAGE_SIZE])[0]), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            raise ApiError(400, 'limit 必须是整数') from None
+        cursor = params.get('cursor', [None])[0]
+        # 列表页的 ETag 由最新的修改序号和请求参数组成：没有任何修改时客户端的缓存一定有效，
+        # 不必再执行查询。序号在查询之前读取，期间有修改时只会让 ETag 偏旧，不会误判为未修改。
+        etag = await self.list_etag(params)
+        if headers.get('if-none-match') == etag:
+            return 304, None, {'ETag': etag}
+        after = decode_cursor(cursor) if cursor else None
+        entries = await self.readers.run('page', query, after, None, limit + 1)
+        payload = {'items': [item_json(item) for _, item in entries[:limit]],
+                   'next_cursor': encode_cursor(entries[limit - 1][0]) if len(entries) > limit else None}
+        if params.get('count', ['0'])[0] in ('1', 'true'):
+            payload['count'] = await self.readers.run('count', query)
+        return 200, payload, {'ETag': etag}
+
+    async def list_etag(self, params):
+        seq = await self.readers.run('last_change')
+        signature = json.dumps(sorted(params.items()), ensure_ascii=False)
+        return f'"{seq}-{zlib.crc32(signature.encode()):x}"'
+
+    async def facets(self, params, headers):
+        query = self.query(params)
+        # 保质期的区间按当天计算，日期变化时 ETag 也要变
+        etag = await self.list_etag({**params, 'today': [date.today().isoformat()]})
+        if headers.get('if-none-match') == etag:
+            return 304, None, {'ETag': etag}
+        facets = await self.readers.run('facets', query)
+        return 200, {name: [{'value': value, 'count': count} for value, count in entries]
+                     for name, entries in facets.items()}, {'ETag': etag}
+
+    async def get_item(self, item_id, params, headers):
+        item = await self.readers.run('get_item', item_id, params.get('deleted', ['0'])[0] in ('1', 'true'))
+        if item is None:
+            raise ApiError(404, '物品不存在')
+        etag = f'"{item.version}"'
+        if headers.get('if-none-match') == etag:
+            return 304, None, {'ETag': etag}
+        return 200, item_json(item), {'ETag': etag}
+
+    async def add_item(self, body):
+        if not isinstance(body, dict):
+            raise ApiError(400, '请求体必须是 JSON 对象')
+        changes = await self.writer.run('add_item', *validate(body))
+        item_id = changes.added['items'][0]
+        return 201, {'id': item_id, 'changes': changes_json(changes)}, {'Location': f'/items/{item_id}'}
+
+    async def update_item(self, item_id, body, headers):
+        if not isinstance(body, dict):
+            raise ApiError(400, '请求体必须是 JSON 对象')
+        version = headers.get('if-match', '').strip('"') or body.get('version')
+        if version in (None, '', '*'):
+            version = None
+        else:
+            try:
+                version = int(version)
+            except ValueError:
+                raise ApiError(400, '无效的版本号') from None
+        record = {key: value for key, value in body.items() if key != 'version'}
+        changes = await self.writer.run('update_item', item_id, *validate(record), version)
+        if not changes:
+            raise ApiError(404, '物品不存在')
+        return 200, {'changes': changes_json(changes)}, {}
+
+    async def write_ids(self, method, body, *args):
+        ids = body.get('ids') if isinstance(body, dict) else None
+        if not isinstance(ids, list) or not all(isinstance(item_id, int) for item_id in ids):
+            raise ApiError(400, '请求体必须包含 ids（整数列表）')
+        changes = await self.writer.run(method, ids, *args)
+        return 200, {'changes': changes_json(changes)}, {}
+
+    async def changes(self, params):
+        try:
+            since = int(params.get('since', ['0'])[0])
+        except ValueError:
+            raise ApiError(400, 'since 必须是整数') from None
+        changes, seq = await self.readers.run('changes_since', since)
+        if changes is None:
+            # 修改记录已被清理，客户端应整表重新加载
+            return 200, {'reload': True, 'seq': seq}, {}
+        return 200, {'reload': False, 'seq': seq, 'changes': changes_json(changes)}, {}
+
+
+async def serve(db_file, host, port, readers):
+    server = ItemServer(db_file, readers)
+    listener = await server.start(host, port)
+    print(f"物品服务已启动：http://{host}:{port}/items")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="物品复活系统：HTTP/JSON 接口服务")
+    parser.add_argument('--db', default=DB_FILE, help="数据库文件路径")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址（默认只允许本机访问）")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--readers', type=int, default=4, help="只读连接数")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.db, args.host, args.port, args.readers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
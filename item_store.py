@@ -0,0 +1,1772 @@
+"""物品数据层：与界面无关，可在脚本和服务中直接使用
+
+也提供几个维护命令：
+    python item_store.py storage-mode flag      # 回收站改用删除标记（table 为独立的回收站表）
+    python item_store.py retention 30           # 回收站物品保留 30 天（0 表示永久保留）
+    python item_store.py purge                  # 立即清理超过保留期的物品和操作日志并回收空间
+    python item_store.py expire                 # 立即把已过保质期的物品移入回收站
+    python item_store.py restore "2025-01-01 12:00" old.db   # 把那一时刻的数据写入 old.db
+"""
+import argparse
+import functools
+import json
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta, timezone
+from itertools import islice
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+
+from item_profile import PROFILER
+
+# 数据库文件路径
+DB_FILE = 'items_with_categories.db'
+
+# 回收站的两种存储方式：'table' 把删除的物品移到 deleted_items 表；
+# 'flag' 只在 items 表中记下删除时间 deleted_at，删除和恢复都是单行 UPDATE
+STORAGE_MODES = ('table', 'flag')
+
+# 各类别的扩展属性
+CATEGORY_ATTRIBUTES = {
+    "食品": ("保质期", "数量"),
+    "书籍": ("作者", "出版社"),
+    "工具": ("品牌", "型号"),
+}
+
+# 扩展属性对应的生成列（由 attributes 计算、不占存储），可在 SQL 中筛选和排序
+ATTRIBUTE_COLUMNS = {
+    "保质期": 'expires_on',
+    "数量": 'quantity',
+    "作者": 'author',
+    "出版社": 'publisher',
+    "品牌": 'brand',
+    "型号": 'model',
+}
+
+# 有类型的扩展属性：保存时统一格式，date 为 YYYY-MM-DD 文本，number 为 JSON 数字；其余为文本
+ATTRIBUTE_TYPES = {
+    "保质期": 'date',
+    "数量": 'number',
+}
+
+# 可排序的列：表格列名（或扩展属性名）-> 列，排序和分页都在 SQL 中完成
+SORT_COLUMNS = {
+    "名称": 'name',
+    "类别": 'category',
+    "描述": 'description',
+    "地址": 'address',
+    "联系人手机": 'contact_phone',
+    "联系人邮箱": 'contact_email',
+    **ATTRIBUTE_COLUMNS,
+}
+
+# 有索引的排序列，按索引顺序取一页。描述、地址、手机、邮箱不建索引：每个索引都让导入和修改变慢，
+# 而按这些列排序并不常用，扫描后取前一页在 10 万行时也只要 20~50 ms（有索引约 2 ms）
+INDEXED_SORT_COLUMNS = ('name', 'category', *ATTRIBUTE_COLUMNS.values())
+
+# 属性筛选可用的比较运算符
+FILTER_OPERATORS = ('=', '!=', '<', '<=', '>', '>=')
+
+# 地址中的第一级行政区划（“北京市”“广东省”“朝阳区”……）到这些字为止，作为生成列 region
+REGION_SUFFIXES = ('省', '市', '区', '县')
+
+# 分面统计：名称 -> 列，facet_counts 表按这些列的组合计数
+FACETS = {
+    "类别": 'category',
+    "地区": 'region',
+    "出版社": 'publisher',
+    "品牌": 'brand',
+    "保质期": 'expires_on',
+}
+
+# 保质期分面的区间：(名称, 起始, 结束)，为距今天的天数，包含起始、不含结束，None 表示不限
+EXPIRY_BUCKETS = (
+    ("已过期", None, 0),
+    ("7 天内到期", 0, 7),
+    ("30 天内到期", 7, 30),
+    ("30 天以后到期", 30, None),
+)
+
+# 到期提醒：保质期在今后这么多天之内的物品提醒一次（设置 expiry_notice_days，0 表示不提醒）
+EXPIRY_NOTICE_DAYS = 3
+
+# 一次最多取出的到期物品数
+DUE_LIMIT = 200
+
+# facet_counts 中一行的分面值（空值记为 ''），{0} 为表名或触发器中的 new、old
+FACET_VALUES = ', '.join(f"coalesce({{0}}.{column}, '')" for column in FACETS.values())
+
+# 每个连接缓存的分面统计结果数
+FACET_CACHE_SIZE = 64
+
+# 查询时使用的列，顺序与 Item 构造参数一致
+ITEM_COLUMNS = 'id, name, description, address, contact_phone, contact_email, category, attributes, version'
+# 分页查询中给表起别名 t 后使用的列
+T_COLUMNS = ', '.join('t.' + column.strip() for column in ITEM_COLUMNS.split(','))
+
+# 参与关键词搜索的文本列；全文索引另有一列 attrs，存放扩展属性的值（不含键名）
+SEARCH_COLUMNS = ('name', 'description', 'address', 'contact_phone', 'contact_email')
+
+# 全文索引 attrs 列的值，{0} 为表名或触发器中的 new
+FTS_ATTRS = "(SELECT group_concat(value, ' ') FROM json_each({0}.attributes) WHERE json_valid({0}.attributes))"
+
+# change_log 中保留的最近修改条数；落后更多的连接改为整表重新加载
+CHANGE_LOG_KEEP = 100000
+
+# 操作日志（journal）记录的列：物品表中除 id 和生成列以外的全部列
+JOURNAL_COLUMNS = ('name', 'description', 'address', 'contact_phone', 'contact_email', 'category', 'attributes',
+                   'deleted_at', 'version')
+
+# 操作日志中一行的完整内容（JSON 对象），{0} 为表名或触发器中的 new、old
+JOURNAL_IMAGE = 'json_object(' + ', '.join(f"'{column}', {{0}}.{column}" for column in JOURNAL_COLUMNS) + ')'
+
+# 批量导入时暂停的逐行触发器：每批写完后对新增的行各用一条语句补上（见 import_items），
+# 全文索引一次写入一批比逐行写入快得多
+IMPORT_DEFERRED_TRIGGERS = ('items_fts_insert', 'items_log_insert', 'items_facets_insert', 'items_journal_insert')
+
+# 操作日志保留的天数：更早的操作不能再撤销，也不能再按时间点重建
+JOURNAL_KEEP_DAYS = 30
+
+# 可以撤销的操作及其名称；其余操作（自动清理回收站、撤销、重做）只用于按时间点重建
+UNDOABLE_ACTIONS = {
+    'add': "添加物品",
+    'update': "修改物品",
+    'delete': "删除物品",
+    'recover': "恢复物品",
+    'purge': "永久删除",
+    'import': "导入物品",
+    'merge': "合并重复物品",
+}
+
+# 合并重复物品时，保留的物品中为空时可以用重复物品的值补上的字段
+MERGE_FIELDS = ('description', 'address', 'contact_phone', 'contact_email')
+
+# 操作日志中的时间：UTC，精确到毫秒，按文本比较即按时间比较
+JOURNAL_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# 列表分页时每页的行数
+PAGE_SIZE = 200
+
+# ItemStore 缓存的物品个数（按最近使用淘汰）
+ITEM_CACHE_SIZE = 2000
+
+# 收集统计信息时每个索引最多检查的行数，大表上 ANALYZE 也很快
+ANALYSIS_LIMIT = 1000
+
+# 以一个 JSON 数组参数传入任意多个 id，避免 IN (?, ?, ...) 的参数个数上限
+IN_IDS = 'IN (SELECT value FROM json_each(?))'
+
+# 连接参数：WAL 模式下读写互不阻塞，synchronous=NORMAL 每次提交不再强制 fsync
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',  # 约 16 MB 页缓存
+    'PRAGMA mmap_size = 268435456',
+)
+
+
+class DuplicateItemError(Exception):
+    """名称和类别相同的物品已存在"""
+
+
+class StaleItemError(Exception):
+    """物品在读取之后已被其他用户修改或删除；current 为数据库中当前的物品，已删除时为 None"""
+
+    def __init__(self, item_id, current):
+        super().__init__(item_id)
+        self.item_id = item_id
+        self.current = current
+
+
+class UndoConflictError(Exception):
+    """要撤销（或重做）的操作涉及的物品之后又被修改过，或恢复后会与现有物品重名"""
+
+    def __init__(self, action):
+        super().__init__(f'“{UNDOABLE_ACTIONS.get(action, action)}”涉及的物品之后又被修改过，无法撤销或重做')
+        self.action = action
+
+
+class Item:
+    """一件物品；用 __slots__ 省去每个实例的 __dict__，扩展属性在第一次访问时才解析 JSON"""
+
+    __slots__ = ('id', 'name', 'description', 'address', 'contact_phone', 'contact_email', 'category', 'version',
+                 '_attributes', '_attributes_json')
+
+    def __init__(self, id, name, description, address, contact_phone, contact_email, category, attributes,
+                 version=1):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.address = address
+        self.contact_phone = contact_phone
+        self.contact_email = contact_email
+        self.category = category
+        self.attributes = attributes  # 扩展属性，使用字典存储
+        self.version = version  # 行版本号，每次修改加一，用于检测并发修改
+
+    @classmethod
+    def from_row(cls, row):
+        """由数据库行构造物品，扩展属性保留为 JSON 文本"""
+        item = cls.__new__(cls)
+        item.id, item.name, item.description, item.address, item.contact_phone, item.contact_email, \
+            item.category, item._attributes_json, item.version = row
+        item._attributes = None
+        return item
+
+    @property
+    def attributes(self):
+        if self._attributes is None:
+            with PROFILER.timed('json'):
+                # 列为 NULL 或 JSON 的 null 时视为没有扩展属性
+                self._attributes = json.loads(self._attributes_json or '{}') or {}
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, attributes):
+        self._attributes = attributes
+        self._attributes_json = None
+
+    @property
+    def attributes_json(self):
+        """扩展属性的 JSON 文本；未修改过时就是数据库中的原文，不必解析再编码"""
+        if self._attributes_json in (None, 'null'):
+            self._attributes_json = _dump_attributes(self.attributes)
+        return self._attributes_json
+
+
+class ItemCache:
+    """按 (列表, id) 缓存最近用到的物品，超过 maxsize 时淘汰最久未用的；列表为 'items' 或 'deleted_items'"""
+
+    def __init__(self, maxsize=ITEM_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, table, item_id):
+        item = self._items.get((table, item_id))
+        if item is not None:
+            self._items.move_to_end((table, item_id))
+        return item
+
+    def put(self, table, item):
+        if self.maxsize <= 0:
+            return
+        self._items[(table, item.id)] = item
+        self._items.move_to_end((table, item.id))
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def invalidate(self, changes):
+        """丢弃一次修改涉及的物品"""
+        for ids_by_table in (changes.added, changes.updated, changes.removed):
+            for table, ids in ids_by_table.items():
+                for item_id in ids:
+                    self._items.pop((table, item_id), None)
+
+    def clear(self):
+        self._items.clear()
+
+
+def _invalidates_cache(method):
+    """返回 ChangeSet 的修改方法：按修改集丢弃缓存中涉及的物品"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        changes = method(self, *args, **kwargs)
+        self.cache.invalidate(changes)
+        return changes
+    return wrapper
+
+
+def attribute_value(key, value):
+    """按 ATTRIBUTE_TYPES 把扩展属性的值转成保存的格式，空值原样返回；格式不对时抛出 ValueError"""
+    kind = ATTRIBUTE_TYPES.get(key)
+    if kind is None or value is None or isinstance(value, (int, float)) and kind == 'number':
+        return value
+    text = str(value).strip()
+    if not text:
+        return text
+    if kind == 'date':
+        for pattern in ('%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d'):
+            try:
+                return datetime.strptime(text, pattern).date().isoformat()
+            except ValueError:
+                pass
+        raise ValueError(f'{key}必须是日期，如 {date.today().isoformat()}')
+    try:
+        number = float(text)
+    except ValueError:
+        raise ValueError(f'{key}必须是数字') from None
+    return int(number) if number.is_integer() and '.' not in text else number
+
+
+def normalize_attributes(attributes):
+    """统一扩展属性中有类型的值的格式（见 attribute_value），返回新字典"""
+    return {key: attribute_value(key, value) for key, value in attributes.items()}
+
+
+def _dump_attributes(attributes):
+    """扩展属性编码为 JSON 文本；键名保留原文，SQLite 的 JSON 函数才能按 '$.保质期' 这样的路径取值
+
+    None 编码为 {}，不写入 JSON 的 null。
+    """
+    return json.dumps({} if attributes is None else attributes, ensure_ascii=False)
+
+
+def _merge_duplicates(rows, keep_last):
+    """合并同名同类别的导入行：保留第一次出现的位置，内容取最后一条（keep_last）或第一条
+
+    与唯一索引一致，名称或类别为 NULL 的行互不重复。
+    """
+    merged = {}
+    for index, row in enumerate(rows):
+        name, category = row[0], row[5]
+        key = index if name is None or category is None else (name, category)
+        if keep_last or key not in merged:
+            merged[key] = row
+    return list(merged.values())
+
+
+def _ids(ids):
+    """把 id 序列编码为 IN_IDS 所需的 JSON 数组"""
+    return json.dumps([int(item_id) for item_id in ids])
+
+
+def journal_time(moment):
+    """datetime（不带时区时按本地时间）转成操作日志中的时间文本（见 JOURNAL_NOW）"""
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+def _journal_entry(row):
+    """journal 的一行 (表, id, 修改前, 修改后)，前后内容从 JSON 解码，不存在时为 None"""
+    table, item_id, old, new = row
+    return table, item_id, json.loads(old) if old else None, json.loads(new) if new else None
+
+
+def expiry_filters(bucket, today=None):
+    """保质期分面的区间（EXPIRY_BUCKETS 中的名称）对应的属性筛选条件"""
+    today = today or date.today()
+    for name, start, end in EXPIRY_BUCKETS:
+        if name == bucket:
+            return [("保质期", operator, (today + timedelta(days=days)).isoformat())
+                    for operator, days in (('>=', start), ('<', end)) if days is not None]
+    raise ValueError(f'未知的保质期区间：{bucket}')
+
+
+def _group_facets(rows, today):
+    """把按分面列组合计数的行 (类别, 地区, ..., 物品数) 汇总成各分面的计数（见 ItemStore.facets）"""
+    bounds = [(name, end is not None and (today + timedelta(days=end)).isoformat()) for name, _, end in EXPIRY_BUCKETS]
+    counters = {name: Counter() for name in FACETS}
+    for *values, count in rows:
+        for name, value in zip(FACETS, values):
+            if not value:
+                continue
+            if name == "保质期":
+                # 区间首尾相接，第一个结束日期晚于它的区间就是它所在的区间
+                value = next(bucket for bucket, end in bounds if end is False or value < end)
+            counters[name][value] += count
+    result = {}
+    for name, counter in counters.items():
+        if name == "保质期":
+            result[name] = [(bucket, counter[bucket]) for bucket, _, _ in EXPIRY_BUCKETS if counter[bucket]]
+        else:
+            result[name] = sorted(counter.items(), key=lambda entry: (-entry[1], entry[0]))
+    return result
+
+
+class ChangeSet:
+    """一次修改涉及的行，界面据此只刷新这些行
+
+    按列表记录新增、更新、删除的 id：'items' 为主列表，'deleted_items' 为回收站
+    （与回收站的存储方式无关）。
+    """
+
+    def __init__(self):
+        self.added = defaultdict(list)
+        self.updated = defaultdict(list)
+        self.removed = defaultdict(list)
+
+    def __bool__(self):
+        return any(self.added.values()) or any(self.updated.values()) or any(self.removed.values())
+
+    def merge(self, other):
+        """并入另一组修改"""
+        for mine, theirs in ((self.added, other.added), (self.updated, other.updated),
+                             (self.removed, other.removed)):
+            for table, ids in theirs.items():
+                mine[table].extend(ids)
+        return self
+
+
+class ItemQuery:
+    """列表查询条件：主列表或回收站，可选关键词、类别和扩展属性筛选
+
+    filters 为 [(属性名, 运算符, 值)]，如 [("保质期", "<", "2025-01-01"), ("数量", ">", 5)]，
+    属性名见 ATTRIBUTE_COLUMNS，运算符见 FILTER_OPERATORS，各条件同时满足。
+    fuzzy 为真时关键词按拼音和相似度匹配（见 item_search），store 没有可用的索引时仍按子串匹配。
+    region 为地址的第一级行政区划（见 REGION_SUFFIXES）。
+    sort 为 SORT_COLUMNS 中的列名，按该列再按 id 排序，descending 为真时倒序，该列为空的物品
+    无论正序倒序都排在最后；不指定时按 id 排序，有关键词时按相关度排序。
+    """
+
+    def __init__(self, deleted=False, keyword='', category=None, filters=(), fuzzy=False, region=None, sort=None,
+                 descending=False):
+        if sort is not None and sort not in SORT_COLUMNS:
+            raise ValueError(f'不能按“{sort}”排序')
+        self.deleted = deleted
+        self.keyword = keyword
+        self.category = category
+        self.filters = tuple(filters)
+        self.fuzzy = fuzzy
+        self.region = region
+        self.sort = sort
+        self.descending = descending
+
+    @property
+    def table(self):
+        return 'deleted_items' if self.deleted else 'items'
+
+    @property
+    def signature(self):
+        """可作字典键的查询条件（不含排序）"""
+        return self.deleted, self.keyword, self.category, self.filters, self.fuzzy, self.region
+
+    def order_key(self, key):
+        """把 page 返回的键转成 Python 中可比较、顺序与列表显示顺序一致的值
+
+        排序列可能混有数字和文本，按 SQLite 的规则数字在前；空值总在最后，彼此按 id 排列。
+        """
+        if self.sort is None:
+            return key
+        value, item_id = key
+        if value is None:
+            return 1, _Descending(item_id) if self.descending else item_id
+        ordered = (0 if isinstance(value, (int, float)) else 1, value, item_id)
+        return 0, _Descending(ordered) if self.descending else ordered
+
+
+@functools.total_ordering
+class _Descending:
+    """比较结果与所包装的值相反，用于倒序排列的键"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _like_pattern(keyword):
+    """把关键词转成子串匹配的 LIKE 模式，转义其中的 % 和 _"""
+    escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+class ItemStore:
+    """持有一个长连接的物品仓库，所有增删改查都通过它完成"""
+
+    def __init__(self, db_file=DB_FILE, timeout=10, readonly=False, cache_size=ITEM_CACHE_SIZE):
+        self.db_file = db_file
+        self.readonly = readonly
+        self.cache = ItemCache(cache_size)  # 分页和 get_item 取到的物品，修改时按 ChangeSet 失效
+        self._lock = threading.RLock()
+        self._depth = 0  # 事务嵌套层数，内层使用 SAVEPOINT
+        self._timeout = timeout
+        self._connect()
+        self.fts = False  # 是否可用全文索引（需要 SQLite 的 FTS5 与 trigram 分词器）
+        self.soft_delete = False  # 回收站是否使用删除标记（见 STORAGE_MODES）
+        self.search_index = None  # 拼音与模糊查找的索引（item_search.SearchIndex），由调用方设置
+        self._facet_cache = OrderedDict()  # (查询条件, 今天) -> (change_log 序号, 分面统计)
+        self._history = None  # history() 的增量状态：(最早的操作号, 读到的最后操作号, 操作名称, 撤销栈, 重做栈)
+        if readonly:
+            self._conn.execute('PRAGMA query_only = ON')
+            self._load_schema_state()
+        else:
+            self.create_database()
+
+    def _connect(self):
+        # isolation_level=None：由本类显式控制事务；语句缓存即预编译语句缓存
+        self._conn = sqlite3.connect(self.db_file, timeout=self._timeout, isolation_level=None,
+                                     check_same_thread=False, cached_statements=256)
+        for pragma in PRAGMAS:
+            self._conn.execute(pragma)
+
+    def reader(self, cache_size=0):
+        """另开一个只读连接，供后台线程查询；可单独取消，不影响本连接
+
+        只读连接默认不使用缓存：它看不到其他连接的修改何时发生，缓存的物品可能已过时。
+        指定 cache_size 时由调用方负责用写入返回的 ChangeSet 调用 cache.invalidate。
+        """
+        reader = ItemStore(self.db_file, readonly=True, cache_size=cache_size)
+        reader.search_index = self.search_index
+        return reader
+
+    def interrupt(self):
+        """中止本连接上正在执行的查询（可从其他线程调用），被中止的查询抛出 sqlite3.OperationalError"""
+        self._conn.interrupt()
+
+    def set_cancel_check(self, check, interval=1000):
+        """查询执行期间每隔 interval 条虚拟机指令调用 check()，返回真值即中止查询；check 为 None 时取消"""
+        self._conn.set_progress_handler(check, interval if check else 0)
+
+    def close(self):
+        """关闭数据库连接；写连接关闭前按需更新查询规划器的统计信息"""
+        with self._lock:
+            if not self.readonly:
+                self.optimize()
+            self._conn.close()
+
+    def optimize(self):
+        """PRAGMA optimize：只对统计信息已过时（如数据量大增）的表重新收集，通常立即返回"""
+        with self._lock:
+            self._execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+            self._execute('PRAGMA optimize')
+            self._drop_fts_statistics()
+
+    def _drop_fts_statistics(self):
+        """删除全文索引影子表（items_fts_data 等）的统计信息
+
+        这些表由 FTS5 自己按 rowid 读写，统计信息对它们没有用处；而在表还很小时收集的统计
+        （如 items_fts_data 只有 2 行）PRAGMA optimize 不会再更新，会让导入等写入慢上十倍。
+        """
+        if self._execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            self._execute("DELETE FROM sqlite_stat1 WHERE tbl GLOB 'items_fts_*'")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _execute(self, sql, params=()):
+        if PROFILER.enabled:
+            return PROFILER.execute(self._conn, sql, params)
+        return self._conn.execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """写事务；嵌套调用时使用保存点，内层失败只回滚自身"""
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute('BEGIN IMMEDIATE')
+                commit, rollback = ('COMMIT',), ('ROLLBACK',)
+            else:
+                savepoint = f'sp{self._depth}'
+                self._conn.execute(f'SAVEPOINT {savepoint}')
+                commit = (f'RELEASE {savepoint}',)
+                rollback = (f'ROLLBACK TO {savepoint}', f'RELEASE {savepoint}')
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                for statement in rollback:
+                    self._conn.execute(statement)
+                self.cache.clear()  # 事务中读到并缓存的物品可能已被回滚
+                self._history = None  # 撤销、重做栈的推算也可能读到了回滚的操作
+                raise
+            self._depth -= 1
+            for statement in commit:
+                self._conn.execute(statement)
+
+    def create_database(self):
+        """创建或升级数据库结构
+
+        每一步迁移在单独的事务中执行，PRAGMA user_version 记录已完成的步数，
+        已是最新结构时只读取这一个值，不再执行任何 DDL，也不再检查增量清理是否已开启
+        （升级到最新结构的那次打开已经检查过）。
+        """
+        version = self._execute('PRAGMA user_version').fetchone()[0]
+        if version == len(self.MIGRATIONS):
+            self._load_schema_state()
+            return
+        if version == 0:
+            # 新建的数据库在建表前设置即可生效
+            self._execute('PRAGMA auto_vacuum = INCREMENTAL')
+        for step, migrate in enumerate(self.MIGRATIONS[version:], start=version + 1):
+            with self.transaction():
+                migrate(self)
+                self._execute(f'PRAGMA user_version = {step}')
+        if self._execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # 旧数据库要整理一次才能改用增量清理，只发生一次
+            self._execute('PRAGMA auto_vacuum = INCREMENTAL')
+            self._execute('VACUUM')
+        # 连接只在打开时读取一次统计信息（sqlite_stat1），迁移改动了它，重新连接后才生效
+        self._conn.close()
+        self._connect()
+        self._load_schema_state()
+
+    def _load_schema_state(self):
+        self.fts = bool(self._execute("SELECT 1 FROM sqlite_master WHERE name = 'items_fts'").fetchone())
+        self.soft_delete = self.get_setting('storage_mode', 'table') == 'flag'
+
+    def _migrate_tables(self):
+        """迁移 1：物品表和回收站表"""
+        for table in ('items', 'deleted_items'):
+            self._execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT,
+                    description TEXT,
+                    address TEXT,
+                    contact_phone TEXT,
+                    contact_email TEXT,
+                    category TEXT,
+                    attributes TEXT
+                )
+            ''')
+
+    def _migrate_fts(self):
+        """迁移 2：items 的全文索引及同步触发器，新建时用现有数据填充；SQLite 不支持时跳过"""
+        columns = ', '.join(SEARCH_COLUMNS)
+        if self._execute("SELECT 1 FROM sqlite_master WHERE name = 'items_fts'").fetchone():
+            return
+        try:
+            with self.transaction():
+                # trigram 分词按任意连续三个字符建索引，中文无需分词即可做子串匹配
+                self._execute(f"CREATE VIRTUAL TABLE items_fts USING fts5({columns}, attrs, tokenize='trigram')")
+                new_values = ', '.join(f'new.{column}' for column in SEARCH_COLUMNS)
+                self._execute(f'''
+                    CREATE TRIGGER items_fts_insert AFTER INSERT ON items BEGIN
+                        INSERT INTO items_fts (rowid, {columns}, attrs)
+                        VALUES (new.id, {new_values}, {FTS_ATTRS.format('new')});
+                    END
+                ''')
+                self._execute('''
+                    CREATE TRIGGER items_fts_delete AFTER DELETE ON items BEGIN
+                        DELETE FROM items_fts WHERE rowid = old.id;
+                    END
+                ''')
+                assignments = ', '.join(f'{column} = new.{column}' for column in SEARCH_COLUMNS)
+                self._execute(f'''
+                    CREATE TRIGGER items_fts_update AFTER UPDATE ON items BEGIN
+                        UPDATE items_fts SET {assignments}, attrs = {FTS_ATTRS.format('new')} WHERE rowid = old.id;
+                    END
+                ''')
+                self._execute(f'''INSERT INTO items_fts (rowid, {columns}, attrs)
+                                 SELECT id, {columns}, {FTS_ATTRS.format('items')} FROM items''')
+        except sqlite3.OperationalError:
+            pass
+
+    def _migrate_indexes(self):
+        """迁移 3：(name, category) 唯一索引及查找用索引
+
+        建唯一索引前，把已有的重复物品（同名同类别中 id 较小的）移入回收站，数据不丢失。
+        """
+        keep = 'SELECT MAX(id) FROM items GROUP BY name, category'
+        self._execute(f'''INSERT INTO deleted_items
+                         (name, description, address, contact_phone, contact_email, category, attributes)
+                         SELECT name, description, address, contact_phone, contact_email, category, attributes
+                         FROM items WHERE id NOT IN ({keep})''')
+        self._execute(f'DELETE FROM items WHERE id NOT IN ({keep})')
+        self._execute('CREATE UNIQUE INDEX IF NOT EXISTS items_name_category ON items (name, category)')
+        self._execute('CREATE INDEX IF NOT EXISTS items_category ON items (category)')
+        self._execute('CREATE INDEX IF NOT EXISTS deleted_items_name_category ON deleted_items (name, category)')
+
+    def _migrate_soft_delete(self):
+        """迁移 4：设置表、删除时间列；唯一索引改为只约束未删除的物品"""
+        self._execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+        for table in ('items', 'deleted_items'):
+            self._execute(f'ALTER TABLE {table} ADD COLUMN deleted_at TEXT')
+        self._execute("UPDATE deleted_items SET deleted_at = datetime('now')")
+        self._execute('DROP INDEX IF EXISTS items_name_category')
+        self._execute('CREATE UNIQUE INDEX items_name_category ON items (name, category) WHERE deleted_at IS NULL')
+        # 删除标记方式下回收站的分页和按删除时间清理使用的部分索引
+        self._execute('CREATE INDEX items_recycle_bin ON items (id) WHERE deleted_at IS NOT NULL')
+        self._execute('CREATE INDEX items_deleted_at ON items (deleted_at) WHERE deleted_at IS NOT NULL')
+        self._execute('CREATE INDEX deleted_items_deleted_at ON deleted_items (deleted_at)')
+
+    def _migrate_attribute_columns(self):
+        """迁移 5：扩展属性的生成列及其索引；已有的数量、保质期尽量转成有类型的值"""
+        valid = 'CASE WHEN json_valid(attributes) THEN attributes END'
+        # 旧数据中的中文键名是 \u 转义的，先转成原文，否则无法用路径取值
+        self._conn.create_function('_dump_attributes', 1,
+                                   lambda text: _dump_attributes(json.loads(text)), deterministic=True)
+        for table in ('items', 'deleted_items'):
+            self._execute(f"UPDATE {table} SET attributes = _dump_attributes(attributes) "
+                          f"WHERE json_valid(attributes) AND instr(attributes, '\\u') > 0")
+            # 数字样式的文本数量转成 JSON 数字，常见分隔符的日期转成 YYYY-MM-DD
+            quantity = f"trim(json_extract({valid}, '$.数量'))"
+            numeric = f"{quantity} GLOB '[0-9]*' AND {quantity} NOT GLOB '*[^0-9.]*' AND {quantity} NOT GLOB '*.*.*'"
+            self._execute(f"UPDATE {table} SET attributes = json_set(attributes, '$.数量', CAST({quantity} AS NUMERIC)) "
+                          f"WHERE json_type({valid}, '$.数量') = 'text' AND {numeric}")
+            expiry = f"replace(replace(trim(json_extract({valid}, '$.保质期')), '/', '-'), '.', '-')"
+            self._execute(f"UPDATE {table} SET attributes = json_set(attributes, '$.保质期', {expiry}) "
+                          f"WHERE json_type({valid}, '$.保质期') = 'text' AND date({expiry}) = {expiry}")
+            for key, column in ATTRIBUTE_COLUMNS.items():
+                path = f"{valid}, '$.{key}'"
+                kind = ATTRIBUTE_TYPES.get(key)
+                if kind == 'date':
+                    expression = f"CASE json_type({path}) WHEN 'text' THEN date(json_extract({path})) END"
+                elif kind == 'number':
+                    expression = f"CASE WHEN json_type({path}) IN ('integer', 'real') THEN json_extract({path}) END"
+                else:
+                    expression = f"CASE json_type({path}) WHEN 'text' THEN NULLIF(json_extract({path}), '') END"
+                self._execute(f'ALTER TABLE {table} ADD COLUMN {column} GENERATED ALWAYS AS ({expression}) VIRTUAL')
+        for column in ATTRIBUTE_COLUMNS.values():
+            self._execute(f'CREATE INDEX items_{column} ON items ({column}) WHERE {column} IS NOT NULL')
+
+    def _migrate_versions(self):
+        """迁移 6：行版本号（乐观并发控制）；触发器把每次修改记入 change_log，供其他连接增量刷新"""
+        for table in ('items', 'deleted_items'):
+            self._execute(f'ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+        # AUTOINCREMENT：清理旧记录后 seq 也不会重复使用
+        self._execute('''CREATE TABLE change_log (
+                             seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                             list TEXT NOT NULL,
+                             item_id INTEGER NOT NULL,
+                             action TEXT NOT NULL
+                         )''')
+        log = 'INSERT INTO change_log (list, item_id, action)'
+        # items 表中的行按 deleted_at 属于主列表或（删除标记方式下的）回收站
+        which = "CASE WHEN {0}.deleted_at IS NULL THEN 'items' ELSE 'deleted_items' END"
+        moved = '(old.deleted_at IS NULL) <> (new.deleted_at IS NULL)'
+        self._execute(f'''CREATE TRIGGER items_log_insert AFTER INSERT ON items BEGIN
+                             {log} VALUES ({which.format('new')}, new.id, 'added');
+                         END''')
+        self._execute(f'''CREATE TRIGGER items_log_update AFTER UPDATE ON items BEGIN
+                             {log} SELECT {which.format('new')}, new.id, 'updated' WHERE NOT {moved};
+                             {log} SELECT {which.format('old')}, old.id, 'removed' WHERE {moved};
+                             {log} SELECT {which.format('new')}, new.id, 'added' WHERE {moved};
+                         END''')
+        self._execute(f'''CREATE TRIGGER items_log_delete AFTER DELETE ON items BEGIN
+                             {log} VALUES ({which.format('old')}, old.id, 'removed');
+                         END''')
+        for event, row, action in (('INSERT', 'new', 'added'), ('UPDATE', 'new', 'updated'),
+                                   ('DELETE', 'old', 'removed')):
+            self._execute(f'''CREATE TRIGGER deleted_items_log_{event.lower()} AFTER {event} ON deleted_items BEGIN
+                                 {log} VALUES ('deleted_items', {row}.id, '{action}');
+                             END''')
+
+    def _migrate_facets(self):
+        """迁移 7：地区生成列；主列表按分面列组合计数的 facet_counts 表，由触发器随修改增减
+
+        facet_counts 中的空值记为 ''，这样才能作为主键去重。
+        """
+        position = 'min(' + ', '.join(f"coalesce(nullif(instr(address, '{suffix}'), 0), 99)"
+                                      for suffix in REGION_SUFFIXES) + ')'
+        region = f'CASE WHEN {position} BETWEEN 2 AND 8 THEN substr(address, 1, {position}) END'
+        for table in ('items', 'deleted_items'):
+            self._execute(f'ALTER TABLE {table} ADD COLUMN region GENERATED ALWAYS AS ({region}) VIRTUAL')
+        self._execute('CREATE INDEX items_region ON items (region) WHERE region IS NOT NULL')
+        columns = ', '.join(FACETS.values())
+        self._execute(f'''CREATE TABLE facet_counts (
+                             {', '.join(f"{column} TEXT NOT NULL" for column in FACETS.values())},
+                             count INTEGER NOT NULL,
+                             PRIMARY KEY ({columns})
+                         ) WITHOUT ROWID''')
+        key = f'({columns}) = ({FACET_VALUES.format("old")})'
+        increment = f'''INSERT INTO facet_counts ({columns}, count) SELECT {FACET_VALUES.format('new')}, 1
+                        WHERE new.deleted_at IS NULL
+                        ON CONFLICT ({columns}) DO UPDATE SET count = count + 1;'''
+        decrement = f'''UPDATE facet_counts SET count = count - 1 WHERE {key} AND old.deleted_at IS NULL;
+                        DELETE FROM facet_counts WHERE {key} AND count = 0;'''
+        self._execute(f'CREATE TRIGGER items_facets_insert AFTER INSERT ON items BEGIN {increment} END')
+        self._execute(f'CREATE TRIGGER items_facets_delete AFTER DELETE ON items BEGIN {decrement} END')
+        self._execute(f'''CREATE TRIGGER items_facets_update AFTER UPDATE OF category, address, attributes, deleted_at
+                         ON items BEGIN {decrement} {increment} END''')
+        self._execute(f'''INSERT INTO facet_counts ({columns}, count)
+                         SELECT {FACET_VALUES.format('items')}, COUNT(*) FROM items
+                         WHERE deleted_at IS NULL GROUP BY {columns}''')
+
+    def _migrate_sort_indexes(self):
+        """迁移 8：主列表有索引的排序列（INDEXED_SORT_COLUMNS）建索引（扩展属性列在迁移 5 已有部分索引）
+
+        索引中隐含 rowid，按 (列, id) 的键集分页只需读索引即可定位，再取一页的行。回收站
+        通常很小，不建这些索引。迁移时表可能还是空的，这里不收集统计信息，留给关闭时的
+        PRAGMA optimize 按实际数据量收集。
+        """
+        for column in INDEXED_SORT_COLUMNS:
+            self._execute(f'CREATE INDEX IF NOT EXISTS items_{column} ON items ({column})')
+
+    def _migrate_journal(self):
+        """迁移 9：操作日志，供撤销、重做和按时间点重建
+
+        journal 由触发器逐行追加修改前后的内容：新增只记 new，删除只记 old，更新只记变化的列。
+        journal_ops 每次操作（一个写事务）一行，记下它从 journal 的哪一条开始，日志本身不再
+        需要操作号；unit 为撤销单位（一次导入分多批写入，后续各批记为第一批的 op），target 为
+        撤销、重做所针对的撤销单位。日志随修改写在同一个事务中，不增加提交次数。
+        """
+        self._execute(f'''CREATE TABLE journal_ops (
+                             op INTEGER PRIMARY KEY AUTOINCREMENT,
+                             at TEXT NOT NULL DEFAULT ({JOURNAL_NOW}),
+                             action TEXT NOT NULL,
+                             unit INTEGER,
+                             target INTEGER,
+                             first_seq INTEGER NOT NULL
+                         )''')
+        self._execute('''CREATE TABLE journal (
+                             seq INTEGER PRIMARY KEY,
+                             tbl TEXT NOT NULL,
+                             item_id INTEGER NOT NULL,
+                             old TEXT,
+                             new TEXT
+                         )''')
+        pairs = ' UNION ALL '.join(f"SELECT '{column}' AS name, old.{column} AS o, new.{column} AS n"
+                                   for column in JOURNAL_COLUMNS)
+        for table in ('items', 'deleted_items'):
+            self._execute(f'''CREATE TRIGGER {table}_journal_insert AFTER INSERT ON {table} BEGIN
+                                 INSERT INTO journal (tbl, item_id, new) VALUES ('{table}', new.id, {JOURNAL_IMAGE.format('new')});
+                             END''')
+            self._execute(f'''CREATE TRIGGER {table}_journal_delete AFTER DELETE ON {table} BEGIN
+                                 INSERT INTO journal (tbl, item_id, old) VALUES ('{table}', old.id, {JOURNAL_IMAGE.format('old')});
+                             END''')
+            self._execute(f'''CREATE TRIGGER {table}_journal_update AFTER UPDATE ON {table} BEGIN
+                                 INSERT INTO journal (tbl, item_id, old, new)
+                                 SELECT '{table}', new.id, json_group_object(name, o), json_group_object(name, n)
+                                 FROM ({pairs}) WHERE o IS NOT n HAVING count(*);
+                             END''')
+        self._execute(f"INSERT INTO settings (key, value) VALUES ('journal_horizon', {JOURNAL_NOW})")
+
+    def _migrate_due_index(self):
+        """迁移 10：到期队列，即主列表中有保质期的物品按 (expires_on, id) 的部分索引
+
+        删除标记方式下 items_expires_on 也包括回收站中的行，按到期顺序取主列表物品时要逐个
+        跳过；这个索引只含主列表的行，取下一批到期的物品只需一次查找。
+        """
+        self._execute('CREATE INDEX items_due ON items (expires_on, id) '
+                      'WHERE expires_on IS NOT NULL AND deleted_at IS NULL')
+
+    def _migrate_fts_statistics(self):
+        """迁移 11：删除迁移 8 在表还很小时为全文索引影子表收集的统计信息（见 _drop_fts_statistics）"""
+        self._drop_fts_statistics()
+
+    def _migrate_text_sort_indexes(self):
+        """迁移 12：删除迁移 8 曾为描述、地址、手机、邮箱建的排序索引（见 INDEXED_SORT_COLUMNS）"""
+        for column in SORT_COLUMNS.values():
+            if column not in INDEXED_SORT_COLUMNS:
+                self._execute(f'DROP INDEX IF EXISTS items_{column}')
+
+    # 按顺序执行的迁移步骤，只能在末尾追加
+    MIGRATIONS = (_migrate_tables, _migrate_fts, _migrate_indexes, _migrate_soft_delete, _migrate_attribute_columns,
+                  _migrate_versions, _migrate_facets, _migrate_sort_indexes, _migrate_journal, _migrate_due_index,
+                  _migrate_fts_statistics, _migrate_text_sort_indexes)
+
+    # ---- 设置 ----
+
+    def get_setting(self, key, default=None):
+        """读取保存在数据库中的设置"""
+        with self._lock:
+            try:
+                row = self._execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+            except sqlite3.OperationalError:  # 尚未迁移的只读连接
+                return default
+        return row[0] if row else default
+
+    def set_setting(self, key, value):
+        """保存设置"""
+        with self.transaction():
+            self._execute('INSERT INTO settings (key, value) VALUES (?, ?) '
+                          'ON CONFLICT (key) DO UPDATE SET value = excluded.value', (key, str(value)))
+
+    def _view(self, deleted):
+        """主列表或回收站对应的 (物理表, 条件列表)，表的别名为 t"""
+        if not deleted:
+            return 'items', ['t.deleted_at IS NULL'] if self.soft_delete else []
+        if self.soft_delete:
+            return 'items', ['t.deleted_at IS NOT NULL']
+        return 'deleted_items', []
+
+    def set_storage_mode(self, mode):
+        """切换回收站的存储方式（见 STORAGE_MODES），已删除的物品随之迁移，会分配新的 id
+
+        日志中的 id 随之失效，切换前的操作日志全部清除，不能再撤销或重建到切换之前。
+        """
+        if mode not in STORAGE_MODES:
+            raise ValueError(f'未知的存储方式：{mode}')
+        columns = 'name, description, address, contact_phone, contact_email, category, attributes, deleted_at, version'
+        with self.transaction():
+            if mode == 'flag' and not self.soft_delete:
+                self._execute(f'INSERT INTO items ({columns}) SELECT {columns} FROM deleted_items ORDER BY id')
+                self._execute('DELETE FROM deleted_items')
+            elif mode == 'table' and self.soft_delete:
+                self._execute(f'''INSERT INTO deleted_items ({columns}) SELECT {columns} FROM items
+                                 WHERE deleted_at IS NOT NULL ORDER BY id''')
+                self._execute('DELETE FROM items WHERE deleted_at IS NOT NULL')
+            self.set_setting('storage_mode', mode)
+            self._truncate_journal()
+        self.soft_delete = mode == 'flag'
+        self.cache.clear()
+
+    def _query_sql(self, query):
+        """把查询条件转成 SQL，返回 (FROM 子句, 条件列表, 参数, 排序键表达式)
+
+        主列表的关键词搜索走全文索引并按相关度（bm25）排序，排序键为 (相关度, id)；模糊查找时
+        由 search_index 给出按相似度排好的 id，其后是其余按子串匹配的物品，排序键为 (名次, id)；
+        其余情况排序键为 (id,)。
+        指定了 sort 时排序键总是 (排序列, id)。
+        """
+        table, clauses = self._view(query.deleted)
+        params = []
+        keys = ('t.id',)
+        source = f'{table} AS t'
+        keyword = query.keyword
+        ranked = None
+        if keyword and query.fuzzy and not query.deleted and self.search_index is not None:
+            ranked = self.search_index.search(keyword)  # 索引未就绪或关键词太短时为 None
+        if ranked is not None:
+            # 索引只含名称、手机和邮箱：按相似度排好的物品在前，再接上按子串匹配（描述、地址、
+            # 扩展属性等）而不在其中的物品，名次都记为 len(ranked)，打开模糊查找不会少找到物品
+            matches, match_params = self._substring_ids(keyword, table)
+            source = (f'(SELECT value AS id, key AS k FROM json_each(?) UNION ALL '
+                      f'SELECT id, {len(ranked)} FROM ({matches}) WHERE id NOT IN (SELECT value FROM json_each(?))) '
+                      f'AS r JOIN {table} AS t ON t.id = r.id')
+            params += [_ids(ranked), *match_params, _ids(ranked)]
+            keys = ('r.k', 't.id')
+        elif keyword and self.fts and table == 'items':
+            source = 'items_fts AS f JOIN items AS t ON t.id = f.rowid'
+            if len(keyword) >= 3:
+                # 三个字符以上走 trigram 索引；短语查询即子串匹配
+                clauses.append('items_fts MATCH ?')
+                params.append('"' + keyword.replace('"', '""') + '"')
+                keys = ('f.rank', 't.id')
+            else:
+                # 少于三个字符无法使用 trigram 索引，扫描索引中的文本（不含 JSON 键名）
+                clauses.append('(' + ' OR '.join(f"f.{column} LIKE ? ESCAPE '\\'"
+                                                 for column in SEARCH_COLUMNS + ('attrs',)) + ')')
+                params += [_like_pattern(keyword)] * (len(SEARCH_COLUMNS) + 1)
+        elif keyword:
+            clauses.append('(' + ' OR '.join(f"t.{column} LIKE ? ESCAPE '\\'"
+                                             for column in SEARCH_COLUMNS + ('attributes',)) + ')')
+            params += [_like_pattern(keyword)] * (len(SEARCH_COLUMNS) + 1)
+        if query.category:
+            if SORT_COLUMNS.get(query.sort) in INDEXED_SORT_COLUMNS and SORT_COLUMNS[query.sort] != 'category':
+                # 排序时沿排序列的索引按序扫描、边扫描边筛选类别，取够一页即停；一元 + 阻止查询
+                # 规划器改用类别索引取出整个类别再排序（类别只有几个，每个都占很大比例）
+                clauses.append('+t.category = ?')
+            else:
+                clauses.append('t.category = ?')
+            params.append(query.category)
+        if query.region:
+            clauses.append('t.region = ?')
+            params.append(query.region)
+        for key, operator, value in query.filters:
+            column = ATTRIBUTE_COLUMNS.get(key)
+            if column is None:
+                raise ValueError(f'不能按“{key}”筛选')
+            if operator not in FILTER_OPERATORS:
+                raise ValueError(f'不支持的运算符：{operator}')
+            # 生成列有索引，比较在 SQL 中完成，不必把行取到 Python 中再解析 JSON
+            clauses.append(f't.{column} {operator} ?')
+            params.append(attribute_value(key, value))
+        if query.sort:
+            keys = (f't.{SORT_COLUMNS[query.sort]}', 't.id')
+        return f' FROM {source}', clauses, params, keys
+
+    def _substring_ids(self, keyword, table):
+        """按子串匹配关键词的物品 id 的子查询，返回 (SQL, 参数)；匹配规则与不用模糊查找时相同"""
+        if self.fts and table == 'items':
+            if len(keyword) >= 3:
+                phrase = '"' + keyword.replace('"', '""') + '"'
+                return 'SELECT rowid AS id FROM items_fts WHERE items_fts MATCH ?', [phrase]
+            source, id_column, columns = 'items_fts', 'rowid', SEARCH_COLUMNS + ('attrs',)
+        else:
+            source, id_column, columns = table, 'id', SEARCH_COLUMNS + ('attributes',)
+        like = ' OR '.join(f"{column} LIKE ? ESCAPE '\\'" for column in columns)
+        return f'SELECT {id_column} AS id FROM {source} WHERE {like}', [_like_pattern(keyword)] * len(columns)
+
+    # ---- 查询 ----
+
+    def list_items(self):
+        """返回物品列表中的全部物品"""
+        return self._list(deleted=False)
+
+    def list_deleted_items(self):
+        """返回回收站中的全部物品"""
+        return self._list(deleted=True)
+
+    def _list(self, deleted):
+        table, clauses = self._view(deleted)
+        with self._lock:
+            rows = self._execute(f'SELECT {T_COLUMNS} FROM {table} AS t{self._where(clauses)}').fetchall()
+        return [Item.from_row(row) for row in rows]
+
+    @staticmethod
+    def _where(clauses):
+        return ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+
+    def iter_items(self, deleted=False, batch_size=1000):
+        """按 id 顺序逐批（fetchmany）读出主列表或回收站的全部物品，内存占用与表的大小无关
+
+        迭代期间游标一直打开，长时间的遍历应在 reader() 得到的只读连接上进行。
+        """
+        table, clauses = self._view(deleted)
+        cursor = self._conn.cursor()
+        cursor.execute(f'SELECT {T_COLUMNS} FROM {table} AS t{self._where(clauses)} ORDER BY t.id')
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield Item.from_row(row)
+        finally:
+            cursor.close()
+
+    def page(self, query, after=None, before=None, limit=PAGE_SIZE, last=False):
+        """按键集分页取一页物品，返回按显示顺序排列的 [(键, 物品)]
+
+        after 取该键之后的一页，before 取该键之前的一页，last 取最后一页；
+        都不指定时取第一页。键是排序键元组（见 _query_sql），分页走索引，与表的大小无关。
+        """
+        source, clauses, params, keys = self._query_sql(query)
+        bound = after if after is not None else before
+        if bound is not None and len(bound) != len(keys):
+            raise ValueError('分页位置与查询条件不符')
+        reverse = before is not None or last  # 从后往前取，取到后再倒过来
+        increasing = reverse == (query.sort is not None and query.descending)
+        select = f'SELECT {", ".join(keys)}, {T_COLUMNS}{source}'
+        order = ', '.join(f'{key} {"ASC" if increasing else "DESC"}' for key in keys)
+        rows = []
+        with self._lock:
+            for clause, bound_params in self._keyset(keys, bound, increasing, reverse, query.sort is not None):
+                sql = f'{select}{self._where(clauses + clause)} ORDER BY {order} LIMIT ?'
+                rows += self._execute(sql, params + bound_params + [limit - len(rows)]).fetchall()
+                if len(rows) >= limit:
+                    break
+        if reverse:
+            rows.reverse()
+        return [self._entry(query, row, len(keys)) for row in rows]
+
+    @staticmethod
+    def _keyset(keys, bound, increasing, reverse, nullable):
+        """键集分页的条件：[(条件列表, 参数)]，按顺序各取一段，直到取够一页
+
+        排序列（nullable）可能为空，空值排在最后；行值比较遇到空值不成立，所以非空值和
+        空值分成两段：非空值沿该列的索引查找（条件中写明 IS NOT NULL 才能用上扩展属性的
+        部分索引），空值按 id 查找。
+        """
+        operator = '>' if increasing else '<'
+        if not nullable:
+            if bound is None:
+                return [([], [])]
+            return [([f'({", ".join(keys)}) {operator} ({", ".join("?" * len(keys))})'], list(bound))]
+        column, id_column = keys
+        values, nulls = [f'{column} IS NOT NULL'], [f'{column} IS NULL']
+        if bound is None:
+            return [(nulls, []), (values, [])] if reverse else [(values, []), (nulls, [])]
+        if bound[0] is None:
+            return [(nulls + [f'{id_column} {operator} ?'], [bound[1]])] + ([(values, [])] if reverse else [])
+        return [(values + [f'({column}, {id_column}) {operator} (?, ?)'], list(bound))] + ([] if reverse else [(nulls, [])])
+
+    def _entry(self, query, row, key_count):
+        item = Item.from_row(row[key_count:])
+        self.cache.put(query.table, item)
+        return tuple(row[:key_count]), item
+
+    def fetch(self, query, ids):
+        """取 ids 中仍满足查询条件的物品，返回 [(键, 物品)]"""
+        source, clauses, params, keys = self._query_sql(query)
+        where = self._where(clauses + [f't.id {IN_IDS}'])
+        with self._lock:
+            rows = self._execute(f'SELECT {", ".join(keys)}, {T_COLUMNS}{source}{where}', params + [_ids(ids)])
+            return [self._entry(query, row, len(keys)) for row in rows]
+
+    def count(self, query):
+        """统计满足查询条件的物品数"""
+        source, clauses, params, _ = self._query_sql(query)
+        with self._lock:
+            return self._execute(f'SELECT COUNT(*){source}{self._where(clauses)}', params).fetchone()[0]
+
+    def get_item(self, item_id, deleted=False):
+        """按 id 取物品，不存在时返回 None；最近显示过或取过的物品直接从缓存返回"""
+        logical = ItemQuery(deleted=deleted).table
+        item = self.cache.get(logical, item_id)
+        if item is not None:
+            return item
+        item = self._read_item(deleted, item_id)
+        if item is not None:
+            self.cache.put(logical, item)
+        return item
+
+    def _read_item(self, deleted, item_id):
+        """不经缓存直接从数据库读取物品"""
+        table, clauses = self._view(deleted)
+        with self._lock:
+            row = self._execute(f'SELECT {T_COLUMNS} FROM {table} AS t{self._where(clauses + ["t.id = ?"])}',
+                                (item_id,)).fetchone()
+        return Item.from_row(row) if row else None
+
+    def search_items(self, keyword='', category=None, filters=()):
+        """按关键词（子串匹配）、类别和扩展属性（见 ItemQuery）查找物品，有全文索引时按相关度排序"""
+        source, clauses, params, keys = self._query_sql(ItemQuery(keyword=keyword, category=category,
+                                                                  filters=filters))
+        sql = f'SELECT {T_COLUMNS}{source}{self._where(clauses)} ORDER BY {", ".join(keys)}'
+        with self._lock:
+            rows = self._execute(sql, params).fetchall()
+        return [Item.from_row(row) for row in rows]
+
+    # ---- 分面统计 ----
+
+    def facets(self, query, today=None):
+        """满足查询条件的物品按 FACETS 分组计数，返回 {分面名: [(值, 物品数)]}
+
+        除保质期按 EXPIRY_BUCKETS 分段并按区间顺序排列外，各分面按物品数从多到少排列，
+        没有值的物品不计入。主列表上不含关键词、只按类别、地区和分面属性筛选的查询直接读
+        facet_counts 汇总表；其余查询对匹配的行做一次 GROUP BY。结果按查询条件缓存，
+        change_log 有新的修改（来自任何连接）时失效。
+        """
+        today = today or date.today()
+        cache_key = (query.signature, today)
+        seq = self.last_change()
+        with self._lock:
+            cached = self._facet_cache.get(cache_key)
+            if cached is not None and cached[0] == seq:
+                self._facet_cache.move_to_end(cache_key)
+                return cached[1]
+            summary = self._facet_summary(query)
+            if summary is None:
+                source, clauses, params, _ = self._query_sql(query)
+                columns = ', '.join(f't.{column}' for column in FACETS.values())
+                summary = self._execute(f'SELECT {columns}, COUNT(*){source}{self._where(clauses)} '
+                                        f'GROUP BY {columns}', params)
+            result = _group_facets(summary, today)
+            self._facet_cache[cache_key] = (seq, result)
+            if len(self._facet_cache) > FACET_CACHE_SIZE:
+                self._facet_cache.popitem(last=False)
+        return result
+
+    def _facet_summary(self, query):
+        """能由 facet_counts 回答时返回其中满足条件的行，否则返回 None"""
+        if query.deleted or query.keyword:
+            return None
+        clauses, params = ['count > 0'], []
+        for column, value in (('category', query.category), ('region', query.region)):
+            if value:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        for key, operator, value in query.filters:
+            column = ATTRIBUTE_COLUMNS.get(key)
+            if column not in FACETS.values() or operator not in FILTER_OPERATORS:
+                return None
+            clauses.append(f"{column} != '' AND {column} {operator} ?")
+            params.append(attribute_value(key, value))
+        return self._execute(f'SELECT {", ".join(FACETS.values())}, count FROM facet_counts{self._where(clauses)}',
+                             params)
+
+    # ---- 修改通知 ----
+
+    def data_version(self):
+        """PRAGMA data_version：其他连接（包括其他进程）每提交一次修改，本连接读到的值就会变化，开销极小"""
+        with self._lock:
+            return self._execute('PRAGMA data_version').fetchone()[0]
+
+    def last_change(self):
+        """change_log 中最新的序号，作为 changes_since 的起点"""
+        with self._lock:
+            row = self._execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, seq):
+        """返回序号 seq 之后提交的修改 (ChangeSet, 最新序号)
+
+        所有连接（包括本进程的其他连接）的修改都会记入；同一行的修改重复应用是安全的。
+        seq 之后的记录已被 prune_change_log 清理时 ChangeSet 为 None，调用方应整表重新加载。
+        """
+        changes = ChangeSet()
+        with self._lock:
+            first = self._execute('SELECT MIN(seq) FROM change_log').fetchone()[0]
+            latest = self.last_change()
+            if latest > seq and (first is None or first > seq + 1):
+                return None, latest
+            rows = self._execute('SELECT seq, list, item_id, action FROM change_log WHERE seq > ? ORDER BY seq',
+                                 (seq,)).fetchall()
+        for _, table, item_id, action in rows:
+            getattr(changes, action)[table].append(item_id)
+        return changes, rows[-1][0] if rows else seq
+
+    # ---- 修改 ----
+
+    @_invalidates_cache
+    def add_item(self, name, description, address, contact_phone, contact_email, category, attributes):
+        """添加物品；名称和类别重复时抛出 DuplicateItemError，扩展属性格式不对时抛出 ValueError"""
+        attributes = normalize_attributes(attributes)
+        changes = ChangeSet()
+        with self.transaction():
+            self._begin_op('add')
+            # 由唯一索引判断重复，不再先查询
+            cursor = self._execute(
+                '''INSERT INTO items (name, description, address, contact_phone, contact_email, category, attributes)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (name, category) WHERE deleted_at IS NULL DO NOTHING''',
+                (name, description, address, contact_phone, contact_email, category, _dump_attributes(attributes)))
+            if not cursor.rowcount:
+                raise DuplicateItemError(name, category)
+            changes.added['items'].append(cursor.lastrowid)
+        return changes
+
+    @_invalidates_cache
+    def update_item(self, item_id, name, description, address, contact_phone, contact_email, category, attributes,
+                    expected_version=None):
+        """更新物品；改成与其他物品相同的名称和类别时抛出 DuplicateItemError，扩展属性格式不对时抛出 ValueError
+
+        指定 expected_version（读取时的 item.version）时，只有版本号未变才更新，否则说明物品
+        已被其他用户修改或删除，抛出 StaleItemError，不会覆盖别人的修改。
+        """
+        attributes = normalize_attributes(attributes)
+        changes = ChangeSet()
+        with self.transaction():
+            self._begin_op('update')
+            try:
+                cursor = self._execute('''UPDATE items
+                                          SET name = ?, description = ?, address = ?, contact_phone = ?,
+                                              contact_email = ?, category = ?, attributes = ?, version = version + 1
+                                          WHERE id = ? AND deleted_at IS NULL AND (? IS NULL OR version = ?)''',
+                                       (name, description, address, contact_phone, contact_email, category,
+                                        _dump_attributes(attributes), item_id, expected_version, expected_version))
+            except sqlite3.IntegrityError:
+                raise DuplicateItemError(name, category) from None
+            if cursor.rowcount:
+                changes.updated['items'].append(item_id)
+            elif expected_version is not None:
+                raise StaleItemError(item_id, self._read_item(False, item_id))
+        return changes
+
+    def _existing_ids(self, deleted, ids):
+        """ids 中确实在主列表（或回收站）中的 id"""
+        table, clauses = self._view(deleted)
+        sql = f'SELECT t.id FROM {table} AS t{self._where(clauses + [f"t.id {IN_IDS}"])}'
+        return [row[0] for row in self._execute(sql, (_ids(ids),))]
+
+    def _move(self, source, target, ids):
+        """把 ids 对应的行从 source 表整体移到 target 表，返回新 id 列表（新 id 由 target 表重新分配）"""
+        deleted_at = "datetime('now')" if target == 'deleted_items' else 'NULL'
+        # 写事务中没有其他写入者，AUTOINCREMENT 分配的新 id 都大于插入前的最大 id
+        last_id = self._execute(f'SELECT COALESCE(MAX(id), 0) FROM {target}').fetchone()[0]
+        self._execute(f'''INSERT INTO {target} (name, description, address, contact_phone, contact_email, category,
+                                             attributes, deleted_at, version)
+                         SELECT name, description, address, contact_phone, contact_email, category, attributes,
+                                {deleted_at}, version + 1
+                         FROM {source} WHERE id {IN_IDS} ORDER BY id''', (_ids(ids),))
+        self._execute(f'DELETE FROM {source} WHERE id {IN_IDS}', (_ids(ids),))
+        return [row[0] for row in self._execute(f'SELECT id FROM {target} WHERE id > ?', (last_id,))]
+
+    @_invalidates_cache
+    def delete_items(self, item_ids):
+        """将物品移动到回收站（整批一条语句；删除标记方式下是 UPDATE，id 不变）"""
+        changes = ChangeSet()
+        with self.transaction():
+            moved = self._existing_ids(False, item_ids)
+            if not moved:
+                return changes
+            self._begin_op('delete')
+            self._to_recycle_bin(moved, changes)
+        return changes
+
+    def _to_recycle_bin(self, moved, changes):
+        """把主列表中的 moved 移入回收站，记入 changes"""
+        changes.removed['items'] += moved
+        if self.soft_delete:
+            self._execute(f"UPDATE items SET deleted_at = datetime('now'), version = version + 1 WHERE id {IN_IDS}",
+                          (_ids(moved),))
+            changes.added['deleted_items'] += moved
+        else:
+            changes.added['deleted_items'] += self._move('items', 'deleted_items', moved)
+
+    @_invalidates_cache
+    def merge_items(self, keep_id, duplicate_ids):
+        """合并重复物品：duplicate_ids 移入回收站，保留的物品中空着的字段和缺少的扩展属性用它们的值补上
+
+        按 duplicate_ids 的顺序取第一个非空的值。保留的物品已不在主列表时抛出 StaleItemError；
+        已不在主列表的重复物品跳过。合并作为一次操作记入操作日志，可以撤销。
+        """
+        changes = ChangeSet()
+        with self.transaction():
+            keep = self._read_item(False, keep_id)
+            if keep is None:
+                raise StaleItemError(keep_id, None)
+            duplicates = [item for item in (self._read_item(False, item_id) for item_id in duplicate_ids
+                                            if item_id != keep_id) if item]
+            if not duplicates:
+                return changes
+            self._begin_op('merge')
+            fields = {field: getattr(keep, field) for field in MERGE_FIELDS}
+            attributes = dict(keep.attributes)
+            for item in duplicates:
+                for field in MERGE_FIELDS:
+                    if not fields[field] and getattr(item, field):
+                        fields[field] = getattr(item, field)
+                for key, value in item.attributes.items():
+                    if attributes.get(key) in (None, '') and value not in (None, ''):
+                        attributes[key] = value
+            if any(fields[field] != getattr(keep, field) for field in MERGE_FIELDS) or attributes != keep.attributes:
+                assignments = ', '.join(f'{field} = ?' for field in MERGE_FIELDS)
+                self._execute(f'UPDATE items SET {assignments}, attributes = ?, version = version + 1 WHERE id = ?',
+                              (*fields.values(), _dump_attributes(attributes), keep_id))
+                changes.updated['items'].append(keep_id)
+            self._to_recycle_bin([item.id for item in duplicates], changes)
+        return changes
+
+    def recover_conflicts(self, deleted_ids):
+        """返回 [(回收站物品, 主列表中同名同类别物品的 id)]，供恢复前一次性确认如何处理"""
+        table, clauses = self._view(True)
+        where = self._where(clauses + [f't.id {IN_IDS}'])
+        with self._lock:
+            rows = self._execute(f'''SELECT {T_COLUMNS}, i.id FROM {table} AS t
+                                     JOIN items AS i ON i.name = t.name AND i.category = t.category
+                                                    AND i.deleted_at IS NULL
+                                     {where} ORDER BY t.id''', (_ids(deleted_ids),)).fetchall()
+        return [(Item.from_row(row[:-1]), row[-1]) for row in rows]
+
+    @_invalidates_cache
+    def recover_items(self, deleted_ids, replace=False):
+        """从回收站恢复物品（整批在一个事务中完成）
+
+        主列表已有同名同类别物品时：replace 为 True 则全部替换（现有物品被删除），为 False
+        则全部跳过，也可以是需要替换的回收站 id 集合（其余冲突的跳过）。所选物品之间同名
+        同类别时只恢复最近删除的一个，其余留在回收站。
+        """
+        changes = ChangeSet()
+        table, clauses = self._view(True)
+        with self.transaction():
+            # 所选物品之间重复时取 id 最大（最近删除）的一个
+            selected = [row[0] for row in self._execute(
+                f'SELECT MAX(t.id) FROM {table} AS t{self._where(clauses + [f"t.id {IN_IDS}"])} '
+                f'GROUP BY t.name, t.category', (_ids(deleted_ids),))]
+            skipped, replaced = set(), []
+            for item, existing_id in self.recover_conflicts(selected):
+                if replace is True or (replace and item.id in replace):
+                    replaced.append(existing_id)
+                else:
+                    skipped.add(item.id)
+            recovered = [deleted_id for deleted_id in selected if deleted_id not in skipped]
+            if not recovered:
+                return changes
+            self._begin_op('recover')
+            if replaced:
+                self._execute(f'DELETE FROM items WHERE id {IN_IDS}', (_ids(replaced),))
+                changes.removed['items'] += replaced
+            changes.removed['deleted_items'] += recovered
+            if self.soft_delete:
+                self._execute(f'UPDATE items SET deleted_at = NULL, version = version + 1 WHERE id {IN_IDS}',
+                              (_ids(recovered),))
+                changes.added['items'] += recovered
+            else:
+                changes.added['items'] += self._move('deleted_items', 'items', recovered)
+        return changes
+
+    @_invalidates_cache
+    def purge_items(self, deleted_ids):
+        """从回收站永久删除物品（整批一条 DELETE）；物品的内容记在操作日志中，可以撤销"""
+        return self._purge(deleted_ids, 'purge')
+
+    def _purge(self, deleted_ids, action):
+        changes = ChangeSet()
+        table, _ = self._view(True)
+        with self.transaction():
+            purged = self._existing_ids(True, deleted_ids)
+            if purged:
+                self._begin_op(action)
+                self._execute(f'DELETE FROM {table} WHERE id {IN_IDS}', (_ids(purged),))
+                changes.removed['deleted_items'] += purged
+        return changes
+
+    @_invalidates_cache
+    def purge_expired(self, retention_days=None, batch_size=500):
+        """永久删除回收站中超过保留期的物品，每次最多 batch_size 个（删除时间最早的先删）
+
+        retention_days 默认取设置 retention_days，为 0 或未设置时不清理。返回 ChangeSet；
+        删除的数量等于 batch_size 时说明可能还有，调用方可稍后继续。
+        """
+        if retention_days is None:
+            retention_days = int(self.get_setting('retention_days', 0))
+        if retention_days <= 0:
+            return ChangeSet()
+        table, clauses = self._view(True)
+        where = self._where(clauses + ["t.deleted_at < datetime('now', ?)"])
+        with self._lock:
+            expired = [row[0] for row in self._execute(
+                f'SELECT t.id FROM {table} AS t{where} ORDER BY t.deleted_at LIMIT ?',
+                (f'-{retention_days} days', batch_size))]
+        # 自动清理不进入撤销栈，以免用户撤销时撤掉的是后台清理而不是自己的操作
+        return self._purge(expired, 'purge_expired') if expired else ChangeSet()
+
+    def due_items(self, before, after=None, ids=None, limit=DUE_LIMIT):
+        """主列表中保质期早于 before（YYYY-MM-DD）的物品，按 (保质期, id) 排列，返回 [(保质期, 物品)]
+
+        after 为 (保质期, id) 时只取排在它之后的，调用方记下取到的最后一个，下次从那里接着取；
+        ids 给出时只在这些物品中找。沿 items_due 索引查找，代价只与取出的行数有关。
+        """
+        clauses, params = ['t.expires_on IS NOT NULL', 't.deleted_at IS NULL', 't.expires_on < ?'], [before]
+        if ids is not None:
+            source = 'items AS t'
+            clauses.append(f't.id {IN_IDS}')
+            params.append(_ids(ids))
+        else:
+            # 查询规划器会选中同样可用的 items_expires_on，删除标记方式下它还含回收站的行
+            source = 'items AS t INDEXED BY items_due'
+        # 行值比较只能按保质期定位，同一天的物品要逐个跳过；分成同一天、之后两段各自查找
+        segments = [([], [])] if after is None else [(['t.expires_on = ?', 't.id > ?'], list(after)),
+                                                      (['t.expires_on > ?'], [after[0]])]
+        rows = []
+        with self._lock:
+            for extra, extra_params in segments:
+                rows += self._execute(f'SELECT t.expires_on, {T_COLUMNS} FROM {source}{self._where(clauses + extra)} '
+                                      f'ORDER BY t.expires_on, t.id LIMIT ?',
+                                      params + extra_params + [limit - len(rows)]).fetchall()
+                if len(rows) >= limit:
+                    break
+        return [(row[0], Item.from_row(row[1:])) for row in rows]
+
+    @_invalidates_cache
+    def expire_items(self, today=None, batch_size=500):
+        """把主列表中已过保质期（早于 today，默认今天）的物品移入回收站，每次最多 batch_size 个
+
+        返回 ChangeSet；移走的数量等于 batch_size 时说明可能还有，调用方可稍后继续。
+        """
+        changes = ChangeSet()
+        with self.transaction():
+            expired = [item.id for _, item in self.due_items((today or date.today()).isoformat(),
+                                                               limit=batch_size)]
+            if expired:
+                # 与回收站的自动清理一样不进入撤销栈，移走的物品可以从回收站恢复
+                self._begin_op('expire')
+                self._to_recycle_bin(expired, changes)
+        return changes
+
+    def vacuum_step(self, pages=256):
+        """增量回收最多 pages 个空闲页，把删除腾出的空间还给文件系统"""
+        with self._lock:
+            if self._depth == 0:
+                self._execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+
+    def prune_change_log(self, keep=CHANGE_LOG_KEEP):
+        """只保留最近 keep 条修改记录"""
+        with self.transaction():
+            self._execute('DELETE FROM change_log WHERE seq <= (SELECT MAX(seq) FROM change_log) - ?', (keep,))
+
+    def import_items(self, records, on_duplicate='update', batch_size=10000, progress=None):
+        """批量导入物品，返回写入的行数
+
+        records 是 (name, description, address, contact_phone, contact_email, category, attributes)
+        元组的可迭代对象，attributes 为已按 normalize_attributes 统一格式的字典（item_io.validate
+        会完成这一步）；每 batch_size 条用一次 executemany 在一个事务中写入。
+        on_duplicate 为 'update' 时覆盖同名同类别的现有物品，为 'skip' 时保留现有物品。
+        progress(已处理条数) 在每批提交后调用。
+
+        每批的事务中先删除 IMPORT_DEFERRED_TRIGGERS，写完后用 _fill_imported 一次补上新增行的
+        全文索引、修改记录、分面计数和操作日志，再按原定义重建触发器。删除和重建触发器会改变
+        数据库的结构版本，其他连接在每批之后要重新编译一次各自的语句。覆盖现有物品仍由更新触发器
+        逐行处理；同一批中同名同类别的记录先合并为一条（'update' 取最后一条，'skip' 取第一条），
+        否则后一条会覆盖本批刚新增、还没有补上索引和日志的行。
+        """
+        if on_duplicate == 'update':
+            conflict = '''DO UPDATE SET description = excluded.description, address = excluded.address,
+                          contact_phone = excluded.contact_phone, contact_email = excluded.contact_email,
+                          attributes = excluded.attributes, version = items.version + 1'''
+        elif on_duplicate == 'skip':
+            conflict = 'DO NOTHING'
+        else:
+            raise ValueError(f'未知的重复处理方式：{on_duplicate}')
+        sql = f'''INSERT INTO items (name, description, address, contact_phone, contact_email, category, attributes)
+                  VALUES (?, ?, ?, ?, ?, ?, ?)
+                  ON CONFLICT (name, category) WHERE deleted_at IS NULL {conflict}'''
+        rows = ((*record[:6], _dump_attributes(record[6])) for record in records)
+        processed = written = 0
+        # 各批分别提交，撤销时作为一次操作整体撤销；撤销单位是第一个真正写入了行的批次，
+        # 之前全部跳过（重复）的批次没有日志，不能作为撤销单位
+        unit = None
+        names = ', '.join('?' * len(IMPORT_DEFERRED_TRIGGERS))
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            processed += len(batch)
+            batch = _merge_duplicates(batch, on_duplicate == 'update')
+            with self.transaction():
+                op = self._begin_op('import', unit)
+                triggers = self._execute(f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+                                         f"AND name IN ({names})", IMPORT_DEFERRED_TRIGGERS).fetchall()
+                for name, _ in triggers:
+                    self._execute(f'DROP TRIGGER {name}')
+                # AUTOINCREMENT：新增的行 id 都大于现有的最大 id
+                first = self._execute('SELECT COALESCE(MAX(id), 0) + 1 FROM items').fetchone()[0]
+                with PROFILER.timed('sql'):
+                    count = self._conn.executemany(sql, batch).rowcount
+                written += count
+                if count and unit is None:
+                    unit = op
+                self._fill_imported(first, {name for name, _ in triggers})
+                for _, definition in triggers:
+                    self._execute(definition)
+            self.cache.clear()  # 覆盖了哪些物品不得而知，整个缓存作废
+            if progress:
+                progress(processed)
+        return written
+
+    def _fill_imported(self, first, deferred):
+        """替暂停的触发器（deferred 为其名称）为 id >= first 的新行补上全文索引、修改记录、分面计数和操作日志"""
+        imported = 'FROM items WHERE id >= ?'
+        if 'items_log_insert' in deferred:
+            self._execute(f"INSERT INTO change_log (list, item_id, action) SELECT 'items', id, 'added' {imported}",
+                          (first,))
+        if 'items_fts_insert' in deferred:
+            columns = ', '.join(SEARCH_COLUMNS)
+            self._execute(f'''INSERT INTO items_fts (rowid, {columns}, attrs)
+                             SELECT id, {columns}, {FTS_ATTRS.format('items')} {imported}''', (first,))
+        if 'items_facets_insert' in deferred:
+            columns = ', '.join(FACETS.values())
+            self._execute(f'''INSERT INTO facet_counts ({columns}, count)
+                             SELECT {FACET_VALUES.format('items')}, COUNT(*) {imported} AND deleted_at IS NULL
+                             GROUP BY {columns}
+                             ON CONFLICT ({columns}) DO UPDATE SET count = count + excluded.count''', (first,))
+        if 'items_journal_insert' in deferred:
+            self._execute(f'''INSERT INTO journal (tbl, item_id, new)
+                             SELECT 'items', id, {JOURNAL_IMAGE.format('items')} {imported} ORDER BY id''', (first,))
+
+    # ---- 操作日志 ----
+
+    def _begin_op(self, action, unit=None, target=None):
+        """在当前写事务中开始一次操作，此后记入 journal 的修改都属于它；返回操作号"""
+        return self._execute('INSERT INTO journal_ops (action, unit, target, first_seq) '
+                             'SELECT ?, ?, ?, COALESCE(MAX(seq), 0) + 1 FROM journal',
+                             (action, unit, target)).lastrowid
+
+    def history(self):
+        """可撤销和可重做的操作：([(撤销单位, 操作)], [(撤销单位, 操作)])，最近的在最后
+
+        操作为 UNDOABLE_ACTIONS 的键。由 journal_ops 按顺序推算：撤销把操作从撤销栈移到重做栈，
+        重做反之，新的操作清空重做栈，没有修改任何行的操作不计入。所有连接（包括 HTTP 服务）
+        的操作都在其中。
+
+        推算是增量的：只按主键读取上次之后新增的操作；日志被清理（最早的操作变了）或倒回
+        （最新的操作比上次读到的还早）时才从头推算。
+        """
+        with self._lock:
+            oldest, newest = self._execute('SELECT (SELECT MIN(op) FROM journal_ops), '
+                                           '(SELECT MAX(op) FROM journal_ops)').fetchone()
+            state = self._history
+            if state is None or state[0] != oldest or state[1] > (newest or 0):
+                state = (oldest, 0, {}, [], [])
+            _, last, actions, undo, redo = state
+            # 日志末尾的序号与操作在同一条语句中读取，彼此一致
+            ops = self._execute('SELECT op, action, COALESCE(unit, op), target, first_seq, '
+                                '(SELECT COALESCE(MAX(seq), 0) + 1 FROM journal) '
+                                'FROM journal_ops WHERE op > ? ORDER BY op', (last,)).fetchall()
+            for index, (op, action, unit, target, first_seq, end) in enumerate(ops):
+                following = ops[index + 1][4] if index + 1 < len(ops) else end
+                if action == 'undo' and target in undo:
+                    undo.remove(target)
+                    redo.append(target)
+                elif action == 'redo' and target in redo:
+                    redo.remove(target)
+                    undo.append(target)
+                elif action in UNDOABLE_ACTIONS and unit == op and following > first_seq:
+                    actions[op] = action
+                    undo.append(op)
+                    for cleared in redo:
+                        del actions[cleared]
+                    redo.clear()
+            self._history = (oldest, ops[-1][0] if ops else last, actions, undo, redo)
+            return [(unit, actions[unit]) for unit in undo], [(unit, actions[unit]) for unit in redo]
+
+    @_invalidates_cache
+    def undo(self):
+        """撤销最近一次可撤销的操作，返回 ChangeSet（没有可撤销的操作时为空）
+
+        涉及的物品之后又被修改过时抛出 UndoConflictError，不做任何修改。撤销本身也记入日志，
+        可以重做；恢复的行保留原来的 id，版本号继续递增，基于旧版本的编辑保存时会被发现。
+        """
+        return self._replay('undo')
+
+    @_invalidates_cache
+    def redo(self):
+        """重做最近一次撤销的操作，返回 ChangeSet；冲突时同 undo"""
+        return self._replay('redo')
+
+    def _replay(self, action):
+        with self.transaction():
+            undo, redo = self.history()
+            stack = undo if action == 'undo' else redo
+            if not stack:
+                return ChangeSet()
+            unit, undone = stack[-1]
+            entries = self._unit_entries(unit)
+            if action == 'undo':
+                # 撤销即把每条修改的前后内容对调，按相反的顺序重放
+                entries = [(table, item_id, new, old) for table, item_id, old, new in reversed(entries)]
+            self._check_entries(entries, undone)
+            seq = self.last_change()
+            self._begin_op(action, target=unit)
+            try:
+                for entry in entries:
+                    self._apply_entry(*entry)
+            except sqlite3.IntegrityError:
+                raise UndoConflictError(undone) from None
+            changes, _ = self.changes_since(seq)
+        return changes
+
+    def _unit_entries(self, unit):
+        """撤销单位中各操作记下的修改 [(表, id, 修改前, 修改后)]，按发生的顺序"""
+        # 各批的操作号都不小于撤销单位本身，按主键从它开始读；下一个操作的起点也按主键定位
+        ranges = self._execute('''SELECT o.first_seq,
+                                         COALESCE((SELECT n.first_seq FROM journal_ops AS n WHERE n.op > o.op
+                                                   ORDER BY n.op LIMIT 1),
+                                                  (SELECT COALESCE(MAX(seq), 0) + 1 FROM journal))
+                                  FROM journal_ops AS o WHERE o.op >= ? AND (o.op = ? OR o.unit = ?) ORDER BY o.op''',
+                               (unit, unit, unit)).fetchall()
+        entries = []
+        for first_seq, end in ranges:
+            entries += map(_journal_entry, self._execute(
+                'SELECT tbl, item_id, old, new FROM journal WHERE seq >= ? AND seq < ? ORDER BY seq',
+                (first_seq, end)))
+        return entries
+
+    def _check_entries(self, entries, action):
+        """重放前确认每一行仍是第一条修改之前的内容（版本号除外），否则抛出 UndoConflictError"""
+        expected = {}
+        for table, item_id, before, _ in entries:
+            expected.setdefault((table, item_id), before)
+        columns = [column for column in JOURNAL_COLUMNS if column != 'version']
+        for table in ('items', 'deleted_items'):
+            ids = [item_id for source, item_id in expected if source == table]
+            if not ids:
+                continue
+            current = {row[0]: dict(zip(columns, row[1:])) for row in self._execute(
+                f'SELECT id, {", ".join(columns)} FROM {table} WHERE id {IN_IDS}', (_ids(ids),))}
+            for item_id in ids:
+                before, row = expected[table, item_id], current.get(item_id)
+                if (before is None) != (row is None) or before is not None and any(
+                        row[column] != value for column, value in before.items() if column != 'version'):
+                    raise UndoConflictError(action)
+
+    def _apply_entry(self, table, item_id, before, after, exact=False):
+        """把一行从 before 改成 after（None 表示该行不存在）
+
+        exact 为假时版本号在当前基础上递增，而不是恢复成日志中的值。
+        """
+        if after is None:
+            self._execute(f'DELETE FROM {table} WHERE id = ?', (item_id,))
+        elif before is None:
+            values = [after[column] for column in JOURNAL_COLUMNS]
+            if not exact:
+                values[-1] += 1
+            self._execute(f'INSERT INTO {table} (id, {", ".join(JOURNAL_COLUMNS)}) '
+                          f'VALUES (?, {", ".join("?" * len(JOURNAL_COLUMNS))})', (item_id, *values))
+        else:
+            columns = [column for column in after if exact or column != 'version']
+            assignments = [f'{column} = ?' for column in columns] + ([] if exact else ['version = version + 1'])
+            self._execute(f'UPDATE {table} SET {", ".join(assignments)} WHERE id = ?',
+                          (*(after[column] for column in columns), item_id))
+
+    def restore_copy(self, path, moment):
+        """把 moment（datetime，不带时区时按本地时间）时刻的数据写入新的数据库文件 path
+
+        先用备份接口复制当前数据库，再在副本中从最新的修改往前逐条倒回 moment 之后的操作：
+        当前数据库就是最新的检查点，耗时只与 moment 之后的修改条数有关。早于操作日志的保留
+        范围（见 compact_journal）时抛出 ValueError。
+        """
+        at = journal_time(moment)
+        horizon = self.get_setting('journal_horizon')
+        if horizon is None or at < horizon:
+            raise ValueError(f'操作日志从 {horizon}（UTC）开始，无法重建更早的数据')
+        target = sqlite3.connect(path)
+        try:
+            with self._lock:
+                self._conn.backup(target)
+        finally:
+            target.close()
+        with ItemStore(path, cache_size=0) as copy:
+            copy._rewind(at)
+
+    def _rewind(self, at, batch_size=1000):
+        """倒回 at 之后的全部操作，并从日志中删去这些操作（连同倒回时记下的日志）"""
+        with self.transaction():
+            row = self._execute('SELECT op, first_seq FROM journal_ops WHERE at > ? ORDER BY op LIMIT 1',
+                                (at,)).fetchone()
+            if row is None:
+                return
+            op, first_seq = row
+            bound = self._execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM journal').fetchone()[0]
+            while True:
+                # 倒回时触发器还在往 journal 末尾追加，按 seq 分批读取，不边读边写同一个游标
+                rows = self._execute('SELECT seq, tbl, item_id, old, new FROM journal WHERE seq >= ? AND seq < ? '
+                                     'ORDER BY seq DESC LIMIT ?', (first_seq, bound, batch_size)).fetchall()
+                if not rows:
+                    break
+                for table, item_id, old, new in map(_journal_entry, (row[1:] for row in rows)):
+                    self._apply_entry(table, item_id, new, old, exact=True)
+                bound = rows[-1][0]
+            self._execute('DELETE FROM journal WHERE seq >= ?', (first_seq,))
+            self._execute('DELETE FROM journal_ops WHERE op >= ?', (op,))
+
+    def compact_journal(self, keep_days=JOURNAL_KEEP_DAYS):
+        """删除 keep_days 天以前的操作日志，日志不会无限增长；这些操作不能再撤销，也不能再重建到那之前"""
+        with self.transaction():
+            op = self._execute("SELECT MAX(op) FROM journal_ops WHERE at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?)",
+                               (f'-{keep_days} days',)).fetchone()[0]
+            if op is not None:
+                self._truncate_journal(op)
+
+    def _truncate_journal(self, op=None):
+        """删除 op 及以前的操作和它们的日志（op 为 None 时全部删除），可重建的最早时间随之推后"""
+        if op is None:
+            self._execute('DELETE FROM journal')
+            self._execute('DELETE FROM journal_ops')
+            horizon = self._execute(f'SELECT {JOURNAL_NOW}').fetchone()[0]
+        else:
+            first_seq, horizon = self._execute(
+                'SELECT (SELECT MIN(first_seq) FROM journal_ops WHERE op > ?), at FROM journal_ops WHERE op = ?',
+                (op, op)).fetchone()
+            if first_seq is None:
+                self._execute('DELETE FROM journal')
+            else:
+                self._execute('DELETE FROM journal WHERE seq < ?', (first_seq,))
+            self._execute('DELETE FROM journal_ops WHERE op <= ?', (op,))
+        self.set_setting('journal_horizon', horizon)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="物品复活系统：数据库维护")
+    parser.add_argument('--db', default=DB_FILE, help="数据库文件路径")
+    commands = parser.add_subparsers(dest='command', required=True)
+    mode_parser = commands.add_parser('storage-mode', help="切换回收站的存储方式")
+    mode_parser.add_argument('mode', choices=STORAGE_MODES)
+    retention_parser = commands.add_parser('retention', help="设置回收站物品的保留天数，0 表示永久保留")
+    retention_parser.add_argument('days', type=int)
+    commands.add_parser('purge', help="清理超过保留期的回收站物品和操作日志并回收空间")
+    commands.add_parser('expire', help="把已过保质期的物品移入回收站")
+    restore_parser = commands.add_parser('restore', help="把某一时刻的数据写入新的数据库文件")
+    restore_parser.add_argument('time', type=datetime.fromisoformat, help="本地时间，如 \"2025-01-01 12:00\"")
+    restore_parser.add_argument('output', help="新数据库文件路径")
+
+    args = parser.parse_args(argv)
+    with ItemStore(args.db) as store:
+        if args.command == 'storage-mode':
+            store.set_storage_mode(args.mode)
+            print(f"回收站存储方式：{args.mode}")
+        elif args.command == 'retention':
+            store.set_setting('retention_days', max(args.days, 0))
+            print(f"回收站保留天数：{args.days or '永久'}")
+        elif args.command == 'purge':
+            purged = 0
+            while True:
+                removed = len(store.purge_expired().removed['deleted_items'])
+                purged += removed
+                if not removed:
+                    break
+            store.compact_journal()
+            store.vacuum_step(pages=1 << 30)
+            print(f"已清理 {purged} 个物品。")
+        elif args.command == 'expire':
+            expired = 0
+            while removed := len(store.expire_items().removed['items']):
+                expired += removed
+            print(f"已将 {expired} 个过期物品移入回收站。")
+        elif args.command == 'restore':
+            try:
+                store.restore_copy(args.output, args.time)
+            except ValueError as e:
+                parser.exit(1, f"{e}\n")
+            print(f"已把 {args.time} 的数据写入 {args.output}。")
+
+
+if __name__ == "__main__":
+    main()
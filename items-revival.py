@@ -1,67 +1,866 @@
+import time
+STARTED = time.perf_counter()  # 启动计时的起点，放在其余导入之前，首屏用时包括载入模块的时间
+
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog, simpledialog
+import bisect
+import queue
 import sqlite3
-import json
-
-# 数据库文件路径
-DB_FILE = 'items_with_categories.db'
-
-class Item:
-    def __init__(self, id, name, description, address, contact_phone, contact_email, category, attributes):
-        self.id = id
-        self.name = name
-        self.description = description
-        self.address = address
-        self.contact_phone = contact_phone
-        self.contact_email = contact_email
-        self.category = category
-        self.attributes = attributes  # 扩展属性，使用字典存储
+import threading
+from datetime import date, timedelta
+
+from item_io import export_file
+from item_profile import PROFILER
+from item_search import SearchIndex
+from item_store import (ATTRIBUTE_COLUMNS, DB_FILE, DUE_LIMIT, EXPIRY_NOTICE_DAYS, FILTER_OPERATORS, ITEM_CACHE_SIZE,
+                        PAGE_SIZE, SORT_COLUMNS, UNDOABLE_ACTIONS, ChangeSet, DuplicateItemError, ItemQuery, ItemStore, StaleItemError,
+                        UndoConflictError, attribute_value, expiry_filters)
+
+
+def item_values(item):
+    """物品在表格中的一行，按列的正确顺序排列"""
+    return (
+        item.name,  # 名称
+        item.category,  # 类别
+        item.description,  # 描述
+        item.address,  # 地址
+        item.contact_phone,  # 联系人手机
+        item.contact_email,  # 联系人邮箱
+        item.attributes_json  # 扩展属性（直接显示数据库中的文本，不解析）
+    )
+
+
+def ask_choice(parent, title, message, choices):
+    """模态对话框：显示 message 和一排按钮，返回所按按钮的值；关闭窗口视为最后一个按钮
+
+    choices 为 [(值, 按钮文字)]。
+    """
+    dialog = tk.Toplevel(parent)
+    dialog.title(title)
+    dialog.transient(parent)
+    dialog.resizable(False, False)
+    result = {"value": choices[-1][0]}
+
+    def choose(value):
+        result["value"] = value
+        dialog.destroy()
+
+    ttk.Label(dialog, text=message, wraplength=360).pack(padx=20, pady=15)
+    buttons = ttk.Frame(dialog)
+    buttons.pack(padx=10, pady=(0, 10))
+    for value, text in choices:
+        ttk.Button(buttons, text=text, command=lambda value=value: choose(value)).pack(side="left", padx=5)
+    dialog.protocol("WM_DELETE_WINDOW", lambda: choose(choices[-1][0]))
+    dialog.grab_set()
+    parent.wait_window(dialog)
+    return result["value"]
+
+
+class PagedTreeview:
+    """分页表格：只物化可见行及前后缓冲，滚动到边缘时按键集分页取相邻一页
+
+    表格中最多保留 max_rows 行，超出的部分从另一端丢弃，因此打开速度和内存
+    占用与表的大小无关。行标识（iid）即数据库 id，修改后用 apply 只刷新涉及的行。
+    """
+
+    def __init__(self, tree, scrollbar, store, query, page_size=PAGE_SIZE, max_rows=PAGE_SIZE * 5):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.store = store
+        self.query = query
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.rows = {}  # iid -> 键，行的顺序以表格为准；物品本身不保留，需要时由 store.get_item 取（带缓存）
+        self.sort = None  # 排序列（SORT_COLUMNS 中的名称），None 为默认顺序
+        self.descending = False
+        self.has_before = False  # 窗口之前是否还有数据
+        self.has_after = False  # 窗口之后是否还有数据
+        self._loading = False
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        self.tree.bind("<Home>", lambda event: self.reload())
+        self.tree.bind("<End>", lambda event: self.load_last())
+
+    def set_query(self, query):
+        """切换查询条件并从第一页重新加载"""
+        self.query = self.sorted(query)
+        self.reload()
+
+    def sorted(self, query):
+        """给查询条件加上表格当前的排序方式"""
+        query.sort, query.descending = self.sort, self.descending
+        return query
+
+    def enable_sorting(self, attributes_column=None):
+        """点击列标题按该列排序，再次点击倒序；attributes_column 列的标题弹出菜单，选择按哪个扩展属性排序"""
+        self._headings = {column: self.tree.heading(column, "text") for column in self.tree["columns"]}
+        self._attributes_column = attributes_column
+        self._attribute_menu = tk.Menu(self.tree, tearoff=False)
+        for name in ATTRIBUTE_COLUMNS:
+            self._attribute_menu.add_command(label=name, command=lambda name=name: self.sort_by(name))
+        self._attribute_menu.add_separator()
+        self._attribute_menu.add_command(label="默认顺序", command=lambda: self.sort_by(None))
+        for column in self.tree["columns"]:
+            if column in SORT_COLUMNS:
+                self.tree.heading(column, command=lambda column=column: self.sort_by(column))
+            elif column == attributes_column:
+                self.tree.heading(column, command=lambda: self._attribute_menu.tk_popup(
+                    self.tree.winfo_pointerx(), self.tree.winfo_pointery()))
+
+    def sort_by(self, name):
+        """按 name 列排序（已按它排序时改为倒序），name 为 None 时恢复默认顺序；排序在数据库中完成"""
+        self.descending = name == self.sort and name is not None and not self.descending
+        self.sort = name
+        arrow = " ▼" if self.descending else " ▲"
+        for column, text in self._headings.items():
+            if column == self.sort:
+                text += arrow
+            elif column == self._attributes_column and self.sort in ATTRIBUTE_COLUMNS:
+                text += f"（{self.sort}{arrow}）"
+            self.tree.heading(column, text=text)
+        self.set_query(self.query)
+
+    @PROFILER.profile('load_first_page')
+    def reload(self):
+        """清空表格并加载第一页"""
+        self.show_page(self.query, self.store.page(self.query, limit=self.page_size + 1))
+
+    def show_page(self, query, entries):
+        """显示已经取到的第一页；entries 比一页多取一行，用来判断后面是否还有数据"""
+        self.query = query
+        self.has_after = len(entries) > self.page_size
+        self._replace(entries[:self.page_size])
+        self.has_before = False
+        self.tree.yview_moveto(0)
+
+    @PROFILER.profile('load_last_page')
+    def load_last(self):
+        """清空表格并加载最后一页"""
+        entries = self.store.page(self.query, limit=self.page_size + 1, last=True)
+        self.has_before = len(entries) > self.page_size
+        self._replace(entries[-self.page_size:])
+        self.has_after = False
+        self.tree.yview_moveto(1)
+
+    def apply(self, changes):
+        """按修改集增量更新表格，只处理涉及的行"""
+        table = self.query.table
+        touched = changes.added[table] + changes.updated[table]
+        entries = self.store.fetch(self.query, touched) if touched else []
+        matched = {str(item.id) for _, item in entries}
+        # 被删除的行，以及修改后不再满足当前查询条件的行
+        gone = dict.fromkeys(str(item_id) for item_id in changes.removed[table] + touched
+                             if str(item_id) not in matched)
+        self._drop([iid for iid in gone if iid in self.rows])
+        keys = self._keys()
+        for key, item in entries:
+            self._upsert(keys, key, item)
+        # 批量插入后超出窗口的行从末尾丢弃，删除后剩余的行不足一页时补齐
+        overflow = len(self.rows) - self.max_rows
+        if overflow > 0:
+            self._drop(self.tree.get_children()[-overflow:])
+            self.has_after = True
+        if not self.rows and (self.has_before or self.has_after):
+            self.reload()
+        elif len(self.rows) < self.page_size and self.has_after:
+            self._load_next()
+
+    def _upsert(self, keys, key, item):
+        """插入或更新一行，keys 是表格中各行按显示顺序的可比较键（见 ItemQuery.order_key），随之一起维护"""
+        iid = str(item.id)
+        current = self.rows.get(iid)
+        if current is not None:
+            if current == key:
+                with PROFILER.timed('tree'):
+                    self.tree.item(iid, values=item_values(item))
+                return
+            del keys[bisect.bisect_left(keys, self.query.order_key(current))]
+            self._drop([iid])
+        position = self.query.order_key(key)
+        # 落在窗口之外的行留给滚动时的分页加载
+        if keys and ((position > keys[-1] and self.has_after) or (position < keys[0] and self.has_before)):
+            return
+        index = bisect.bisect(keys, position)
+        keys.insert(index, position)
+        with PROFILER.timed('tree'):
+            self.tree.insert('', index, iid=iid, values=item_values(item))
+        self.rows[iid] = key
+
+    def _keys(self):
+        return [self.query.order_key(self.rows[iid]) for iid in self.tree.get_children()]
+
+    def _replace(self, entries):
+        with PROFILER.timed('tree'):
+            self.tree.delete(*self.tree.get_children())
+        self.rows.clear()
+        self._insert(entries, 'end')
+
+    def _insert(self, entries, index):
+        if index == 0:
+            entries = reversed(entries)
+        with PROFILER.timed('tree'):
+            for key, item in entries:
+                iid = self.tree.insert('', index, iid=item.id, values=item_values(item))
+                self.rows[iid] = key
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._loading or not self.rows:
+            return
+        if float(last) >= 0.95 and self.has_after:
+            self._loading = True
+            self.tree.after_idle(self._load_next)
+        elif float(first) <= 0.05 and self.has_before:
+            self._loading = True
+            self.tree.after_idle(self._load_previous)
+
+    def _first_visible(self):
+        return int(float(self.tree.yview()[0]) * len(self.rows))
+
+    def _drop(self, iids):
+        with PROFILER.timed('tree'):
+            self.tree.delete(*iids)
+        for iid in iids:
+            del self.rows[iid]
+
+    @PROFILER.profile('load_next_page')
+    def _load_next(self):
+        try:
+            children = self.tree.get_children()
+            entries = self.store.page(self.query, after=self.rows[children[-1]], limit=self.page_size + 1)
+            self.has_after = len(entries) > self.page_size
+            top = self._first_visible()
+            self._insert(entries[:self.page_size], 'end')
+            # 丢弃窗口顶部多余的行，并保持当前可见位置不动
+            overflow = len(self.rows) - self.max_rows
+            if overflow > 0:
+                self._drop(self.tree.get_children()[:overflow])
+                self.has_before = True
+                self.tree.yview_moveto(max(top - overflow, 0) / len(self.rows))
+        finally:
+            self._loading = False
+
+    @PROFILER.profile('load_previous_page')
+    def _load_previous(self):
+        try:
+            children = self.tree.get_children()
+            entries = self.store.page(self.query, before=self.rows[children[0]], limit=self.page_size + 1)
+            self.has_before = len(entries) > self.page_size
+            entries = entries[-self.page_size:]
+            top = self._first_visible()
+            self._insert(entries, 0)
+            # 丢弃窗口底部多余的行
+            overflow = len(self.rows) - self.max_rows
+            if overflow > 0:
+                self._drop(self.tree.get_children()[-overflow:])
+                self.has_after = True
+            self.tree.yview_moveto((top + len(entries)) / len(self.rows))
+        finally:
+            self._loading = False
+
+
+def show_db_error(error):
+    """后台数据库操作失败时的默认处理"""
+    messagebox.showerror("数据库错误", f"操作失败：{error}")
+
+
+class DbWorker:
+    """唯一的数据库写入线程：按提交顺序执行操作，结果经队列交回主线程
+
+    数据库被其他程序锁住时（最长等待连接的 timeout 秒）或磁盘缓慢时，等待都发生在
+    后台线程中，界面照常响应。on_busy(True/False) 在有操作进行中和全部完成时调用。
+    开启性能记录时，每次提交记为一个以 func 命名的操作（在某个操作中提交时计入该操作），
+    包括后台执行和主线程中的回调。
+    """
+
+    def __init__(self, root, on_busy=None):
+        self.root = root
+        self.on_busy = on_busy
+        self._busy = 0  # 进行中且需要显示忙碌状态的操作数
+        self._pending = 0  # 已提交但结果尚未交回主线程的操作数
+        self._polling = False
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, on_done=None, on_error=show_db_error, quiet=False):
+        """在后台执行 func(*args)；完成后在主线程中调用 on_done(结果) 或 on_error(异常)
+
+        quiet 为真时不显示忙碌状态，用于定时的后台维护。
+        """
+        self._pending += 1
+        if not quiet:
+            self._busy += 1
+            if self._busy == 1 and self.on_busy:
+                self.on_busy(True)
+        action = PROFILER.hold() or PROFILER.begin(func.__name__)
+        self._requests.put((func, args, on_done, on_error, quiet, action))
+        if not self._polling:
+            self._polling = True
+            self.root.after(30, self._poll)
+
+    @property
+    def busy(self):
+        """是否有需要显示忙碌状态的操作尚未完成"""
+        return self._busy > 0
+
+    def close(self):
+        """等已提交的操作执行完后结束线程"""
+        self._requests.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            func, args, on_done, on_error, quiet, action = request
+            try:
+                with PROFILER.resume(action):
+                    result = func(*args)
+                self._results.put((on_done, quiet, action, result, None))
+            except Exception as e:
+                self._results.put((on_error, quiet, action, None, e))
+
+    def _poll(self):
+        while True:
+            try:
+                callback, quiet, action, result, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._pending -= 1
+            if not quiet:
+                self._busy -= 1
+            try:
+                if callback:
+                    with PROFILER.resume(action):
+                        callback(error if error is not None else result)
+            finally:
+                PROFILER.release(action)
+        if self._busy == 0 and self.on_busy:
+            self.on_busy(False)
+        if self._pending:
+            self.root.after(30, self._poll)
+        else:
+            self._polling = False
+
+
+class LiveSearch:
+    """边输入边查找：输入停顿 delay 毫秒后在后台线程查询，新的输入会中止尚未完成的旧查询
+
+    查询使用独立的只读连接，通过 SQLite 进度回调检查查询是否已过期；结果经队列
+    交回主线程，由 on_result(query, kind, payload) 处理，kind 为 'page'（第一页）、'count'
+    或 'facets'（分面统计，见 ItemStore.facets）。
+    """
+
+    def __init__(self, root, store, on_result, delay=300, page_size=PAGE_SIZE):
+        self.root = root
+        self.reader = store.reader()
+        self.on_result = on_result
+        self.delay = delay
+        self.page_size = page_size
+        self.generation = 0  # 每次提交新查询加一，旧的查询随之过期
+        self._after_id = None
+        self._pending = 0  # 已提交但后台线程尚未处理完的查询数
+        self._facets_queued = False  # 是否已有待处理的 refresh_facets 请求
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def schedule(self, query, delay=None):
+        """延迟提交查询；延迟期间再次调用会重新计时"""
+        self.cancel()
+        self._after_id = self.root.after(self.delay if delay is None else delay, self._submit, query)
+
+    def cancel(self):
+        """放弃尚未提交和正在执行的查询"""
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        self.generation += 1
+
+    def refresh_facets(self, query):
+        """数据有修改时在后台重新统计当前查询的分面，不中止正在进行的查询"""
+        if not self._facets_queued:
+            self._facets_queued = True
+            self._enqueue(self.generation, query, True)
+
+    def close(self):
+        self.cancel()
+        self._requests.put((None, None, False))
+
+    def _submit(self, query):
+        self._after_id = None
+        self.generation += 1
+        self._enqueue(self.generation, query, False)
+
+    def _enqueue(self, generation, query, facets_only):
+        self._requests.put((generation, query, facets_only))
+        self._pending += 1
+        if self._pending == 1:
+            self.root.after(30, self._poll)
+
+    def _run(self):
+        while True:
+            generation, query, facets_only = self._requests.get()
+            if generation is None:
+                break
+            action = None
+            if facets_only:
+                self._facets_queued = False
+            if generation == self.generation:
+                # 查询和主线程中显示结果都计入同一个操作，显示完（done）时结束
+                action = PROFILER.begin('facets' if facets_only else 'search')
+                self.reader.set_cancel_check(lambda: generation != self.generation)
+                try:
+                    with PROFILER.resume(action):
+                        if not facets_only:
+                            page = self.reader.page(query, limit=self.page_size + 1)
+                            self._results.put((generation, query, 'page', page, action))
+                            self._results.put((generation, query, 'count', self.reader.count(query), action))
+                        self._results.put((generation, query, 'facets', self.reader.facets(query), action))
+                except sqlite3.OperationalError:
+                    pass  # 已被新的输入中止
+                finally:
+                    self.reader.set_cancel_check(None)
+            self._results.put((generation, query, 'done', None, action))
+        self.reader.close()
+
+    def _poll(self):
+        while True:
+            try:
+                generation, query, kind, payload, action = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'done':
+                self._pending -= 1
+                PROFILER.release(action)
+            elif generation == self.generation:
+                with PROFILER.resume(action):
+                    self.on_result(query, kind, payload)
+        if self._pending:
+            self.root.after(30, self._poll)
+
+
+class DiagnosticsWindow:
+    """性能诊断窗口：开关性能记录，查看各操作的耗时构成、SQL 语句统计和慢查询的执行计划，可导出为 JSON"""
+
+    REFRESH_INTERVAL = 1000
+
+    ACTION_COLUMNS = (("name", "操作", 160), ("count", "次数", 60), ("mean_ms", "平均(ms)", 80),
+                      ("max_ms", "最长(ms)", 80), ("sql_ms", "SQL(ms)", 80), ("json_ms", "JSON(ms)", 80),
+                      ("tree_ms", "表格(ms)", 80), ("other_ms", "其他(ms)", 80), ("statements", "语句数", 70),
+                      ("rows", "行数", 70))
+    STATEMENT_COLUMNS = (("count", "次数", 60), ("total_ms", "合计(ms)", 80), ("mean_ms", "平均(ms)", 80),
+                         ("max_ms", "最长(ms)", 80), ("rows", "行数", 70), ("sql", "SQL", 600))
+    SLOW_COLUMNS = (("time", "时间", 140), ("action", "操作", 120), ("ms", "耗时(ms)", 80), ("rows", "行数", 70),
+                    ("sql", "SQL", 500))
+
+    def __init__(self, root):
+        self.window = tk.Toplevel(root)
+        self.window.title("性能诊断")
+        self.window.geometry("900x560")
+
+        controls = ttk.Frame(self.window)
+        controls.pack(fill="x", padx=10, pady=5)
+        self.enabled_var = tk.BooleanVar(value=PROFILER.enabled)
+        ttk.Checkbutton(controls, text="记录性能数据", variable=self.enabled_var,
+                        command=self.toggle).pack(side="left")
+        ttk.Label(controls, text="慢查询阈值（毫秒）：").pack(side="left", padx=(15, 0))
+        self.slow_var = tk.StringVar(value=f"{PROFILER.slow_query_ms:g}")
+        slow_entry = ttk.Entry(controls, textvariable=self.slow_var, width=8)
+        slow_entry.pack(side="left")
+        slow_entry.bind("<Return>", lambda event: self.set_slow_query_ms())
+        slow_entry.bind("<FocusOut>", lambda event: self.set_slow_query_ms())
+        ttk.Button(controls, text="导出 JSON…", command=self.dump).pack(side="right", padx=5)
+        ttk.Button(controls, text="清空", command=self.reset).pack(side="right", padx=5)
+        self.since_label = ttk.Label(controls, text="")
+        self.since_label.pack(side="right", padx=10)
+
+        notebook = ttk.Notebook(self.window)
+        notebook.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+        self.action_tree = self.create_table(notebook, "操作", self.ACTION_COLUMNS)
+        self.statement_tree = self.create_table(notebook, "SQL 语句", self.STATEMENT_COLUMNS)
+        slow_frame = ttk.Frame(notebook)
+        notebook.add(slow_frame, text="慢查询")
+        self.slow_tree = self.create_table(slow_frame, None, self.SLOW_COLUMNS)
+        self.slow_tree.bind("<<TreeviewSelect>>", self.show_plan)
+        self.plan_text = tk.Text(slow_frame, height=8, wrap="none")
+        self.plan_text.pack(fill="x", pady=(5, 0))
+        self.slow_queries = []
+
+        self.refresh()
+
+    def create_table(self, parent, title, columns):
+        frame = ttk.Frame(parent)
+        if title is None:
+            frame.pack(fill="both", expand=True)
+        else:
+            parent.add(frame, text=title)
+        tree = ttk.Treeview(frame, columns=[column for column, _, _ in columns], show="headings")
+        for column, heading, width in columns:
+            tree.heading(column, text=heading)
+            tree.column(column, width=width, anchor="w" if column in ("name", "sql", "action") else "e")
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        return tree
+
+    def toggle(self):
+        PROFILER.enabled = self.enabled_var.get()
+
+    def set_slow_query_ms(self):
+        try:
+            PROFILER.slow_query_ms = max(float(self.slow_var.get()), 0)
+        except ValueError:
+            self.slow_var.set(f"{PROFILER.slow_query_ms:g}")
+
+    def reset(self):
+        PROFILER.reset()
+        self.refresh(reschedule=False)
+
+    def dump(self):
+        path = filedialog.asksaveasfilename(parent=self.window, title="导出性能数据", defaultextension=".json",
+                                            filetypes=[("JSON 文件", "*.json")])
+        if path:
+            try:
+                PROFILER.dump(path)
+            except OSError as e:
+                messagebox.showerror("导出失败", str(e), parent=self.window)
+
+    def refresh(self, reschedule=True):
+        """每秒刷新一次，窗口关闭后停止"""
+        if not self.window.winfo_exists():
+            return
+        snapshot = PROFILER.snapshot()
+        self.since_label.config(text=f"自 {snapshot['since']} 起")
+        actions = sorted(snapshot['actions'].items(), key=lambda entry: entry[1]['wall_ms'], reverse=True)
+        self.fill(self.action_tree, [{'name': name, **stats} for name, stats in actions], self.ACTION_COLUMNS)
+        self.fill(self.statement_tree, snapshot['statements'], self.STATEMENT_COLUMNS)
+        # 慢查询列表只在有新记录时重填，以免丢失选中的行
+        slow_queries = snapshot['slow_queries'][::-1]  # 最近的在前
+        if slow_queries[:1] != self.slow_queries[:1] or len(slow_queries) != len(self.slow_queries):
+            self.slow_queries = slow_queries
+            self.fill(self.slow_tree, self.slow_queries, self.SLOW_COLUMNS)
+        if reschedule:
+            self.window.after(self.REFRESH_INTERVAL, self.refresh)
+
+    @staticmethod
+    def fill(tree, rows, columns):
+        tree.delete(*tree.get_children())
+        for index, row in enumerate(rows):
+            tree.insert('', 'end', iid=index, values=[row[column] for column, _, _ in columns])
+
+    def show_plan(self, event):
+        selected = self.slow_tree.selection()
+        self.plan_text.delete("1.0", tk.END)
+        if selected:
+            query = self.slow_queries[int(selected[0])]
+            self.plan_text.insert("1.0", query['sql'] + "\n\n" + "\n".join(query['plan']))
+
+
+class DuplicatesWindow:
+    """重复物品窗口：在后台查找可能重复的物品，逐组查看，选定保留的物品后合并（可以撤销）"""
+
+    COLUMNS = (("name", "名称", 180), ("category", "类别", 80), ("phone", "联系人手机", 130),
+               ("email", "联系人邮箱", 160), ("address", "地址", 150), ("description", "描述", 240))
+
+    def __init__(self, app):
+        # 查找用到进程池，相关模块载入约需 50 毫秒，不放在程序启动时
+        from item_dedup import DEFAULT_THRESHOLD
+
+        self.app = app
+        self.window = tk.Toplevel(app.root)
+        self.window.title("查找重复物品")
+        self.window.geometry("1000x560")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.groups = {}  # 组的表格项 -> DuplicateGroup
+        self.cancel = None  # 正在进行的查找的取消标志
+
+        controls = ttk.Frame(self.window)
+        controls.pack(fill="x", padx=10, pady=5)
+        ttk.Label(controls, text="相似度阈值：").pack(side="left")
+        self.threshold_var = tk.StringVar(value=f"{DEFAULT_THRESHOLD:g}")
+        ttk.Entry(controls, textvariable=self.threshold_var, width=6).pack(side="left")
+        self.find_button = ttk.Button(controls, text="开始查找", command=self.find)
+        self.find_button.pack(side="left", padx=10)
+        self.progress_label = ttk.Label(controls, text="")
+        self.progress_label.pack(side="left", fill="x", expand=True)
+
+        frame = ttk.Frame(self.window)
+        frame.pack(fill="both", expand=True, padx=10)
+        self.tree = ttk.Treeview(frame, columns=[column for column, _, _ in self.COLUMNS])
+        self.tree.heading("#0", text="分组")
+        self.tree.column("#0", width=170)
+        for column, heading, width in self.COLUMNS:
+            self.tree.heading(column, text=heading)
+            self.tree.column(column, width=width)
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+
+        buttons = ttk.Frame(self.window)
+        buttons.pack(fill="x", padx=10, pady=5)
+        ttk.Button(buttons, text="设为保留", command=self.set_keep).pack(side="left", padx=5)
+        ttk.Button(buttons, text="合并所选组", command=self.merge).pack(side="left", padx=5)
+        ttk.Button(buttons, text="忽略所选组", command=self.dismiss).pack(side="left", padx=5)
+
+    def find(self):
+        """在后台线程（及其进程池）中查找，进度显示在窗口顶部，完成后列出各组"""
+        from concurrent.futures.process import BrokenProcessPool
+        from item_dedup import find_duplicates
+
+        try:
+            threshold = float(self.threshold_var.get())
+        except ValueError:
+            threshold = -1
+        if not 0 < threshold <= 1:
+            messagebox.showwarning("输入错误", "相似度阈值应在 0 到 1 之间。", parent=self.window)
+            return
+        updates = queue.Queue()
+        cancel = self.cancel = threading.Event()
+
+        def run():
+            reader = self.app.store.reader()
+            try:
+                groups = find_duplicates(reader, threshold, progress=lambda text: updates.put(('progress', text)),
+                                         cancel=cancel)
+                updates.put(('done', groups))
+            except (OSError, sqlite3.Error, BrokenProcessPool) as e:
+                updates.put(('error', e))
+            finally:
+                reader.close()
+
+        def poll():
+            if cancel.is_set():
+                return
+            while True:
+                try:
+                    kind, payload = updates.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == 'progress':
+                    self.progress_label.config(text=payload)
+                    continue
+                self.find_button.config(state=tk.NORMAL)
+                if kind == 'done':
+                    self.show(payload)
+                else:
+                    self.progress_label.config(text="")
+                    messagebox.showerror("查找失败", str(payload), parent=self.window)
+                return
+            self.window.after(200, poll)
+
+        self.find_button.config(state=tk.DISABLED)
+        self.progress_label.config(text="正在读取物品…")
+        threading.Thread(target=run, daemon=True).start()
+        self.window.after(200, poll)
+
+    def show(self, groups):
+        self.tree.delete(*self.tree.get_children())
+        self.groups = {}
+        for group in groups:
+            row = self.tree.insert("", "end", text=f"相似度 {group.score:.2f}（{len(group.items)} 个）", open=True)
+            self.groups[row] = group
+            self.fill(row)
+
+    def fill(self, row):
+        """重新列出一组中的物品，保留的物品排在最前"""
+        self.tree.delete(*self.tree.get_children(row))
+        group = self.groups[row]
+        for item in group.items:
+            self.tree.insert(row, "end", iid=f"{row}/{item.id}", text="保留" if item is group.keep else "",
+                             values=(item.name, item.category, item.contact_phone, item.contact_email,
+                                     item.address, item.description))
+
+    def selected_group(self):
+        """所选行所在的组的表格项；未选择时提示并返回 None"""
+        selected = self.tree.selection()
+        if not selected:
+            messagebox.showwarning("选择错误", "请先选择一组物品！", parent=self.window)
+            return None
+        return self.tree.parent(selected[0]) or selected[0]
+
+    def set_keep(self):
+        """所选物品改为这一组中保留的物品"""
+        selected = self.tree.selection()
+        if not selected or not self.tree.parent(selected[0]):
+            messagebox.showwarning("选择错误", "请先选择组中要保留的物品！", parent=self.window)
+            return
+        row = self.tree.parent(selected[0])
+        group = self.groups[row]
+        item_id = int(selected[0].rsplit("/", 1)[1])
+        group.items.sort(key=lambda item: item.id != item_id)
+        self.fill(row)
+
+    def merge(self):
+        """把所选组中的其他物品合并到保留的物品中，并移入回收站"""
+        row = self.selected_group()
+        if row is None:
+            return
+        group = self.groups[row]
+        if not messagebox.askyesno(
+                "确认合并",
+                f"将 {len(group.duplicates)} 个物品合并到“{group.keep.name}”并移入回收站？\n"
+                "可以通过“编辑 → 撤销”恢复。", parent=self.window):
+            return
+
+        def done(changes):
+            self.app.apply_changes(changes)
+            self.remove(row)
+
+        def failed(error):
+            if isinstance(error, StaleItemError):
+                messagebox.showerror("合并失败", f"物品“{group.keep.name}”已被删除，请重新查找。", parent=self.window)
+                self.remove(row)
+            else:
+                show_db_error(error)
+
+        self.app.worker.submit(self.app.store.merge_items, group.keep.id, [item.id for item in group.duplicates],
+                               on_done=done, on_error=failed)
+
+    def dismiss(self):
+        row = self.selected_group()
+        if row is not None:
+            self.remove(row)
+
+    def remove(self, row):
+        if self.window.winfo_exists() and self.tree.exists(row):
+            self.tree.delete(row)
+        self.groups.pop(row, None)
+
+    def close(self):
+        """关闭窗口，并停止正在进行的查找"""
+        if self.cancel is not None:
+            self.cancel.set()
+        self.window.destroy()
+
 
 class ItemApp:
     def __init__(self, root):
         self.root = root
         self.root.title("物品复活系统")
-        self.create_database()
-        self.items = []
-        self.deleted_items = []
-
-        self.create_widgets()
-        self.load_items()
-        self.load_deleted_items()
+        # 写入都在 DbWorker 线程中通过 store 完成；表格的分页读取使用单独的只读连接，
+        # WAL 模式下读不会被写阻塞
+        self.store = ItemStore(DB_FILE)
+        # 拼音与模糊查找的索引在首屏画出后才开始在后台载入，之后创建的只读连接都共用它
+        self.search_index = SearchIndex(self.store)
+        self.store.search_index = self.search_index
+        self.view_store = self.store.reader(cache_size=ITEM_CACHE_SIZE)
         self.is_editing = False  # 当前是否处于编辑模式
+        self.editing_item = None  # 正在编辑的物品（读取时的版本）
+        self.diagnostics = None  # 性能诊断窗口
+        self.duplicates = None  # 重复物品窗口
+        self.facet_selection = {}  # 在分类统计中选中的值：分面名 -> 值（类别直接设置到类别选择框）
+        self.facet_entries = {}  # 分类统计表格项 -> (分面名, 值)
+        self._due_cursor = None  # 到期队列中已提醒到的位置 (保质期, id)
+        self._due_changed = set()  # 上次检查保质期以来新增或修改的物品，可能排在已提醒到的位置之前
+        self._due_notified = {}  # 已提醒的物品 id -> 提醒时的保质期
+        self._expired_count = 0  # 这一轮自动移入回收站的过期物品数
 
-    def create_database(self):
-        """创建数据库和表"""
-        with sqlite3.connect(DB_FILE, timeout=10) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT,
-                    description TEXT,
-                    address TEXT,
-                    contact_phone TEXT,
-                    contact_email TEXT,
-                    category TEXT,
-                    attributes TEXT
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS deleted_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT,
-                    description TEXT,
-                    address TEXT,
-                    contact_phone TEXT,
-                    contact_email TEXT,
-                    category TEXT,
-                    attributes TEXT
-                )
-            ''')
-            conn.commit()
+        self.create_widgets()
+        self.worker = DbWorker(self.root, on_busy=self.set_busy)
+        self.live_search = LiveSearch(self.root, self.store, self.show_search_results)
+        # 其他程序（或同一数据库上的其他窗口）提交的修改，从载入第一页之前算起
+        self._change_seq = self.view_store.last_change()
+        self._data_version = self.view_store.data_version()
+        # 启动时只载入物品列表的第一页；回收站在第一次切换过去时才创建和载入
+        self.item_view.set_query(ItemQuery())
+        self.refresh_history()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self._purge_after_id = self._watch_after_id = self._expiry_after_id = None
+        self.tree.bind("<Expose>", self.on_first_paint)
+
+    # 回收站过期清理的间隔（毫秒）；一批没删完时隔 PURGE_BATCH_INTERVAL 再继续，避免长时间占用数据库
+    PURGE_INTERVAL = 60 * 1000
+    PURGE_BATCH_INTERVAL = 200
+    # 检查其他程序修改的间隔（毫秒）
+    WATCH_INTERVAL = 1000
+    # 检查保质期的间隔（毫秒）；自动移走过期物品时一批没移完隔 PURGE_BATCH_INTERVAL 再继续
+    EXPIRY_INTERVAL = 60 * 1000
+
+    def on_first_paint(self, event):
+        """物品表格第一次显示：等它画完（空闲时）报告启动用时，再开始不影响首屏的工作"""
+        self.tree.unbind("<Expose>")
+        self.root.after_idle(self.finish_startup)
+
+    def finish_startup(self):
+        """启动的后半段：载入模糊查找索引、分类统计，开始定时清理回收站、检查保质期和其他程序的修改"""
+        elapsed = time.perf_counter() - STARTED
+        PROFILER.record("first_paint", STARTED)
+        self.status_label.config(text=f"启动用时 {elapsed:.2f} 秒")
+        self.search_index.open()
+        self.refresh_facets()
+        self._purge_after_id = self.root.after(self.PURGE_INTERVAL, self.purge_expired)
+        self._watch_after_id = self.root.after(self.WATCH_INTERVAL, self.watch_changes)
+        self.schedule_expiry(self.WATCH_INTERVAL)
+
+    def on_close(self):
+        """关闭窗口时释放数据库连接"""
+        for after_id in (self._purge_after_id, self._watch_after_id, self._expiry_after_id):
+            if after_id is not None:
+                self.root.after_cancel(after_id)
+        self.worker.close()  # 等进行中的写入完成
+        self.live_search.close()
+        self.search_index.close()
+        self.view_store.close()
+        self.store.close()
+        self.root.destroy()
+
+    def set_busy(self, busy):
+        """后台有数据库操作时禁用操作按钮并显示忙碌状态，避免重复提交"""
+        state = tk.DISABLED if busy else tk.NORMAL
+        buttons = [self.edit_button, self.edit_selected_button, self.delete_button]
+        if self.recovery_view is not None:
+            buttons += [self.recover_button, self.permanently_delete_button]
+        for button in buttons:
+            button.config(state=state)
+        self.add_button.config(state=tk.DISABLED if busy or self.is_editing else tk.NORMAL)
+        self.busy_label.config(text="正在处理…" if busy else "")
+        self.root.config(cursor="watch" if busy else "")
 
     def create_widgets(self):
         """创建主界面组件"""
+        menubar = tk.Menu(self.root)
+        file_menu = tk.Menu(menubar, tearoff=False)
+        file_menu.add_command(label="导出物品列表…", command=lambda: self.export_items(deleted=False))
+        file_menu.add_command(label="导出回收站…", command=lambda: self.export_items(deleted=True))
+        menubar.add_cascade(label="文件", menu=file_menu)
+        # 撤销、重做的名称和可用状态由 refresh_history 按操作日志更新
+        self.edit_menu = tk.Menu(menubar, tearoff=False)
+        self.edit_menu.add_command(label="撤销", accelerator="Ctrl+Z", state=tk.DISABLED,
+                                   command=lambda: self.replay('undo'))
+        self.edit_menu.add_command(label="重做", accelerator="Ctrl+Y", state=tk.DISABLED,
+                                   command=lambda: self.replay('redo'))
+        self.edit_menu.add_separator()
+        self.edit_menu.add_command(label="查找重复物品…", command=self.show_duplicates)
+        menubar.add_cascade(label="编辑", menu=self.edit_menu)
+        self.root.bind("<Control-z>", lambda event: self.replay('undo', event))
+        self.root.bind("<Control-y>", lambda event: self.replay('redo', event))
+        settings_menu = tk.Menu(menubar, tearoff=False)
+        settings_menu.add_command(label="回收站保留天数…", command=self.set_retention)
+        settings_menu.add_command(label="到期提醒天数…", command=self.set_notice_days)
+        self.auto_expire_var = tk.BooleanVar(value=bool(int(self.view_store.get_setting('expiry_auto_move', 0))))
+        settings_menu.add_checkbutton(label="自动移走过期物品", variable=self.auto_expire_var,
+                                      command=self.toggle_auto_expire)
+        settings_menu.add_command(label="性能诊断…", command=self.show_diagnostics)
+        menubar.add_cascade(label="设置", menu=settings_menu)
+        self.root.config(menu=menubar)
+
+        # 状态栏，显示后台任务的进度和数据库操作的忙碌状态
+        status_bar = ttk.Frame(self.root)
+        status_bar.pack(side="bottom", fill="x", padx=10)
+        self.busy_label = ttk.Label(status_bar, text="", anchor="e")
+        self.busy_label.pack(side="right")
+        # 到期提醒一直显示到点击它为止，不会被其他状态信息覆盖
+        self.notice_label = ttk.Label(status_bar, text="", foreground="#b03020", cursor="hand2")
+        self.notice_label.pack(side="right", padx=10)
+        self.notice_label.bind("<Button-1>", lambda event: self.notice_label.config(text=""))
+        self.status_label = ttk.Label(status_bar, text="", anchor="w")
+        self.status_label.pack(side="left", fill="x", expand=True)
+
         self.notebook = ttk.Notebook(self.root)
         self.notebook.pack(fill='both', expand=True, padx=10, pady=10)
 
@@ -70,9 +869,17 @@ class ItemApp:
 
         self.recovery_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.recovery_frame, text="回收站")
+        self.recovery_view = None  # 回收站标签页第一次选中时才创建（见 on_tab_changed）
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
 
         self.create_items_tab()
-        self.create_recovery_tab()
+
+    def on_tab_changed(self, event):
+        """第一次切换到回收站时创建其表格和按钮并载入第一页"""
+        if self.recovery_view is None and self.notebook.select() == str(self.recovery_frame):
+            self.create_recovery_tab()
+            self.load_deleted_items()
+            self.set_busy(self.worker.busy)
 
     def create_items_tab(self):
         """创建物品管理标签页"""
@@ -138,17 +945,59 @@ class ItemApp:
         self.search_entry = ttk.Entry(search_row, width=60)
         self.search_entry.pack(side="left", padx=5)
 
+        # 边输入边查找
+        self.search_entry.bind("<KeyRelease>", self.on_search_input)
+        self.search_category_combobox.bind("<<ComboboxSelected>>", self.on_search_input)
+        self.live_search_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(search_row, text="边输入边查找", variable=self.live_search_var).pack(side="left", padx=5)
+        # 按拼音、拼音首字母查找，容忍错字
+        self.fuzzy_search_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(search_row, text="拼音/模糊", variable=self.fuzzy_search_var,
+                        command=lambda: self.on_search_input(None)).pack(side="left", padx=5)
+
         # 查找和取消按钮
         self.search_button = ttk.Button(search_row, text="查找", command=self.search_items)
         self.search_button.pack(side="left", padx=5)
 
-        self.clear_search_button = ttk.Button(search_row, text="取消", command=self.load_items)
+        self.clear_search_button = ttk.Button(search_row, text="取消", command=self.clear_search)
         self.clear_search_button.pack(side="left", padx=5)
 
+        # 扩展属性筛选，如“数量 > 5”、“保质期 < 2025-01-01”
+        filter_row = ttk.Frame(search_frame)
+        filter_row.pack(fill="x", padx=5)
+        ttk.Label(filter_row, text="属性:").pack(side="left", padx=5, pady=5)
+        self.filter_key_combobox = ttk.Combobox(filter_row, values=["暂不选择", *ATTRIBUTE_COLUMNS],
+                                                state="readonly", width=10)
+        self.filter_key_combobox.pack(side="left", padx=5)
+        self.filter_key_combobox.set("暂不选择")
+        self.filter_operator_combobox = ttk.Combobox(filter_row, values=FILTER_OPERATORS, state="readonly", width=4)
+        self.filter_operator_combobox.pack(side="left", padx=5)
+        self.filter_operator_combobox.set("=")
+        self.filter_value_entry = ttk.Entry(filter_row, width=20)
+        self.filter_value_entry.pack(side="left", padx=5)
+        self.filter_key_combobox.bind("<<ComboboxSelected>>", self.on_search_input)
+        self.filter_operator_combobox.bind("<<ComboboxSelected>>", self.on_search_input)
+        self.filter_value_entry.bind("<KeyRelease>", self.on_search_input)
+
+        # 查找结果提示
+        self.search_status_label = ttk.Label(search_frame, text="")
+        self.search_status_label.pack(fill="x", padx=10)
+
         # 列表部分
         list_frame = ttk.Frame(search_frame)
         list_frame.pack(fill="both", expand=True, padx=10, pady=5)
 
+        # 分类统计：当前结果按类别、地区、出版社、品牌、保质期的计数，双击一项即按它缩小范围
+        facet_frame = ttk.LabelFrame(list_frame, text="分类统计")
+        facet_frame.pack(side="right", fill="y", padx=(5, 0))
+        self.facet_selection_label = ttk.Label(facet_frame, text="", wraplength=180)
+        self.facet_selection_label.pack(fill="x", padx=5)
+        ttk.Button(facet_frame, text="清除分类筛选", command=self.clear_facet_selection).pack(fill="x", padx=5)
+        self.facet_tree = ttk.Treeview(facet_frame, show="tree", selectmode="browse")
+        self.facet_tree.column("#0", width=200)
+        self.facet_tree.pack(fill="both", expand=True, padx=5, pady=5)
+        self.facet_tree.bind("<Double-1>", self.select_facet)
+
         columns = ("名称", "类别", "描述", "地址", "联系人手机", "联系人邮箱", "扩展属性")
         style = ttk.Style()
         style.configure("Treeview", rowheight=24)
@@ -166,8 +1015,9 @@ class ItemApp:
         self.tree.column("扩展属性", width=200)
 
         scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscroll=scrollbar.set)
         scrollbar.pack(side="right", fill="y")
+        self.item_view = PagedTreeview(self.tree, scrollbar, self.view_store, ItemQuery())
+        self.item_view.enable_sorting(attributes_column="扩展属性")
 
         buttons_frame = ttk.Frame(search_frame)
         buttons_frame.pack(fill="x", padx=10, pady=5)
@@ -194,8 +1044,10 @@ class ItemApp:
         self.recovery_tree.pack(fill="both", expand=True, side="left")
 
         scrollbar = ttk.Scrollbar(recovery_frame, orient="vertical", command=self.recovery_tree.yview)
-        self.recovery_tree.configure(yscroll=scrollbar.set)
         scrollbar.pack(side="right", fill="y")
+        self.recovery_view = PagedTreeview(self.recovery_tree, scrollbar, self.view_store,
+                                           ItemQuery(deleted=True))
+        self.recovery_view.enable_sorting(attributes_column="扩展属性")
 
         recovery_buttons_frame = ttk.Frame(self.recovery_frame)
         recovery_buttons_frame.pack(fill="x", padx=10, pady=5)
@@ -207,31 +1059,11 @@ class ItemApp:
         self.recover_button = ttk.Button(recovery_buttons_frame, text="恢复选中物品", command=self.recover_item)
         self.recover_button.pack(side="right", padx=5)
 
+    @PROFILER.profile()
     def load_items(self):
-        """加载物品列表"""
-        self.items.clear()
-        self.tree.delete(*self.tree.get_children())
-
-        with sqlite3.connect(DB_FILE, timeout=10) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM items')
-            for row in cursor.fetchall():
-                item = Item(row[0], row[1], row[2], row[3], row[4], row[5], row[6], json.loads(row[7]))
-                self.items.append(item)
-
-                # 按列的正确顺序插入数据
-                self.tree.insert(
-                    '', 'end',
-                    values=(
-                        item.name,  # 名称
-                        item.category,  # 类别
-                        item.description,  # 描述
-                        item.address,  # 地址
-                        item.contact_phone,  # 联系人手机
-                        item.contact_email,  # 联系人邮箱
-                        json.dumps(item.attributes, ensure_ascii=False)  # 扩展属性
-                    )
-                )
+        """加载物品列表（第一页）"""
+        self.item_view.set_query(ItemQuery())
+        self.refresh_facets()
 
     def update_attributes_fields(self, event):
         """根据类别更新扩展属性字段"""
@@ -240,7 +1072,7 @@ class ItemApp:
 
         category = self.category_combobox.get()
         if category == "食品":
-            ttk.Label(self.attributes_frame, text="保质期:").grid(row=0, column=0, padx=5, pady=5, sticky="e")
+            ttk.Label(self.attributes_frame, text="保质期(年-月-日):").grid(row=0, column=0, padx=5, pady=5, sticky="e")
             self.expiry_entry = ttk.Entry(self.attributes_frame, width=30)
             self.expiry_entry.grid(row=0, column=1, padx=5, pady=5)
 
@@ -290,22 +1122,23 @@ class ItemApp:
             messagebox.showwarning("输入错误", "请填写必要的字段：名称和类别！")
             return
 
-        with sqlite3.connect(DB_FILE, timeout=10) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT 1 FROM items WHERE name = ? AND category = ?', (name, category))
-            if cursor.fetchone():
-                messagebox.showerror("重复错误", "名称和类别相同的物品已存在，无法重复添加！")
-                return
+        def done(changes):
+            self.apply_changes(changes)
+            self.clear_entries()
+            messagebox.showinfo("成功", f"物品“{name}”已添加成功。")
 
-            cursor.execute('''INSERT INTO items (name, description, address, contact_phone, contact_email, category, attributes) 
-                              VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                           (name, description, address, phone, email, category, json.dumps(attributes)))
-            conn.commit()
+        def failed(error):
+            if isinstance(error, DuplicateItemError):
+                messagebox.showerror("重复错误", "名称和类别相同的物品已存在，无法重复添加！")
+            elif isinstance(error, ValueError):
+                messagebox.showwarning("输入错误", str(error))
+            else:
+                show_db_error(error)
 
-        self.load_items()
-        self.clear_entries()
-        messagebox.showinfo("成功", f"物品“{name}”已添加成功。")
+        self.worker.submit(self.store.add_item, name, description, address, phone, email, category, attributes,
+                           on_done=done, on_error=failed)
 
+    @PROFILER.profile('edit_item')
     def load_selected_item_for_edit(self):
         """加载选中物品到编辑框"""
         selected = self.tree.selection()
@@ -313,49 +1146,45 @@ class ItemApp:
             messagebox.showwarning("编辑错误", "请选择要编辑的物品！")
             return
 
-        item_values = self.tree.item(selected[0], 'values')
-        name = item_values[0]
-        category = item_values[1]
+        item = self.view_store.get_item(int(selected[0]))
+        if item:
+            self.edit_item(item)
 
-        with sqlite3.connect(DB_FILE, timeout=10) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM items WHERE name = ? AND category = ?', (name, category))
-            row = cursor.fetchone()
-            if row:
-                item = Item(row[0], row[1], row[2], row[3], row[4], row[5], row[6], json.loads(row[7]))
-
-                # 填充编辑框
-                self.name_entry.delete(0, tk.END)
-                self.name_entry.insert(0, item.name)
-
-                self.description_entry.delete(0, tk.END)
-                self.description_entry.insert(0, item.description)
-
-                self.address_entry.delete(0, tk.END)
-                self.address_entry.insert(0, item.address)
-
-                self.phone_entry.delete(0, tk.END)
-                self.phone_entry.insert(0, item.contact_phone)
+    def edit_item(self, item):
+        """把物品填入编辑框并进入编辑模式；记下读取时的版本号，保存时据此检测其他用户的修改"""
+        # 填充编辑框
+        self.name_entry.delete(0, tk.END)
+        self.name_entry.insert(0, item.name)
 
-                self.email_entry.delete(0, tk.END)
-                self.email_entry.insert(0, item.contact_email)
+        self.description_entry.delete(0, tk.END)
+        self.description_entry.insert(0, item.description)
 
-                self.category_combobox.set(item.category)
-                self.update_attributes_fields(None)
+        self.address_entry.delete(0, tk.END)
+        self.address_entry.insert(0, item.address)
 
-                if item.category == "食品":
-                    self.expiry_entry.insert(0, item.attributes.get("保质期", ""))
-                    self.quantity_entry.insert(0, item.attributes.get("数量", ""))
-                elif item.category == "书籍":
-                    self.author_entry.insert(0, item.attributes.get("作者", ""))
-                    self.publisher_entry.insert(0, item.attributes.get("出版社", ""))
-                elif item.category == "工具":
-                    self.brand_entry.insert(0, item.attributes.get("品牌", ""))
-                    self.model_entry.insert(0, item.attributes.get("型号", ""))
+        self.phone_entry.delete(0, tk.END)
+        self.phone_entry.insert(0, item.contact_phone)
 
-                # 禁用“添加物品”按钮，设置为编辑模式
-                self.add_button.config(state=tk.DISABLED)
-                self.is_editing = True
+        self.email_entry.delete(0, tk.END)
+        self.email_entry.insert(0, item.contact_email)
+
+        self.category_combobox.set(item.category)
+        self.update_attributes_fields(None)
+
+        if item.category == "食品":
+            self.expiry_entry.insert(0, item.attributes.get("保质期", ""))
+            self.quantity_entry.insert(0, item.attributes.get("数量", ""))
+        elif item.category == "书籍":
+            self.author_entry.insert(0, item.attributes.get("作者", ""))
+            self.publisher_entry.insert(0, item.attributes.get("出版社", ""))
+        elif item.category == "工具":
+            self.brand_entry.insert(0, item.attributes.get("品牌", ""))
+            self.model_entry.insert(0, item.attributes.get("型号", ""))
+
+        # 禁用“添加物品”按钮，设置为编辑模式
+        self.add_button.config(state=tk.DISABLED)
+        self.is_editing = True
+        self.editing_item = item
 
     def save_edits(self):
         """保存编辑后的物品"""
@@ -381,46 +1210,59 @@ class ItemApp:
             messagebox.showwarning("输入错误", "请填写必要的字段：名称和类别！")
             return
 
-        selected = self.tree.selection()
-        if not selected:
+        item = self.editing_item
+        if item is None:
             messagebox.showwarning("保存错误", "未选择物品进行编辑！")
             return
 
-        # 从表格中获取选中的物品的 ID
-        selected_item = self.tree.item(selected[0], 'values')
-        original_name = selected_item[0]  # 获取原始名称
-        original_category = selected_item[1]  # 获取原始类别
+        def save(expected_version):
+            self.worker.submit(self.store.update_item, item.id, name, description, address, phone, email,
+                               category, attributes, expected_version, on_done=done, on_error=failed)
 
-        with sqlite3.connect(DB_FILE, timeout=10) as conn:
-            cursor = conn.cursor()
+        def done(changes):
+            self.apply_changes(changes)
+            # 清空输入框，同时退出编辑模式
+            self.clear_entries()
+            messagebox.showinfo("成功", f"物品“{name}”已更新成功。")
 
-            # 检查是否尝试修改为与现有其他物品相同的名称和类别
-            cursor.execute('SELECT id FROM items WHERE name = ? AND category = ? AND name != ? OR category != ?',
-                           (name, category, original_name, original_category))
-            conflict = cursor.fetchone()
-            if conflict:
+        def failed(error):
+            if isinstance(error, DuplicateItemError):
                 messagebox.showerror("冲突错误", "名称和类别的组合与现有物品冲突，无法保存更改！")
-                return
-
-            # 执行更新操作
-            cursor.execute('''UPDATE items
-                              SET name = ?, description = ?, address = ?, contact_phone = ?,
-                                  contact_email = ?, category = ?, attributes = ?
-                              WHERE name = ? AND category = ?''',
-                           (name, description, address, phone, email, category, json.dumps(attributes),
-                            original_name, original_category))
-            conn.commit()
-
-        self.load_items()
-        self.clear_entries()
-
-        # 重新启用“添加物品”按钮，退出编辑模式
-        self.add_button.config(state=tk.NORMAL)
-        self.is_editing = False
-        messagebox.showinfo("成功", f"物品“{name}”已更新成功。")
-
-    def search_items(self):
-        """根据类别和关键词查找物品"""
+            elif isinstance(error, ValueError):
+                messagebox.showwarning("输入错误", str(error))
+            elif isinstance(error, StaleItemError):
+                self.resolve_stale_edit(error, save)
+            else:
+                show_db_error(error)
+
+        # 只有物品自读取以来未被修改（版本号相同）才保存
+        save(item.version)
+
+    def resolve_stale_edit(self, error, save):
+        """保存时发现物品已被其他用户修改或删除：让用户选择覆盖、载入对方的修改或放弃"""
+        current = error.current
+        if current is None:
+            messagebox.showerror("保存失败", "该物品已被其他用户删除，无法保存。")
+            self.clear_entries()
+            return
+        # 表格中这一行也换成对方保存的内容
+        changes = ChangeSet()
+        changes.updated['items'].append(current.id)
+        self.apply_changes(changes)
+        choice = ask_choice(
+            self.root, "编辑冲突",
+            f"物品“{current.name}”在您编辑期间已被其他用户修改。\n"
+            "覆盖：用您的内容替换对方的修改；载入：放弃您的修改，显示对方保存的内容。",
+            (("overwrite", "覆盖"), ("reload", "载入"), (None, "取消"))
+        )
+        if choice == "overwrite":
+            save(current.version)
+        elif choice == "reload":
+            self.clear_entries()
+            self.edit_item(current)
+
+    def search_query(self):
+        """由查找栏的类别、关键词和属性筛选构造查询条件，都为空时返回 None；筛选值格式不对时抛出 ValueError"""
         category = self.search_category_combobox.get().strip()  # 获取类别
         keyword = self.search_entry.get().strip()
 
@@ -428,54 +1270,119 @@ class ItemApp:
         if category == "暂不选择":
             category = None
 
-        if not keyword and not category:
-            messagebox.showwarning("输入错误", "请输入关键词或选择类别进行查找！")
+        filters = []
+        filter_key = self.filter_key_combobox.get()
+        filter_value = self.filter_value_entry.get().strip()
+        if filter_key != "暂不选择" and filter_value:
+            # 在这里检查格式，而不是在后台查询时才报错
+            filters.append((filter_key, self.filter_operator_combobox.get(), attribute_value(filter_key, filter_value)))
+
+        # 在分类统计中选中的值
+        region = self.facet_selection.get("地区")
+        for name in ("出版社", "品牌"):
+            if name in self.facet_selection:
+                filters.append((name, "=", self.facet_selection[name]))
+        if "保质期" in self.facet_selection:
+            filters += expiry_filters(self.facet_selection["保质期"])
+
+        if not keyword and not category and not filters and not region:
+            return None
+        return self.item_view.sorted(ItemQuery(keyword=keyword, category=category, filters=filters,
+                                               fuzzy=self.fuzzy_search_var.get(), region=region))
+
+    def search_items(self):
+        """根据类别、关键词和属性筛选查找物品（立即在后台查询）"""
+        try:
+            query = self.search_query()
+        except ValueError as e:
+            messagebox.showwarning("输入错误", str(e))
+            return
+        if query is None:
+            messagebox.showwarning("输入错误", "请输入关键词、选择类别或填写属性筛选进行查找！")
             return
+        self.search_status_label.config(text="正在查找…")
+        self.live_search.schedule(query, delay=0)
 
-        # 清空现有的 TreeView 数据
-        self.tree.delete(*self.tree.get_children())
+    def on_search_input(self, event):
+        """查找栏内容变化时，防抖后自动查找"""
+        if not self.live_search_var.get():
+            return
+        try:
+            query = self.search_query()
+        except ValueError as e:
+            self.search_status_label.config(text=str(e))  # 可能还没输入完，不弹窗
+            return
+        if query is None:
+            self.clear_search()
+            return
+        self.live_search.schedule(query)
+
+    def show_search_results(self, query, kind, payload):
+        """显示后台查找的结果：先显示第一页，随后显示匹配总数和分类统计"""
+        if kind == 'page':
+            self.item_view.show_page(query, payload)
+        elif kind == 'facets':
+            self.show_facets(payload)
+        elif payload:
+            self.search_status_label.config(text=f"找到 {payload} 个匹配的物品。")
+        else:
+            self.search_status_label.config(text="没有找到匹配的物品。")
+
+    def clear_search(self):
+        """取消查找，恢复完整的物品列表"""
+        self.live_search.cancel()
+        self.search_status_label.config(text="")
+        self.facet_selection.clear()
+        self.show_facet_selection()
+        self.load_items()
 
-        # 构建动态 SQL 查询
-        query = '''
-            SELECT * FROM items WHERE 
-            (name LIKE ? OR 
-            description LIKE ? OR 
-            address LIKE ? OR 
-            contact_phone LIKE ? OR 
-            contact_email LIKE ? OR 
-            attributes LIKE ?)
-        '''
-        params = [f"%{keyword}%"] * 6  # 模糊匹配关键词
-
-        if category:  # 如果选择了类别，增加类别条件
-            query += " AND category = ?"
-            params.append(category)
-
-        # 在数据库中执行查询
-        with sqlite3.connect(DB_FILE, timeout=10) as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            results = cursor.fetchall()
-
-        # 显示搜索结果
-        if results:
-            for row in results:
-                item = Item(row[0], row[1], row[2], row[3], row[4], row[5], row[6], json.loads(row[7]))
-                self.tree.insert(
-                    '', 'end',
-                    values=(
-                        item.name,
-                        item.category,
-                        item.description,
-                        item.address,
-                        item.contact_phone,
-                        item.contact_email,
-                        json.dumps(item.attributes, ensure_ascii=False)
-                    )
-                )
-            messagebox.showinfo("查找完成", f"找到 {len(results)} 个匹配的物品。")
+    def refresh_facets(self):
+        """在后台重新统计列表当前内容的分类计数"""
+        self.live_search.refresh_facets(self.item_view.query)
+
+    def show_facets(self, facets):
+        """显示分类统计，各分面下列出值和物品数"""
+        self.facet_entries = {}
+        with PROFILER.timed('tree'):
+            self.facet_tree.delete(*self.facet_tree.get_children())
+            for name, entries in facets.items():
+                if not entries:
+                    continue
+                node = self.facet_tree.insert("", "end", text=name, open=True)
+                for value, count in entries:
+                    iid = self.facet_tree.insert(node, "end", text=f"{value}（{count}）")
+                    self.facet_entries[iid] = (name, value)
+
+    def select_facet(self, event):
+        """双击分类统计中的一项：按它缩小查找范围"""
+        entry = self.facet_entries.get(self.facet_tree.focus())
+        if entry is None:
+            return
+        name, value = entry
+        if name == "类别":
+            self.search_category_combobox.set(value)
         else:
-            messagebox.showinfo("查找完成", "没有找到匹配的物品。")
+            self.facet_selection[name] = value
+        self.show_facet_selection()
+        self.search_items()
+
+    def clear_facet_selection(self):
+        """取消在分类统计中选中的值，按查找栏其余的条件重新查找"""
+        self.facet_selection.clear()
+        self.show_facet_selection()
+        try:
+            query = self.search_query()
+        except ValueError as e:
+            self.search_status_label.config(text=str(e))
+            return
+        if query is None:
+            self.clear_search()
+        else:
+            self.live_search.schedule(query, delay=0)
+
+    def show_facet_selection(self):
+        text = "、".join(f"{name}：{value}" for name, value in self.facet_selection.items())
+        self.facet_selection_label.config(text=f"已选 {text}" if text else "")
 
     def clear_entries(self):
         """清空输入框"""
@@ -488,10 +1395,12 @@ class ItemApp:
         for widget in self.attributes_frame.winfo_children():
             widget.destroy()
 
-        # 如果处于编辑模式，退出编辑模式并启用“添加物品”按钮
+        # 如果处于编辑模式，退出编辑模式并启用“添加物品”按钮（后台操作进行中时由 set_busy 在结束后启用）
         if self.is_editing:
-            self.add_button.config(state=tk.NORMAL)
             self.is_editing = False
+            self.editing_item = None
+            if not self.worker.busy:
+                self.add_button.config(state=tk.NORMAL)
 
     def delete_item(self):
         """删除选中物品，将其移动到回收站"""
@@ -504,21 +1413,11 @@ class ItemApp:
         if not confirm:
             return
 
-        with sqlite3.connect(DB_FILE, timeout=10) as conn:
-            cursor = conn.cursor()
-            for sel in selected:
-                item_values = self.tree.item(sel, 'values')
-                name = item_values[0]
-                cursor.execute('SELECT * FROM items WHERE name = ?', (name,))
-                item = cursor.fetchone()
-                if item:
-                    cursor.execute('INSERT INTO deleted_items (name, description, address, contact_phone, contact_email, category, attributes) VALUES (?, ?, ?, ?, ?, ?, ?)', item[1:])
-                    cursor.execute('DELETE FROM items WHERE id = ?', (item[0],))
-            conn.commit()
+        def done(changes):
+            self.apply_changes(changes)
+            messagebox.showinfo("删除成功", "选中的物品已移动到回收站。")
 
-        self.load_items()
-        self.load_deleted_items()
-        messagebox.showinfo("删除成功", "选中的物品已移动到回收站。")
+        self.worker.submit(self.store.delete_items, [int(sel) for sel in selected], on_done=done)
 
     def recover_item(self):
         """从回收站恢复选中的物品"""
@@ -527,43 +1426,34 @@ class ItemApp:
             messagebox.showwarning("恢复错误", "请选择要恢复的物品！")
             return
 
-        with sqlite3.connect(DB_FILE, timeout=10) as conn:
-            cursor = conn.cursor()
-            for sel in selected:
-                item_values = self.recovery_tree.item(sel, 'values')
-                name = item_values[0]
-                category = item_values[1]
-
-                # 检查是否存在名称和类别相同的物品
-                cursor.execute('SELECT * FROM items WHERE name = ? AND category = ?', (name, category))
-                existing_item = cursor.fetchone()
-
-                cursor.execute('SELECT * FROM deleted_items WHERE name = ? AND category = ?', (name, category))
-                deleted_item = cursor.fetchone()
-
-                if deleted_item:
-                    if existing_item:
-                        # 如果已存在相同名称和类别的物品，提示用户选择是否替换
-                        replace = messagebox.askyesno(
-                            "重复物品",
-                            f"物品“{name}”（类别：{category}）已存在于列表中，是否替换？"
-                        )
-                        if not replace:
-                            continue  # 如果用户选择不替换，则跳过恢复该物品
-
-                        # 如果用户选择替换，删除现有物品
-                        cursor.execute('DELETE FROM items WHERE id = ?', (existing_item[0],))
-
-                    # 恢复物品到主物品列表
-                    cursor.execute(
-                        'INSERT INTO items (name, description, address, contact_phone, contact_email, category, attributes) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                        deleted_item[1:])
-                    cursor.execute('DELETE FROM deleted_items WHERE id = ?', (deleted_item[0],))
-            conn.commit()
+        deleted_ids = [int(sel) for sel in selected]
+        replace = False
+        # 恢复前一次性确认如何处理与主列表重名的物品，不在事务进行中弹框
+        conflicts = self.view_store.recover_conflicts(deleted_ids)
+        if conflicts:
+            choice = ask_choice(
+                self.root, "重复物品",
+                f"有 {len(conflicts)} 个物品与列表中名称和类别相同的物品冲突，如何处理？",
+                (("replace", "全部替换"), ("skip", "全部跳过"), ("each", "逐个确认"), (None, "取消"))
+            )
+            if choice is None:
+                return
+            if choice == "replace":
+                replace = True
+            elif choice == "each":
+                replace = {
+                    item.id for item, _ in conflicts
+                    if messagebox.askyesno(
+                        "重复物品",
+                        f"物品“{item.name}”（类别：{item.category}）已存在于列表中，是否替换？"
+                    )
+                }
 
-        self.load_items()
-        self.load_deleted_items()
-        messagebox.showinfo("恢复成功", "选中的物品已恢复。")
+        def done(changes):
+            self.apply_changes(changes)
+            messagebox.showinfo("恢复成功", "选中的物品已恢复。")
+
+        self.worker.submit(self.store.recover_items, deleted_ids, replace, on_done=done)
 
     def permanently_delete_item(self):
         """永久删除选中的物品"""
@@ -572,49 +1462,263 @@ class ItemApp:
             messagebox.showwarning("删除错误", "请选择要永久删除的物品！")
             return
 
-        confirm = messagebox.askyesno("确认删除", "确定要永久删除选中的物品吗？此操作无法撤销。")
+        confirm = messagebox.askyesno("确认删除", "确定要永久删除选中的物品吗？（可在“编辑”菜单中撤销）")
         if not confirm:
             return
 
-        with sqlite3.connect(DB_FILE, timeout=10) as conn:
-            cursor = conn.cursor()
-            for sel in selected:
-                item_values = self.recovery_tree.item(sel, 'values')
-                name = item_values[0]
-                cursor.execute('SELECT * FROM deleted_items WHERE name = ?', (name,))
-                item = cursor.fetchone()
-                if item:
-                    cursor.execute('DELETE FROM deleted_items WHERE id = ?', (item[0],))
-            conn.commit()
+        def done(changes):
+            self.apply_changes(changes)
+            messagebox.showinfo("删除成功", "选中的物品已永久删除。")
 
-        self.load_deleted_items()
-        messagebox.showinfo("删除成功", "选中的物品已永久删除。")
+        self.worker.submit(self.store.purge_items, [int(sel) for sel in selected], on_done=done)
 
+    def export_items(self, deleted=False):
+        """在后台线程把主列表或回收站导出为 CSV / JSON Lines 文件，状态栏显示进度"""
+        path = filedialog.asksaveasfilename(
+            title="导出回收站" if deleted else "导出物品列表",
+            defaultextension=".csv",
+            filetypes=[("CSV 文件", "*.csv"), ("JSON Lines 文件", "*.jsonl")]
+        )
+        if not path:
+            return
+
+        updates = queue.Queue()
+
+        def run():
+            try:
+                exported = export_file(self.store, path, deleted=deleted,
+                                       progress=lambda done, total: updates.put(('progress', (done, total))))
+                updates.put(('done', exported))
+            except (OSError, ValueError, sqlite3.Error) as e:
+                updates.put(('error', e))
+
+        def poll():
+            while True:
+                try:
+                    kind, payload = updates.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == 'progress':
+                    self.status_label.config(text=f"正在导出：{payload[0]}/{payload[1]}")
+                    continue
+                self.status_label.config(text="")
+                if kind == 'done':
+                    messagebox.showinfo("导出完成", f"已导出 {payload} 个物品到 {path}。")
+                else:
+                    messagebox.showerror("导出失败", str(payload))
+                return
+            self.root.after(100, poll)
+
+        threading.Thread(target=run, daemon=True).start()
+        self.status_label.config(text="正在导出…")
+        self.root.after(100, poll)
+
+    def set_retention(self):
+        """设置回收站物品的保留天数，0 表示永久保留"""
+        days = simpledialog.askinteger(
+            "回收站保留天数", "删除超过多少天的物品自动永久删除（0 表示永久保留）：",
+            initialvalue=int(self.view_store.get_setting('retention_days', 0)), minvalue=0, parent=self.root)
+        if days is None:
+            return
+
+        def done(_):
+            # 已安排的下一次清理提前到现在；为 None 时一轮清理正在后台进行（或启动后尚未安排），
+            # 它结束后照常安排下一次，不另起一条定时链
+            if self._purge_after_id is not None:
+                self.root.after_cancel(self._purge_after_id)
+                self._purge_after_id = None
+                self.purge_expired()
+
+        self.worker.submit(self.store.set_setting, 'retention_days', days, on_done=done)
+
+    def set_notice_days(self):
+        """设置到期提醒的天数，0 表示不提醒"""
+        days = simpledialog.askinteger(
+            "到期提醒天数", "保质期在多少天之内的物品提醒一次（0 表示不提醒）：",
+            initialvalue=int(self.view_store.get_setting('expiry_notice_days', EXPIRY_NOTICE_DAYS)), minvalue=0,
+            parent=self.root)
+        if days is not None:
+            self.worker.submit(self.store.set_setting, 'expiry_notice_days', days,
+                               on_done=lambda _: self.schedule_expiry(0))
+
+    def toggle_auto_expire(self):
+        """开关自动移走过期物品；打开后立即检查一次"""
+        self.worker.submit(self.store.set_setting, 'expiry_auto_move', int(self.auto_expire_var.get()),
+                           on_done=lambda _: self.schedule_expiry(0))
+
+    def show_diagnostics(self):
+        """打开性能诊断窗口（已打开时移到最前）"""
+        if self.diagnostics is not None and self.diagnostics.window.winfo_exists():
+            self.diagnostics.window.lift()
+        else:
+            self.diagnostics = DiagnosticsWindow(self.root)
+
+    def show_duplicates(self):
+        """打开重复物品窗口（已打开时移到最前）"""
+        if self.duplicates is not None and self.duplicates.window.winfo_exists():
+            self.duplicates.window.lift()
+        else:
+            self.duplicates = DuplicatesWindow(self)
+
+    def purge_expired(self):
+        """定时在后台清理回收站中超过保留期的物品，每次一小批；清理完后增量回收数据库空间"""
+        self._purge_after_id = None  # 本次的定时已触发，这一轮结束时再安排下一次
+
+        def done(changes):
+            if changes.removed['deleted_items']:
+                self.apply_changes(changes)
+                self._purge_after_id = self.root.after(self.PURGE_BATCH_INTERVAL, self.purge_expired)
+                return
+            self.worker.submit(self.search_index.save, quiet=True)
+            self.worker.submit(self.store.prune_change_log, quiet=True)
+            self.worker.submit(self.store.compact_journal, quiet=True)
+            self.worker.submit(self.store.vacuum_step, quiet=True)
+            self._purge_after_id = self.root.after(self.PURGE_INTERVAL, self.purge_expired)
+
+        self.worker.submit(self.store.purge_expired, on_done=done, quiet=True)
+
+    def schedule_expiry(self, delay):
+        """delay 毫秒后检查保质期；已安排的检查取消，始终只有一条定时链"""
+        if self._expiry_after_id is not None:
+            self.root.after_cancel(self._expiry_after_id)
+        self._expiry_after_id = self.root.after(delay, self.check_expiry)
+
+    def check_expiry(self):
+        """定时检查保质期：打开了自动移走时把过期物品分小批移入回收站，再提醒新进入提醒期的物品"""
+        def done(changes):
+            if changes.removed['items']:
+                self.apply_changes(changes)
+                self._expired_count += len(changes.removed['items'])
+                self.schedule_expiry(self.PURGE_BATCH_INTERVAL)
+                return
+            notices = [f"已将 {self._expired_count} 个过期物品移入回收站"] if self._expired_count else []
+            self._expired_count = 0
+            notice = self.due_notice()
+            if notice:
+                notices.append(notice)
+            if notices:
+                self.notice_label.config(text="；".join(notices))
+                self.root.bell()
+            self.schedule_expiry(self.EXPIRY_INTERVAL)
+
+        self._expiry_after_id = None
+        if self.auto_expire_var.get():
+            self.worker.submit(self.store.expire_items, on_done=done, quiet=True)
+        else:
+            done(ChangeSet())
+
+    @PROFILER.profile()
+    def due_notice(self):
+        """从到期队列中取出新进入提醒期的物品，返回提醒文字（没有时为 None），每个物品只提醒一次
+
+        到期队列就是主列表按 (保质期, id) 的索引：从上次提醒到的位置接着往后取，代价与新到期
+        的物品数有关，与物品总数无关。之后新增或修改、排在这个位置之前的物品另按 id 检查。
+        """
+        changed, self._due_changed = self._due_changed, set()
+        days = int(self.view_store.get_setting('expiry_notice_days', EXPIRY_NOTICE_DAYS))
+        if days <= 0:
+            return None
+        today = date.today()
+        start = (today.isoformat(), 0)
+        horizon = (today + timedelta(days=days)).isoformat()
+        if self._due_cursor is None or self._due_cursor < start:
+            # 第一次检查或过了一天：已过期的物品不再提醒
+            self._due_cursor = start
+            self._due_notified = {item_id: expires_on for item_id, expires_on in self._due_notified.items()
+                                  if expires_on >= start[0]}
+        due, reached = [], self._due_cursor
+        while True:
+            page = self.view_store.due_items(horizon, after=self._due_cursor)
+            if page:
+                due += page
+                self._due_cursor = (page[-1][0], page[-1][1].id)
+            if len(page) < DUE_LIMIT:
+                break
+        if changed:
+            due += [(expires_on, item) for expires_on, item in
+                    self.view_store.due_items(horizon, after=start, ids=changed)
+                    if (expires_on, item.id) <= reached]
+        due = [(expires_on, item) for expires_on, item in due if self._due_notified.get(item.id) != expires_on]
+        if not due:
+            return None
+        self._due_notified.update((item.id, expires_on) for expires_on, item in due)
+        due.sort(key=lambda entry: (entry[0], entry[1].id))
+        names = "、".join(item.name for _, item in due[:3])
+        return f"到期提醒：{names}{' 等' if len(due) > 3 else ''} {len(due)} 个物品将在 {days} 天内到期"
+
+    @PROFILER.profile()
+    def watch_changes(self):
+        """定时检查数据库是否被其他连接修改（PRAGMA data_version），有修改时只刷新涉及的行
+
+        本窗口自己的写入也会被检查到，重复刷新同一行是安全的。
+        """
+        version = self.view_store.data_version()
+        if version != self._data_version:
+            self._data_version = version
+            changes, self._change_seq = self.view_store.changes_since(self._change_seq)
+            if changes is None:
+                # 落后太多，修改记录已被清理
+                self.view_store.cache.clear()
+                self.item_view.reload()
+                if self.recovery_view is not None:
+                    self.recovery_view.reload()
+                self.refresh_history()
+            elif changes:
+                self.apply_changes(changes)
+        self._watch_after_id = self.root.after(self.WATCH_INTERVAL, self.watch_changes)
+
+    def apply_changes(self, changes):
+        """把一次修改涉及的行同步到物品列表和回收站，不重新加载整张表
+
+        拼音与模糊查找的索引要读取修改过的物品，在后台线程中同步，完成后再更新列表，
+        模糊查找的结果中才有这次修改；同步失败时列表照常更新。
+        """
+        self.view_store.cache.invalidate(changes)
+        self._due_changed.update(changes.added['items'] + changes.updated['items'])
+        self.worker.submit(self.search_index.sync, on_done=lambda _: self.show_changes(changes),
+                           on_error=lambda _: self.show_changes(changes), quiet=True)
+
+    def show_changes(self, changes):
+        """按修改更新物品列表、回收站、分面统计和撤销菜单"""
+        self.item_view.apply(changes)
+        if self.recovery_view is not None:
+            self.recovery_view.apply(changes)
+        self.refresh_facets()
+        self.refresh_history()
+
+    def refresh_history(self):
+        """在后台按操作日志推算撤销、重做栈（只读取新增的操作），完成后更新“编辑”菜单"""
+        self.worker.submit(self.store.history, on_done=self.show_history, quiet=True)
+
+    def show_history(self, stacks):
+        """按撤销、重做栈更新“编辑”菜单中撤销、重做的名称和可用状态"""
+        undo, redo = stacks
+        for index, (verb, stack) in enumerate((("撤销", undo), ("重做", redo))):
+            self.edit_menu.entryconfig(index, label=f"{verb}{UNDOABLE_ACTIONS[stack[-1][1]]}" if stack else verb,
+                                       state=tk.NORMAL if stack else tk.DISABLED)
+
+    def replay(self, action, event=None):
+        """撤销（action 为 'undo'）或重做（'redo'）最近一次操作，包括永久删除"""
+        if event is not None and isinstance(event.widget, (tk.Entry, ttk.Entry)):
+            return  # 输入框中的快捷键留给输入框
+        verb = "撤销" if action == 'undo' else "重做"
+
+        def done(changes):
+            self.apply_changes(changes)
+            self.status_label.config(text=f"已{verb}。" if changes else f"没有可{verb}的操作。")
+
+        def failed(error):
+            if isinstance(error, UndoConflictError):
+                messagebox.showerror(f"无法{verb}", str(error))
+            else:
+                show_db_error(error)
+
+        self.worker.submit(getattr(self.store, action), on_done=done, on_error=failed)
+
+    @PROFILER.profile()
     def load_deleted_items(self):
         """加载回收站物品"""
-        self.deleted_items.clear()
-        self.recovery_tree.delete(*self.recovery_tree.get_children())
-
-        with sqlite3.connect(DB_FILE, timeout=10) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM deleted_items')
-            for row in cursor.fetchall():
-                item = Item(row[0], row[1], row[2], row[3], row[4], row[5], row[6], json.loads(row[7]))
-                self.deleted_items.append(item)
-
-                # 按列的正确顺序插入数据
-                self.recovery_tree.insert(
-                    '', 'end',
-                    values=(
-                        item.name,  # 名称
-                        item.category,  # 类别
-                        item.description,  # 描述
-                        item.address,  # 地址
-                        item.contact_phone,  # 联系人手机
-                        item.contact_email,  # 联系人邮箱
-                        json.dumps(item.attributes, ensure_ascii=False)  # 扩展属性
-                    )
-                )
+        self.recovery_view.reload()
 
 
 if __name__ == "__main__":
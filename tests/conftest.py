@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# 各模块在仓库根目录下，直接运行 pytest 时也能导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from item_store import ItemStore  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    """临时目录中的新数据库"""
+    store = ItemStore(str(tmp_path / 'items.db'))
+    yield store
+    store.close()
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from item_server import MAX_BODY, ItemServer
+
+
+def exchange(tmp_path, *requests):
+    """启动服务，在一个连接上依次发送原始请求，返回服务关闭连接前发回的全部内容"""
+    async def run():
+        server = ItemServer(str(tmp_path / 'items.db'), readers=1)
+        listener = await server.start('127.0.0.1', 0)
+        try:
+            port = listener.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            for request in requests:
+                writer.write(request)
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            return response
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            await server.close()
+    return asyncio.run(run())
+
+
+def test_keep_alive_requests(tmp_path):
+    request = b'GET /items HTTP/1.1\r\nHost: x\r\n\r\n'
+    response = exchange(tmp_path, request, request.replace(b'Host: x', b'Connection: close'))
+    assert response.count(b'HTTP/1.1 200 OK') == 2
+
+
+@pytest.mark.parametrize('request_head', [
+    b'GARBAGE\r\n\r\n',
+    b'GET /items FTP/1.0\r\n\r\n',
+    b'POST /items HTTP/1.1\r\nContent-Length: abc\r\n\r\n',
+    b'POST /items HTTP/1.1\r\nContent-Length: -5\r\n\r\n',
+    b'GET /items HTTP/1.1\r\nno colon here\r\n\r\n',
+])
+def test_malformed_request_gets_400(tmp_path, request_head):
+    response = exchange(tmp_path, request_head)
+    assert response.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+    assert b'Connection: close' in response
+
+
+def test_oversized_body_gets_413_without_reading_it(tmp_path):
+    # 只发送请求头：服务不等待请求体就回复并关闭连接
+    head = f'POST /items HTTP/1.1\r\nContent-Length: {MAX_BODY + 1}\r\n\r\n'.encode()
+    response = exchange(tmp_path, head)
+    assert response.startswith(b'HTTP/1.1 413 Payload Too Large\r\n')
+    assert b'Connection: close' in response
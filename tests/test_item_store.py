@@ -0,0 +1,203 @@
+import json
+import sqlite3
+from datetime import date
+
+from item_store import FACET_VALUES, FACETS, ItemQuery, ItemStore
+
+
+def record(name, category, description='', address='', attributes=None):
+    return name, description, address, '', '', category, attributes or {}
+
+
+def items(store):
+    """主列表中的物品：{(名称, 类别): (描述, 扩展属性)}"""
+    return {(item.name, item.category): (item.description, item.attributes) for item in store.list_items()}
+
+
+def facet_truth(store):
+    """直接对 items 做 GROUP BY 得到的类别、地区、出版社和品牌计数"""
+    truth = {}
+    for name, column in FACETS.items():
+        if name == "保质期":
+            continue
+        rows = store._conn.execute(f"SELECT {column}, COUNT(*) FROM items WHERE deleted_at IS NULL "
+                                   f"AND coalesce({column}, '') != '' GROUP BY {column}").fetchall()
+        truth[name] = dict(rows)
+    return truth
+
+
+def assert_facets_consistent(store):
+    facets = store.facets(ItemQuery())
+    for name, counts in facet_truth(store).items():
+        assert dict(facets[name]) == counts, name
+    # facet_counts 汇总表与逐行统计一致，且没有残留的负数
+    columns = ', '.join(FACETS.values())
+    summary = store._conn.execute(f'SELECT {columns}, count FROM facet_counts WHERE count != 0 '
+                                  f'ORDER BY {columns}').fetchall()
+    grouped = store._conn.execute(f"SELECT {FACET_VALUES.format('items')}, COUNT(*) FROM items "
+                                  f"WHERE deleted_at IS NULL GROUP BY {columns} ORDER BY {columns}").fetchall()
+    assert summary == grouped
+
+
+def test_import_merges_duplicates_in_one_batch(store):
+    store.add_item('台灯', '旧的', '', '', '', '电器', {"品牌": "甲"})
+    records = [
+        record('大米', '食品', '第一条', attributes={"品牌": "乙"}),
+        record('台灯', '电器', '覆盖现有', attributes={"品牌": "丙"}),
+        record('大米', '食品', '第二条', attributes={"品牌": "丁"}),
+        record('面粉', '食品'),
+    ]
+    assert store.import_items(records) == 3
+    assert items(store) == {
+        ('台灯', '电器'): ('覆盖现有', {"品牌": "丙"}),
+        ('大米', '食品'): ('第二条', {"品牌": "丁"}),
+        ('面粉', '食品'): ('', {}),
+    }
+    assert_facets_consistent(store)
+    assert [item.name for item in store.search_items('第二条')] == ['大米']
+    assert store.search_items('第一条') == []
+
+
+def test_import_skip_keeps_first_duplicate(store):
+    records = [record('大米', '食品', '第一条'), record('大米', '食品', '第二条')]
+    assert store.import_items(records, on_duplicate='skip') == 1
+    assert items(store) == {('大米', '食品'): ('第一条', {})}
+    assert_facets_consistent(store)
+
+
+def test_import_undo_redo_with_duplicates(store):
+    store.add_item('台灯', '旧的', '', '', '', '电器', {})
+    records = [record('大米', '食品', '第一条'), record('台灯', '电器', '新的'), record('大米', '食品', '第二条')]
+    store.import_items(records)
+    imported = items(store)
+    undo, _ = store.history()
+    assert undo[-1][1] == 'import'
+
+    store.undo()
+    assert items(store) == {('台灯', '电器'): ('旧的', {})}
+    assert_facets_consistent(store)
+
+    store.redo()
+    assert items(store) == imported
+    assert_facets_consistent(store)
+
+
+def test_facets_match_group_by(store):
+    store.import_items([
+        record('大米', '食品', address='北京市海淀区', attributes={"品牌": "甲", "保质期": "2000-01-01"}),
+        record('面粉', '食品', address='北京市朝阳区', attributes={"品牌": "甲"}),
+        record('小说', '书籍', address='广东省广州市', attributes={"出版社": "人民文学"}),
+        record('台灯', '电器', address='', attributes={"品牌": "乙", "保质期": "2999-01-01"}),
+    ])
+    lamp = store.search_items('台灯')[0]
+    store.update_item(lamp.id, '台灯', '', '上海市', '', '', '电器', {"品牌": "甲"}, lamp.version)
+    store.delete_items([store.search_items('面粉')[0].id])
+    assert_facets_consistent(store)
+
+    facets = store.facets(ItemQuery(), today=date(2020, 1, 1))
+    assert dict(facets["品牌"]) == {"甲": 2}
+    assert dict(facets["地区"]) == {"北京市": 1, "广东省": 1, "上海市": 1}
+    assert dict(facets["保质期"]) == {"已过期": 1}
+    # 带关键词的查询走 GROUP BY，与汇总表的结果一致
+    assert store.facets(ItemQuery(keyword='大米'))["类别"] == [("食品", 1)]
+
+
+def test_undo_redo_round_trip(store):
+    store.add_item('大米', '', '', '', '', '食品', {"数量": 5})
+    rice = store.search_items('大米')[0]
+    store.update_item(rice.id, '大米', '五斤', '', '', '', '食品', {"数量": 3}, rice.version)
+    store.delete_items([rice.id])
+    assert items(store) == {}
+    assert [action for _, action in store.history()[0]] == ['add', 'update', 'delete']
+
+    store.undo()
+    assert items(store) == {('大米', '食品'): ('五斤', {"数量": 3})}
+    store.undo()
+    assert items(store) == {('大米', '食品'): ('', {"数量": 5})}
+    store.undo()
+    assert items(store) == {}
+    assert store.history()[0] == []
+    assert [action for _, action in store.history()[1]] == ['delete', 'update', 'add']
+
+    for _ in range(3):
+        store.redo()
+    assert items(store) == {}
+    assert store.history()[1] == []
+    store.undo()
+    assert items(store) == {('大米', '食品'): ('五斤', {"数量": 3})}
+    assert_facets_consistent(store)
+
+
+def test_migrate_baseline_database(tmp_path):
+    path = str(tmp_path / 'baseline.db')
+    conn = sqlite3.connect(path)
+    for table in ('items', 'deleted_items'):
+        conn.execute(f'''CREATE TABLE {table} (
+                             id INTEGER PRIMARY KEY AUTOINCREMENT,
+                             name TEXT,
+                             description TEXT,
+                             address TEXT,
+                             contact_phone TEXT,
+                             contact_email TEXT,
+                             category TEXT,
+                             attributes TEXT
+                         )''')
+    conn.execute('INSERT INTO items (name, description, address, contact_phone, contact_email, category, attributes) '
+                 'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                 ('大米', '五斤装', '北京市海淀区', '13800000000', 'a@example.com', '食品',
+                  json.dumps({"保质期": "2030-01-01", "品牌": "甲"}, ensure_ascii=False)))
+    conn.execute('INSERT INTO deleted_items (name, description, address, contact_phone, contact_email, category, '
+                 'attributes) VALUES (?, ?, ?, ?, ?, ?, ?)', ('旧书', '', '', '', '', '书籍', '{}'))
+    conn.commit()
+    conn.close()
+
+    store = ItemStore(path)
+    try:
+        assert store._execute('PRAGMA user_version').fetchone()[0] == len(ItemStore.MIGRATIONS) == 12
+        assert items(store) == {('大米', '食品'): ('五斤装', {"保质期": "2030-01-01", "品牌": "甲"})}
+        assert [item.name for item in store.list_deleted_items()] == ['旧书']
+        assert [item.name for item in store.search_items('五斤')] == ['大米']
+        assert_facets_consistent(store)
+        store.add_item('面粉', '', '', '', '', '食品', {})
+        assert [action for _, action in store.history()[0]] == ['add']
+    finally:
+        store.close()
+
+    # 再次打开时已是最新结构
+    store = ItemStore(path)
+    try:
+        assert len(store.list_items()) == 2
+    finally:
+        store.close()
+
+
+def test_import_redo_after_later_batch_overwrites_earlier_rows(store):
+    store.add_item('台灯', '旧的', '', '', '', '电器', {"品牌": "甲"})
+    records = [
+        record('大米', '食品', '第一批', attributes={"品牌": "乙"}),
+        record('面粉', '食品'),
+        # 第二批覆盖第一批刚新增的大米，第三批覆盖导入前已有的台灯和第二批的大米
+        record('大米', '食品', '第二批', attributes={"品牌": "丙"}),
+        record('小说', '书籍'),
+        record('台灯', '电器', '新的'),
+        record('大米', '食品', '第三批'),
+    ]
+    store.import_items(records, batch_size=2)
+    imported = items(store)
+    assert imported[('大米', '食品')] == ('第三批', {})
+    # 三个批次作为一次操作撤销和重做
+    assert [action for _, action in store.history()[0]] == ['add', 'import']
+
+    store.undo()
+    assert items(store) == {('台灯', '电器'): ('旧的', {"品牌": "甲"})}
+    assert_facets_consistent(store)
+
+    store.redo()
+    assert items(store) == imported
+    assert_facets_consistent(store)
+
+    # 重做之后仍可再次撤销和重做
+    store.undo()
+    store.redo()
+    assert items(store) == imported
+    assert [item.name for item in store.search_items('第三批')] == ['大米']